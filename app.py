@@ -1,25 +1,42 @@
 import os
+import sys
 import tempfile
 import uuid
 import json
 import re
 import logging
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, Response, make_response
+from datetime import datetime, timedelta
+from flask import Flask, render_template, request, jsonify, session, Response, make_response, stream_with_context, send_file
 from flask_wtf.csrf import CSRFProtect
 from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
 import traceback
-import html
-import difflib
+import hashlib
+import io
+import zipfile
+import mimetypes
+import click
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Import refactored modules and database models
 from modules.chat import ChatModule
 from modules.testing import TestingModule
 from modules.coding import CodingModule
 from modules.fa_transcriber import FATranscriberModule  # Import the new module
-from database import db, ChatSession, ChatMessage, Script, ScriptVersion, TestCase, TestResult
+from modules.llm_gateway import get_gateway
+from modules.chat_context import ChatContextBuilder
+from modules.jobs import JobQueue, JobError
+from modules.llm_usage import LLMUsageRecorder
+from modules.blob_store import create_blob_store
+from modules.ecu_graph import EcuGraph
+from modules.transcription_export import TranscriptionExporter, EXPORT_FORMATS
+from modules.diff_engine import DiffEngine
+from modules.search_index import SearchIndex
+from database import db, upgrade_schema, unit_of_work, bulk_insert, script_version_cache, ChatSession, ChatMessage, Script, ScriptVersion, TestCase, TestResult
 from database import Image, FATranscription, FATranscriptionItem  # Import new models
+from database import Job, LLMUsage
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from config import config
 
 # Load environment variables
@@ -42,6 +59,33 @@ logger = logging.getLogger(__name__)
 # Setup database
 db.init_app(app)
 
+# Chat history is trimmed to a token budget, older turns are summarized
+chat_context = ChatContextBuilder(app.config)
+
+# Background jobs for slow LLM calls and test execution (handlers registered below the routes)
+job_queue = JobQueue(app)
+
+# Per-call LLM usage rows (fed by the gateway's metrics)
+llm_usage_recorder = LLMUsageRecorder(app)
+
+# Uploaded image bytes live here instead of the images table (None keeps them in the database)
+blob_store = create_blob_store(app.config, os.path.join(app.instance_path, 'blobs'))
+
+# ECU-to-ECU edge index over transcription items, kept current as transcriptions are saved
+ecu_graph = EcuGraph(app.config)
+
+# Streams transcription items as CSV / NDJSON / XLSX downloads
+transcription_exporter = TranscriptionExporter(app.config)
+
+# Script versions between checkpoints are stored as deltas and rebuilt through this LRU
+script_version_cache.maxsize = app.config.get('SCRIPT_VERSION_CACHE_SIZE', 128)
+
+# Script diffs (unified / side-by-side / JSON hunks), memoized per text or version pair
+diff_engine = DiffEngine(app.config)
+
+# Full-text index over scripts, versions, chat messages and transcription items (created by init-db)
+search_index = SearchIndex(app.config)
+
 # Setup CSRF protection
 csrf = CSRFProtect(app)
 
@@ -53,6 +97,10 @@ try:
     logger.debug(f"Attempting to initialize modules with config: {app.config}")
     logger.info(f"Found OPENROUTER_API_KEY in app.config: {'*' * 5 + app.config.get('OPENROUTER_API_KEY')[-4:] if app.config.get('OPENROUTER_API_KEY') else 'Not Found'}")
     
+    logger.info("Initializing shared LLM gateway...")
+    llm_gateway = get_gateway(app.config, app.instance_path)
+    llm_gateway.metrics.add_listener(llm_usage_recorder)
+    
     logger.info("Initializing ChatModule...")
     chat_module = ChatModule(app.config)
     logger.info("ChatModule initialized successfully.")
@@ -71,42 +119,79 @@ try:
     
 except ValueError as e:
     logger.error(f"ValueError during module initialization: {e}. Ensure OPENROUTER_API_KEY is set.", exc_info=True)
+    llm_gateway = None
     chat_module = None
     fa_transcriber_module = None
     coding_module = None
     testing_module = None
 except Exception as e:
     logger.error(f"Unexpected Exception during module initialization: {e}", exc_info=True)
+    llm_gateway = None
     chat_module = None
     fa_transcriber_module = None
     coding_module = None
     testing_module = None
 
-# Helper function to generate HTML diff
-def generateDiffHtml(original, modified):
-    """Generate HTML diff between original and modified text"""
-    if original == modified:
-        return "<div class='bg-yellow-100 p-2 rounded'>No changes made - code is identical.</div>"
-    
-    diff = difflib.unified_diff(
-        original.splitlines(keepends=False),  
-        modified.splitlines(keepends=False),  
-        n=3
+# Helper function to format a Server-Sent Event
+def sse_event(payload):
+    """Serialize a dict as a single SSE 'data:' event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+# Helper function to wrap a generator as an SSE response
+def sse_response(generator):
+    """Stream a generator of SSE events, keeping the request context alive"""
+    return Response(
+        stream_with_context(generator),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Disable proxy buffering so chunks reach the browser immediately
+        }
     )
-    
-    html_diff = []
-    for line in diff:
-        line_html = html.escape(line)
-        if line.startswith('+'):
-            html_diff.append(f"<div class='diff-line-added'>{line_html}</div>")
-        elif line.startswith('-'):
-            html_diff.append(f"<div class='diff-line-removed'>{line_html}</div>")
-        elif line.startswith('@@'):
-            html_diff.append(f"<div class='diff-line-info bg-blue-100 text-blue-800'>{line_html}</div>")
-        else:
-            html_diff.append(f"<div class='diff-line'>{line_html}</div>")
-    
-    return f"<div class='font-mono text-sm whitespace-pre-wrap'>{''.join(html_diff)}</div>"
+
+# Helper function to check whether the client asked for background processing
+def wants_async(data=None):
+    """True if the request asks to run as a background job (?async=true or "async": true in the body)"""
+    if request.args.get('async', '').lower() == 'true':
+        return True
+    return bool(data and data.get('async'))
+
+# Helper function to queue a job and point the client at its status
+def submit_job(kind, payload):
+    """Queue a background job and return a 202 response with its status/result URLs"""
+    job = job_queue.submit(kind, payload)
+    return jsonify({
+        "success": True,
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "result_url": f"/api/jobs/{job.id}/result"
+    }), 202
+
+# Helper function to run a route's worker function as a job handler
+def job_handler(run):
+    """Adapt a run_* function returning (body, status) into a job handler taking the payload as kwargs"""
+    def handle(payload, ctx):
+        body, status = run(**payload)
+        if status >= 400:
+            raise JobError(body.get('error', 'Job failed'), result=body)
+        return body
+    return handle
+
+# Start job workers at start-up so queued jobs resume before any request arrives.
+# Not for CLI commands other than `flask run` (e.g. init-db), nor in the debug reloader's watcher process
+def should_start_job_workers():
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':  # the reloader's serving child
+        return True
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        args = sys.argv[1:]
+        if 'run' not in args:
+            return False
+        reloading = (app.debug or '--debug' in args or '--reload' in args) and '--no-reload' not in args
+        return not reloading
+    if __name__ == '__main__':
+        return not app.debug
+    return True  # imported by a WSGI server
 
 # Home route
 @app.route('/')
@@ -165,22 +250,24 @@ def send_chat_message():
             logger.info(f"Creating new DB record for chat session: {session_id}")
             chat_db_session = ChatSession(session_id=session_id)
             db.session.add(chat_db_session)
-            # We need the ID, so commit here
-            db.session.commit() 
+            # We need the ID; flushed here, committed with the user message below
+            db.session.flush()
             logger.info(f"Created ChatSession DB ID: {chat_db_session.id}")
         else:
              logger.debug(f"Found existing ChatSession DB ID: {chat_db_session.id}")
 
-        # Save user message to DB *before* calling the model
+        # Save user message to DB *before* calling the model (one commit with a new session row)
         user_msg = ChatMessage(session_id=chat_db_session.id, role='user', content=message)
         db.session.add(user_msg)
         db.session.commit()
         logger.debug(f"Saved user ChatMessage ID: {user_msg.id}")
 
-        # Get history from DB for context (make sure it's ordered correctly)
-        db_history = ChatMessage.query.filter_by(session_id=chat_db_session.id).order_by(ChatMessage.created_at.asc()).all()
-        # Format for the model: list of {'role': str, 'content': str}
-        history_for_model = [{'role': msg.role, 'content': msg.content} for msg in db_history]
+        # Get the newest turns that fit the token budget (plus the rolling summary) for context.
+        # The message just saved is excluded because ChatModule appends it itself.
+        history_for_model = chat_context.build(chat_db_session, exclude_message_id=user_msg.id)
+
+        if request.args.get('stream', '').lower() == 'true':
+            return sse_response(stream_chat_response(message, history_for_model, chat_db_session.id, session_id))
 
         # Call refactored chat method (non-streaming)
         logger.debug(f"Calling chat_module.get_response for session ID: {session_id}")
@@ -202,6 +289,7 @@ def send_chat_message():
         db.session.add(assistant_msg)
         db.session.commit()
         logger.debug(f"Saved assistant ChatMessage ID: {assistant_msg.id}")
+        queue_chat_summary_fold(chat_db_session.id)
 
         return jsonify({
             "success": True, 
@@ -215,6 +303,61 @@ def send_chat_message():
         db.session.rollback()
         return jsonify({"success": False, "error": str(e), "message": "Failed to send message"}), 500
 
+def queue_chat_summary_fold(chat_db_session_id):
+    """Queue a background job folding turns that slid out of the context window into the session summary"""
+    if not chat_context.summary_enabled:
+        return
+    try:
+        chat_db_session = db.session.get(ChatSession, chat_db_session_id)
+        if not chat_db_session or not chat_context.needs_fold(chat_db_session):
+            return
+        # One fold per session at a time; turns still left over are picked up after the next reply
+        payload = {"chat_db_session_id": chat_db_session_id}
+        pending = Job.query.filter(Job.kind == 'chat.fold_summary', Job.status.in_(('queued', 'running')),
+                                   Job.payload == json.dumps(payload)).first()
+        if not pending:
+            job_queue.submit('chat.fold_summary', payload)
+    except Exception as e:
+        logger.error(f"Error queueing chat summary fold for session DB ID {chat_db_session_id}: {e}")
+        db.session.rollback()
+
+def handle_chat_summary_fold(payload, ctx):
+    chat_db_session = db.session.get(ChatSession, payload["chat_db_session_id"])
+    folded = bool(chat_db_session) and chat_context.fold(chat_db_session, chat_module.summarize_history)
+    return {"success": True, "folded": folded}
+
+def stream_chat_response(message, history_for_model, chat_db_session_id, session_id):
+    """Forward model tokens as SSE events, then persist the full assistant message"""
+    yield sse_event({"initializing": True})
+
+    chunks = []
+    try:
+        logger.debug(f"Calling chat_module.stream_response for session ID: {session_id}")
+        for chunk in chat_module.stream_response(message, chat_history=history_for_model):
+            chunks.append(chunk)
+            yield sse_event({"chunk": chunk})
+    except Exception as e:
+        logger.error(f"Error while streaming chat response: {e}")
+        logger.error(traceback.format_exc())
+        yield sse_event({"error": f"OpenRouter API Error: {e}"})
+        return
+
+    assistant_response = ''.join(chunks).strip()
+    try:
+        # --- Database Interaction: Save Assistant Response once the stream has ended ---
+        assistant_msg = ChatMessage(session_id=chat_db_session_id, role='assistant', content=assistant_response)
+        db.session.add(assistant_msg)
+        db.session.commit()
+        logger.debug(f"Saved streamed assistant ChatMessage ID: {assistant_msg.id}")
+    except Exception as e:
+        logger.error(f"Error saving streamed assistant message: {e}")
+        db.session.rollback()
+        yield sse_event({"error": "Response was generated but could not be saved."})
+        return
+    queue_chat_summary_fold(chat_db_session_id)
+
+    yield sse_event({"done": True, "session_id": session_id})
+
 # Chat API - Get History
 @app.route('/api/chat/history', methods=['GET'])
 def get_chat_history():
@@ -263,6 +406,9 @@ def clear_chat_history():
         logger.info(f"Clearing chat history for session ID: {session_id} (DB ID: {chat_db_session.id})")
         # Delete associated messages
         num_deleted = ChatMessage.query.filter_by(session_id=chat_db_session.id).delete()
+        # The rolling summary describes the deleted messages, so drop it too
+        chat_db_session.summary = None
+        chat_db_session.summary_upto_id = None
         # Optional: Delete the ChatSession row itself? 
         # db.session.delete(chat_db_session) 
         db.session.commit()
@@ -276,6 +422,11 @@ def clear_chat_history():
         db.session.rollback() # Rollback in case of error
         return jsonify({"success": False, "error": str(e), "message": "Failed to clear chat history"}), 500
 
+ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+
+def allowed_image(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
+
 # FA Transcriber API - Upload Image and Transcribe
 @app.route('/api/fa-transcriber/transcribe', methods=['POST'])
 def transcribe_image():
@@ -290,9 +441,7 @@ def transcribe_image():
         return jsonify({"success": False, "error": "No selected image file"}), 400
         
     # Check file type
-    allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
-    if '.' not in image_file.filename or \
-       image_file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
+    if not allowed_image(image_file.filename):
         return jsonify({
             "success": False, 
             "error": "Invalid file type. Allowed types: png, jpg, jpeg, gif, bmp, webp"
@@ -303,62 +452,350 @@ def transcribe_image():
         image_data = image_file.read()
         content_type = image_file.content_type or 'image/jpeg'  # Fallback if content_type not available
         
-        # Save the image to the database
-        new_image = Image(
-            filename=image_file.filename,
-            data=image_data,
-            content_type=content_type
-        )
-        db.session.add(new_image)
+        # Identical uploads share one Image row, keyed by content hash
+        image = get_or_create_images([(image_file.filename, image_data, content_type)])[0]
+        
+        # Re-uploads of an already transcribed sheet return the stored items unless forced
+        force = request.args.get('force', request.form.get('force', '')).lower() == 'true'
+        transcription = None if force else find_transcription(image.id, fa_transcriber_module.model)
+        if transcription:
+            logger.info(f"Reusing FATranscription {transcription.id} for image {image.id}")
+        
+        tiling = requested_tiling()
+        if wants_async(request.form) and not transcription:
+            # A new image row is committed together with the job
+            return submit_job('fa_transcriber.transcribe', {"image_id": image.id, "tiling": tiling})
+        
+        # Commit a new upload now rather than holding the write transaction through the model call
         db.session.commit()
-        logger.info(f"Saved new image with ID: {new_image.id}")
+        
+        if request.args.get('stream', '').lower() == 'true':
+            return sse_response(stream_fa_transcription(image.id, tiling, cached=transcription))
+        
+        if transcription:
+            return jsonify(transcription_result(image, transcription, transcription.items.all(), cached=True)), 200
+        
+        body, status = run_fa_transcription(image.id, tiling)
+        return jsonify(body), status
+        
+    except Exception as e:
+        logger.error(f"Error in transcribe_image API: {e}")
+        logger.error(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+def requested_tiling():
+    """Per-request tiling override: tiled=true/false maps to 'always'/'never', otherwise None (FA_TILING)"""
+    tiled = request.args.get('tiled', request.form.get('tiled', '')).lower()
+    if tiled in ('true', 'false'):
+        return 'always' if tiled == 'true' else 'never'
+    return None
+
+def get_or_create_images(uploads):
+    """Return the stored Image for each (filename, bytes, content_type) upload, adding rows for new content
+
+    New rows are flushed (so they have ids) but not committed; the caller
+    commits them as part of its unit of work. This must be the request's
+    first write, since losing the unique-index race rolls the session back.
+    """
+    hashed = [(hashlib.sha256(image_data).hexdigest(), filename, image_data, content_type)
+              for filename, image_data, content_type in uploads]
+    for attempt in range(2):
+        images = {image.sha256: image for image in Image.query.filter(Image.sha256.in_({entry[0] for entry in hashed}))}
+        created = 0
+        for sha256, filename, image_data, content_type in hashed:
+            if sha256 in images:
+                continue
+            image = Image(filename=filename, content_type=content_type, sha256=sha256)
+            if blob_store:
+                image.blob_key = blob_store.put(image_data, sha256)
+            else:
+                image.data = image_data
+            db.session.add(image)
+            images[sha256] = image
+            created += 1
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # A concurrent upload of the same bytes won the unique index; look again to pick up its row
+            db.session.rollback()
+            if attempt:
+                raise
+            continue
+        logger.info(f"Stored {created} new images; {len(hashed) - created} uploads matched existing images")
+        return [images[entry[0]] for entry in hashed]
+
+def load_image_data(image):
+    """Bytes of a stored image, from the blob store or the images table"""
+    if image.blob_key:
+        if not blob_store:
+            raise RuntimeError(f"Image {image.id} is in the blob store but no blob store is configured")
+        return blob_store.get(image.blob_key)
+    return image.data
+
+def find_transcription(image_id, model):
+    """Latest transcription of an image by the given model, if any"""
+    return FATranscription.query.filter_by(image_id=image_id, model=model) \
+        .order_by(FATranscription.processed_at.desc(), FATranscription.id.desc()).first()
+
+def transcription_result(image, transcription, items, cached=False):
+    return {
+        "success": True,
+        "image_id": image.id,
+        "transcription_id": transcription.id,
+        "model": transcription.model,
+        "cached": cached,
+        "items": [item.to_dict() for item in items]
+    }
+
+def run_fa_transcription(image_id, tiling=None):
+    """Transcribe a stored image and persist its items; returns (body, status)"""
+    try:
+        image = db.session.get(Image, image_id)
+        if not image:
+            return {"success": False, "error": "Image not found"}, 404
         
         # Transcribe the image
-        result = fa_transcriber_module.transcribe_image(image_data, image_file.filename, content_type)
+        result = fa_transcriber_module.transcribe_image(load_image_data(image), image.filename, image.content_type, tiling)
         
         if not result["success"]:
             logger.error(f"Failed to transcribe image: {result.get('error')}")
-            return jsonify(result), 500
+            return result, 500
         
-        # Create a transcription record
-        transcription = FATranscription(image_id=new_image.id)
-        db.session.add(transcription)
-        db.session.commit()
-        logger.info(f"Created FATranscription with ID: {transcription.id}")
-        
-        # Create transcription items
-        items = []
-        for item_data in result["data"]:
-            transcription_item = FATranscriptionItem(
-                transcription_id=transcription.id,
-                sheet_name=item_data.get("sheet_name"),
-                message=item_data.get("message"),
-                start_ecu=item_data.get("start_ecu"),
-                end_ecu=item_data.get("end_ecu"),
-                sending_ecu=item_data.get("sending_ecu"),
-                receiving_ecu=item_data.get("receiving_ecu"),
-                dashed_line=item_data.get("dashed_line")
-            )
-            db.session.add(transcription_item)
-            items.append(transcription_item)
-        
-        db.session.commit()
-        logger.info(f"Created {len(items)} FATranscriptionItems for transcription ID: {transcription.id}")
+        # Save the transcription record and all of its items in one transaction
+        with unit_of_work():
+            transcription = FATranscription(image_id=image.id, model=fa_transcriber_module.model)
+            db.session.add(transcription)
+            db.session.flush()
+            fields = ("sheet_name", "message", "start_ecu", "end_ecu", "sending_ecu", "receiving_ecu", "dashed_line")
+            items = bulk_insert(FATranscriptionItem, [
+                dict({field: item_data.get(field) for field in fields}, transcription_id=transcription.id)
+                for item_data in result["data"]
+            ])
+            ecu_graph.index_items(transcription, items)
+            # Build the response before the commit expires the new objects (reading them after would reload each row)
+            body = transcription_result(image, transcription, items)
+        logger.info(f"Created FATranscription with ID: {body['transcription_id']} and {len(items)} items")
         
         # Return the transcription data
-        return jsonify({
-            "success": True,
-            "image_id": new_image.id,
-            "transcription_id": transcription.id,
-            "items": [item.to_dict() for item in items]
-        })
+        for key in ("tiles", "warning"):
+            if key in result:
+                body[key] = result[key]
+        return body, 200
         
     except Exception as e:
-        logger.error(f"Error in transcribe_image API: {e}")
+        logger.error(f"Error in run_fa_transcription: {e}")
+        logger.error(traceback.format_exc())
+        db.session.rollback()
+        return {"success": False, "error": str(e)}, 500
+
+def stream_fa_transcription(image_id, tiling=None, cached=None):
+    """Send transcription rows to the client as SSE events, saving each FATranscriptionItem as it arrives"""
+    if cached:
+        items = cached.items.all()
+        yield sse_event({"image_id": image_id, "transcription_id": cached.id, "cached": True})
+        for item in items:
+            yield sse_event({"item": item.to_dict()})
+        yield sse_event({"done": True, "success": True, "image_id": image_id, "transcription_id": cached.id,
+                         "model": cached.model, "cached": True, "count": len(items)})
+        return
+    
+    image = db.session.get(Image, image_id)
+    transcription = FATranscription(image_id=image.id, model=fa_transcriber_module.model)
+    db.session.add(transcription)
+    db.session.commit()
+    logger.info(f"Created FATranscription with ID: {transcription.id} (streaming)")
+    yield sse_event({"image_id": image.id, "transcription_id": transcription.id, "cached": False})
+    
+    count = 0
+    info = {}
+    try:
+        for kind, payload in fa_transcriber_module.stream_transcription(load_image_data(image), image.content_type, tiling):
+            if kind == 'done':
+                info = payload
+                continue
+            if kind == 'reset':
+                # The whole-sheet answer was cut off and the sheet is transcribed again tiled: drop the rows so far
+                transcription.ecu_edges.delete(synchronize_session=False)
+                transcription.items.delete(synchronize_session=False)
+                db.session.commit()
+                count = 0
+                yield sse_event(dict(payload, reset=True))
+                continue
+            item = FATranscriptionItem(transcription_id=transcription.id, **payload)
+            db.session.add(item)
+            db.session.flush()
+            ecu_graph.index_items(transcription, [item], replace_older=False)
+            db.session.commit()
+            count += 1
+            yield sse_event({"item": item.to_dict()})
+    except GeneratorExit:
+        # Client went away: an incomplete transcription must not be handed out to later uploads
+        logger.info(f"Client disconnected during transcription stream; discarding FATranscription {transcription.id}.")
+        discard_transcription(transcription.id)
+        raise
+    except Exception as e:
+        logger.error(f"Error while streaming transcription: {e}")
+        logger.error(traceback.format_exc())
+        discard_transcription(transcription.id)
+        yield sse_event({"success": False, "error": f"Transcription failed: {e}"})
+        return
+    
+    # Only now that the new transcription is complete may it replace the image's older edges
+    ecu_graph.drop_superseded(transcription)
+    db.session.commit()
+    logger.info(f"Streamed {count} FATranscriptionItems for transcription ID: {transcription.id}")
+    yield sse_event(dict(info, done=True, success=True, image_id=image.id, transcription_id=transcription.id,
+                         model=transcription.model, cached=False, count=count))
+
+def discard_transcription(transcription_id):
+    """Delete a partially streamed transcription and its items"""
+    try:
+        db.session.rollback()
+        transcription = db.session.get(FATranscription, transcription_id)
+        if transcription:
+            db.session.delete(transcription)
+            db.session.commit()
+    except Exception as e:
+        logger.error(f"Failed to discard FATranscription {transcription_id}: {e}")
+        db.session.rollback()
+
+# FA Transcriber API - Batch Transcribe (many image files and/or zip archives)
+@app.route('/api/fa-transcriber/transcribe/batch', methods=['POST'])
+def transcribe_batch():
+    if not fa_transcriber_module:
+        return jsonify({"success": False, "error": "FA Transcriber module not initialized. Check API key."}), 500
+    
+    uploads = request.files.getlist('images') + request.files.getlist('archive')
+    if not uploads:
+        return jsonify({"success": False, "error": "No image files or zip archive provided"}), 400
+    
+    try:
+        try:
+            sheets = collect_batch_images(uploads)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        if not sheets:
+            return jsonify({"success": False, "error": "No images found. Allowed types: png, jpg, jpeg, gif, bmp, webp (or a zip of them)"}), 400
+        
+        images = get_or_create_images([
+            (filename, image_data, mimetypes.guess_type(filename)[0] or 'image/jpeg') for filename, image_data in sheets
+        ])
+        entries = [{"image_id": image.id, "filename": filename} for image, (filename, _) in zip(images, sheets)]
+        logger.info(f"Batch transcription of {len(entries)} sheets")
+        
+        force = request.args.get('force', request.form.get('force', '')).lower() == 'true'
+        tiling = requested_tiling()
+        if wants_async(request.form):
+            # New image rows are committed together with the job
+            return submit_job('fa_transcriber.batch', {"entries": entries, "force": force, "tiling": tiling})
+        
+        # One commit for all new uploads before the sheets fan out to worker threads
+        db.session.commit()
+        body, status = run_fa_batch(entries, force, tiling)
+        return jsonify(body), status
+    
+    except Exception as e:
+        logger.error(f"Error in transcribe_batch API: {e}")
         logger.error(traceback.format_exc())
         db.session.rollback()
         return jsonify({"success": False, "error": str(e)}), 500
 
+def collect_batch_images(uploads):
+    """Return (filename, bytes) for each image upload and each image inside uploaded zips"""
+    max_files = app.config.get('FA_BATCH_MAX_FILES', 100)
+    max_bytes = app.config.get('FA_BATCH_MAX_BYTES', 200 * 1024 * 1024)
+    sheets = []
+    total_bytes = 0
+    for upload in uploads:
+        filename = upload.filename or ''
+        if filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(upload.stream) as archive:
+                for member in archive.infolist():
+                    name = os.path.basename(member.filename)
+                    if member.is_dir() or member.filename.startswith('__MACOSX/') or name.startswith('.') or not allowed_image(name):
+                        continue
+                    # Checked against the declared size before decompressing anything
+                    total_bytes += member.file_size
+                    if total_bytes > max_bytes:
+                        raise ValueError(f"Archive contents exceed {max_bytes} bytes")
+                    sheets.append((name, archive.read(member)))
+                    if len(sheets) > max_files:
+                        raise ValueError(f"Too many images; at most {max_files} per batch")
+        elif allowed_image(filename):
+            sheets.append((filename, upload.read()))
+            if len(sheets) > max_files:
+                raise ValueError(f"Too many images; at most {max_files} per batch")
+        else:
+            raise ValueError(f"Invalid file type: {filename}. Allowed types: png, jpg, jpeg, gif, bmp, webp, zip")
+    return sheets
+
+def transcribe_stored_image(image_id, force=False, tiling=None):
+    """Transcribe one stored image in its own app context, reusing a stored transcription unless forced"""
+    with app.app_context():
+        if not force:
+            transcription = find_transcription(image_id, fa_transcriber_module.model)
+            if transcription:
+                image = db.session.get(Image, image_id)
+                return transcription_result(image, transcription, transcription.items.all(), cached=True), 200
+        return run_fa_transcription(image_id, tiling)
+
+def run_fa_batch(entries, force=False, tiling=None, progress=None):
+    """Transcribe the batch's images concurrently and consolidate their items; returns (body, status)
+
+    Sheets are fanned out over FA_BATCH_WORKERS threads (the LLM scheduler still
+    bounds upstream concurrency). Duplicate uploads within the batch share one
+    transcription. progress(fraction, message) is called as each sheet finishes.
+    """
+    image_ids = list(dict.fromkeys(entry["image_id"] for entry in entries))
+    outcomes = {}
+    workers = max(1, min(app.config.get('FA_BATCH_WORKERS', 8), len(image_ids)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fa-batch') as pool:
+        futures = {pool.submit(transcribe_stored_image, image_id, force, tiling): image_id for image_id in image_ids}
+        for done, future in enumerate(as_completed(futures), start=1):
+            image_id = futures[future]
+            try:
+                outcomes[image_id] = future.result()
+            except Exception as e:
+                logger.error(f"Batch transcription of image {image_id} failed: {e}")
+                outcomes[image_id] = ({"success": False, "error": str(e)}, 500)
+            if progress:
+                state = "done" if outcomes[image_id][0].get("success") else "failed"
+                progress(done / len(image_ids), f"{done}/{len(image_ids)} sheets; image {image_id} {state}")
+    
+    results = []
+    items = []
+    for entry in entries:
+        body, status = outcomes[entry["image_id"]]
+        result = {"image_id": entry["image_id"], "filename": entry["filename"], "success": bool(body.get("success"))}
+        if result["success"]:
+            result.update(transcription_id=body["transcription_id"], cached=body.get("cached", False), item_count=len(body["items"]))
+            items.extend(dict(item, image_id=entry["image_id"], filename=entry["filename"]) for item in body["items"])
+        else:
+            result["error"] = body.get("error", "Transcription failed")
+        results.append(result)
+    
+    succeeded = sum(1 for result in results if result["success"])
+    body = {
+        "success": succeeded > 0,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "cached": sum(1 for result in results if result.get("cached")),
+        "results": results,
+        "items": items
+    }
+    if not succeeded:
+        body["error"] = "All transcriptions in the batch failed"
+        return body, 500
+    return body, 200
+
+def handle_fa_batch(payload, ctx):
+    body, status = run_fa_batch(payload["entries"], payload.get("force", False), payload.get("tiling"), progress=ctx.update_progress)
+    if status >= 400:
+        raise JobError(body.get('error', 'Job failed'), result=body)
+    return body
+
 # FA Transcriber API - Get Transcription
 @app.route('/api/fa-transcriber/transcriptions/<int:transcription_id>', methods=['GET'])
 def get_transcription(transcription_id):
@@ -375,6 +812,7 @@ def get_transcription(transcription_id):
             "transcription_id": transcription.id,
             "image_id": transcription.image_id,
             "processed_at": transcription.processed_at.isoformat(),
+            "model": transcription.model,
             "items": [item.to_dict() for item in items]
         })
         
@@ -383,24 +821,167 @@ def get_transcription(transcription_id):
         logger.error(traceback.format_exc())
         return jsonify({"success": False, "error": str(e)}), 500
 
+# FA Transcriber API - Export One Transcription
+@app.route('/api/fa-transcriber/transcriptions/<int:transcription_id>/export', methods=['GET'])
+def export_transcription(transcription_id):
+    """Download a transcription's items as ?format=csv (default), ndjson or xlsx."""
+    try:
+        transcription = db.session.get(FATranscription, transcription_id)
+        if not transcription:
+            return jsonify({"success": False, "error": "Transcription not found"}), 404
+        return export_response(f"fa-transcription-{transcription_id}", transcription_id=transcription_id)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in export_transcription API: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+# FA Transcriber API - Export Transcriptions (date range or whole corpus)
+@app.route('/api/fa-transcriber/export', methods=['GET'])
+def export_transcriptions():
+    """Download the items of every transcription processed in [?since=, ?until=) (ISO dates, both optional).
+
+    ?latest=true skips transcriptions that a newer one of the same image has replaced.
+    """
+    try:
+        since = parse_export_date(request.args.get('since'))
+        until = parse_export_date(request.args.get('until'), end_of_day=True)
+        latest_only = request.args.get('latest', '').lower() == 'true'
+        return export_response("fa-transcriptions", since=since, until=until, latest_only=latest_only)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in export_transcriptions API: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+def parse_export_date(value, end_of_day=False):
+    """Parse an ISO date or datetime query value; a bare date as an upper bound includes that whole day"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD or an ISO datetime")
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def export_response(basename, **filters):
+    """Stream the items selected by filters in the requested ?format= as a file download"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    rows = transcription_exporter.rows(**filters)
+    return Response(
+        stream_with_context(transcription_exporter.stream(export_format, rows)),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="{basename}.{extension}"',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 # FA Transcriber API - Get Image
 @app.route('/api/fa-transcriber/images/<int:image_id>', methods=['GET'])
 def get_image(image_id):
     try:
-        image = Image.query.get(image_id)
+        image = db.session.get(Image, image_id)
         
         if not image:
             return jsonify({"success": False, "error": "Image not found"}), 404
-            
-        response = make_response(image.data)
-        response.headers.set('Content-Type', image.content_type)
-        return response
+        
+        # Stream from disk (or X-Sendfile) with ETag/Last-Modified revalidation and Range requests
+        if image.blob_key and blob_store:
+            source = blob_store.path(image.blob_key)
+        else:
+            source = io.BytesIO(load_image_data(image))
+        return send_file(
+            source,
+            mimetype=image.content_type,
+            download_name=image.filename,
+            conditional=True,
+            etag=image.sha256 or f"image-{image.id}",
+            last_modified=image.uploaded_at
+        )
         
     except Exception as e:
         logger.error(f"Error in get_image API: {e}")
         logger.error(traceback.format_exc())
         return jsonify({"success": False, "error": str(e)}), 500
 
+# ECU Graph API - List ECUs
+@app.route('/api/ecus', methods=['GET'])
+def api_ecus():
+    """ECUs seen in transcriptions, optionally filtered by ?q=, with message counts in each direction."""
+    try:
+        result = ecu_graph.list_ecus(request.args.get('q'), request.args.get('limit', type=int), request.args.get('offset', type=int))
+        return jsonify(dict(result, success=True))
+    except Exception as e:
+        logger.error(f"Error in api_ecus: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+# ECU Graph API - Neighbours of an ECU
+@app.route('/api/ecus/<path:name>/neighbours', methods=['GET'])
+def api_ecu_neighbours(name):
+    """ECUs an ECU sends to (?direction=out), receives from (in) or both, up to ?depth= hops."""
+    try:
+        direction = request.args.get('direction', 'both')
+        if direction not in ('in', 'out', 'both'):
+            return jsonify({"success": False, "error": "direction must be one of: in, out, both"}), 400
+        result = ecu_graph.neighbours(name, direction, request.args.get('depth', 1, type=int))
+        if result is None:
+            return jsonify({"success": False, "error": "ECU not found"}), 404
+        return jsonify(dict(result, success=True))
+    except Exception as e:
+        logger.error(f"Error in api_ecu_neighbours: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+# ECU Graph API - Filter Edges
+@app.route('/api/ecu-edges', methods=['GET'])
+def api_ecu_edges():
+    """Messages between ECUs, filtered by sender, receiver, ecu (either end), message (?match=exact|prefix|contains), sheet, transcription_id or image_id."""
+    try:
+        args = request.args
+        result = ecu_graph.find_edges(
+            sender=args.get('sender'),
+            receiver=args.get('receiver'),
+            ecu=args.get('ecu'),
+            message=args.get('message'),
+            sheet=args.get('sheet'),
+            transcription_id=args.get('transcription_id', type=int),
+            image_id=args.get('image_id', type=int),
+            limit=args.get('limit', type=int),
+            offset=args.get('offset', type=int),
+            match=args.get('match', 'exact')
+        )
+        return jsonify(dict(result, success=True))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in api_ecu_edges: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
+# ECU Graph API - Aggregate Edges
+@app.route('/api/ecu-edges/aggregate', methods=['GET'])
+def api_ecu_edges_aggregate():
+    """Message counts grouped by ?group_by=sender|receiver|pair|sheet|message (default pair)."""
+    try:
+        result = ecu_graph.aggregate(request.args.get('group_by', 'pair'), request.args.get('limit', type=int), request.args.get('offset', type=int))
+        return jsonify(dict(result, success=True))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in api_ecu_edges_aggregate: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # Coding API - Generate Script
 @app.route('/api/coding/generate', methods=['POST'])
 # @csrf.exempt # Typically POST routes should be protected
@@ -426,42 +1007,136 @@ def generate_script():
             logger.error(f"Missing parameters - language: {language}, requirements: {requirements}")
             return jsonify({"success": False, "error": "Missing language or requirements"}), 400
 
+        if request.args.get('stream', '').lower() == 'true':
+            return sse_response(stream_generated_script(language, requirements, script_name))
+
+        if wants_async(data):
+            return submit_job('coding.generate', {"language": language, "requirements": requirements, "script_name": script_name})
+
+        body, status = run_generate_script(language, requirements, script_name)
+        return jsonify(body), status
+
+    except Exception as e:
+        logger.error(f"Error in generate_script API: {e}")
+        logger.error(traceback.format_exc())
+        db.session.rollback() # Rollback DB changes on error
+        return jsonify({"success": False, "error": str(e), "message": "Failed to generate script"}), 500
+
+def run_generate_script(language, requirements, script_name):
+    """Generate a script and save it with its initial version; returns (body, status)"""
+    try:
         # Call the refactored module method (non-streaming)
         logger.debug(f"Calling coding_module.generate_script for {language}")
         generated_code = coding_module.generate_script(language, requirements)
 
         if generated_code.startswith("Error generating script:"):
             logger.error(f"Module Error in generate_script: {generated_code}")
-            return jsonify({"success": False, "error": generated_code}), 500
+            return {"success": False, "error": generated_code}, 500
 
         # --- Database Interaction --- 
-        logger.debug("Saving generated script to database.")
-        # Use provided name or generate one
-        title = script_name if script_name else f"{language.capitalize()} script based on: {requirements[:30]}..."
-        
+        new_script, initial_version = save_generated_script(language, requirements, script_name, generated_code)
+
+        return {
+            "success": True, 
+            "script": new_script.to_dict(), # Return the saved script data
+            "version": initial_version.to_dict()
+        }, 201 # Status code for resource created
+
+    except Exception as e:
+        logger.error(f"Error in run_generate_script: {e}")
+        logger.error(traceback.format_exc())
+        db.session.rollback() # Rollback DB changes on error
+        return {"success": False, "error": str(e), "message": "Failed to generate script"}, 500
+
+def save_generated_script(language, requirements, script_name, generated_code):
+    """Persist a newly generated script together with its initial version"""
+    logger.debug("Saving generated script to database.")
+    # Use provided name or generate one
+    title = script_name if script_name else f"{language.capitalize()} script based on: {requirements[:30]}..."
+    
+    with unit_of_work():
         new_script = Script(title=title, language=language, content=generated_code)
         db.session.add(new_script)
-        # Commit here to get the new_script.id
-        db.session.commit()
-        logger.info(f"Created new Script with ID: {new_script.id}")
+        # Flush to get new_script.id; the script and its first version commit together
+        db.session.flush()
         
         # Add initial version
         initial_version = ScriptVersion(script_id=new_script.id, version=1, content=generated_code, changes="Initial generation")
         db.session.add(initial_version)
-        db.session.commit()
-        logger.info(f"Created initial ScriptVersion ID: {initial_version.id} for Script ID: {new_script.id}")
+    logger.info(f"Created initial ScriptVersion ID: {initial_version.id} for Script ID: {new_script.id}")
+    return new_script, initial_version
+
+def save_script_version(script, content, changes):
+    """Append a new version to an existing script and make it the current content"""
+    # Every SCRIPT_VERSION_CHECKPOINT_INTERVAL-th version keeps its full text; the rest are deltas
+    interval = app.config.get('SCRIPT_VERSION_CHECKPOINT_INTERVAL', 10)
+    for attempt in range(3):
+        latest_version = ScriptVersion.query.filter_by(script_id=script.id).order_by(ScriptVersion.version.desc()).first()
+        new_version_num = (latest_version.version + 1) if latest_version else 1
+        
+        new_version = ScriptVersion(
+            script_id=script.id,
+            version=new_version_num,
+            content=content,
+            changes=changes
+        )
+        if latest_version and (new_version_num - 1) % interval:
+            new_version.store_as_delta(latest_version)
+        try:
+            with db.session.begin_nested():
+                db.session.add(new_version)
+        except IntegrityError:
+            # A concurrent save took this version number (unique index); read the latest version again
+            logger.warning(f"Version {new_version_num} of Script ID {script.id} was taken by a concurrent save; retrying")
+            if attempt == 2:
+                raise
+            continue
+        break
+    
+    # Update the main script content as well
+    script.content = content
+    script.updated_at = db.func.current_timestamp()
+    
+    db.session.commit()
+    script_version_cache.put((script.id, new_version_num), content)
+    logger.info(f"Created ScriptVersion ID: {new_version.id} (v{new_version_num}) for Script ID: {script.id}")
+    return new_version
 
-        return jsonify({
-            "success": True, 
-            "script": new_script.to_dict(), # Return the saved script data
-            "version": initial_version.to_dict()
-        }), 201 # Status code for resource created
+def stream_generated_script(language, requirements, script_name):
+    """Forward generated code to the editor as SSE chunks; save the Script only once the stream completes"""
+    yield sse_event({"initializing": True})
 
+    chunks = []
+    try:
+        logger.debug(f"Calling coding_module.stream_generate_script for {language}")
+        for chunk in coding_module.stream_generate_script(language, requirements):
+            chunks.append(chunk)
+            yield sse_event({"chunk": chunk})
+    except GeneratorExit:
+        # Client went away: closing the module generator also closes the upstream stream, nothing is saved
+        logger.info("Client disconnected during script generation stream; nothing saved.")
+        raise
     except Exception as e:
-        logger.error(f"Error in generate_script API: {e}")
+        logger.error(f"Error while streaming generated script: {e}")
         logger.error(traceback.format_exc())
-        db.session.rollback() # Rollback DB changes on error
-        return jsonify({"success": False, "error": str(e), "message": "Failed to generate script"}), 500
+        yield sse_event({"success": False, "error": f"Error generating script: {e}"})
+        return
+
+    try:
+        new_script, initial_version = save_generated_script(language, requirements, script_name, ''.join(chunks))
+    except Exception as e:
+        logger.error(f"Error saving streamed script: {e}")
+        logger.error(traceback.format_exc())
+        db.session.rollback()
+        yield sse_event({"success": False, "error": f"Failed to save generated script: {e}"})
+        return
+
+    yield sse_event({
+        "done": True,
+        "success": True,
+        "script": new_script.to_dict(),
+        "version": initial_version.to_dict()
+    })
 
 # Coding API - Debug Script
 @app.route('/api/coding/debug', methods=['POST'])
@@ -482,6 +1157,21 @@ def debug_script():
         if script_content is None:
             return jsonify({"success": False, "error": "Missing script_content"}), 400
 
+        if wants_async(data):
+            return submit_job('coding.debug', {"script_id": script_id, "script_content": script_content, "error_log": error_log})
+
+        body, status = run_debug_script(script_id, script_content, error_log)
+        return jsonify(body), status
+
+    except Exception as e:
+        logger.error(f"Error in debug_script API: {e}")
+        logger.error(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e), "message": "Failed to debug script"}), 500
+
+def run_debug_script(script_id, script_content, error_log):
+    """Debug a script and save a new version if the code changed; returns (body, status)"""
+    try:
         # If script_id is missing but we have content, we can still proceed with debugging
         script = None
         if script_id:
@@ -492,7 +1182,7 @@ def debug_script():
 
         logger.debug(f"Calling coding_module.debug_script for script")
         # Call refactored debug method (returns dict with 'analysis' and 'fixed_code')
-        debug_result = coding_module.debug_script(script_content, error_log)
+        debug_result = coding_module.debug_script(script_content, error_log, script.language if script else None)
 
         analysis = debug_result.get('analysis', 'No analysis provided.')
         fixed_code = debug_result.get('fixed_code') # Will be None if no fix or error
@@ -501,42 +1191,28 @@ def debug_script():
              # Check if the analysis indicates an error from the module
             if analysis.startswith("Error during debugging:"):
                 logger.error(f"Module Error in debug_script: {analysis}")
-                return jsonify({"success": False, "error": analysis}), 500
+                return {"success": False, "error": analysis}, 500
             else:
                 # No changes needed or analysis only
                 logger.info(f"Debug analysis complete, no code changes suggested.")
-                return jsonify({
+                return {
                     "success": True,
                     "analysis": analysis,
                     "explanation": analysis,  # Add this for frontend compatibility
                     "fixed_code": script_content, # Return original content if no changes
                     "fixed_script": script_content, # Added for compatibility
                     "diff_html": "<div class='bg-yellow-100 p-2 rounded'>No changes needed - script appears to be functioning correctly.</div>",
+                    "static_analysis": debug_result.get('static_analysis'),
                     "script_id": script_id,
                     "new_version": None # No new version created
-                })
+                }, 200
 
         # --- Database Interaction (Code Changed) --- 
         version_dict = None
         if script and fixed_code != script_content:
             logger.debug(f"Saving debugged version for script ID: {script_id}")
-            latest_version = ScriptVersion.query.filter_by(script_id=script.id).order_by(ScriptVersion.version.desc()).first()
-            new_version_num = (latest_version.version + 1) if latest_version else 1
-            
-            new_version = ScriptVersion(
-                script_id=script.id,
-                version=new_version_num,
-                content=fixed_code,
-                changes=f"Debugged: {analysis[:150]}..." # Truncate analysis for changes field
-            )
-            db.session.add(new_version)
-            
-            # Update the main script content as well
-            script.content = fixed_code 
-            script.updated_at = db.func.current_timestamp()
-            
-            db.session.commit()
-            logger.info(f"Created debugged ScriptVersion ID: {new_version.id} for Script ID: {script.id}")
+            # Truncate analysis for changes field
+            new_version = save_script_version(script, fixed_code, f"Debugged: {analysis[:150]}...")
             version_dict = new_version.to_dict()
         else:
             if script:
@@ -544,22 +1220,24 @@ def debug_script():
             else:
                 logger.info("Debug completed without script ID, no version saved to database")
             
-        return jsonify({
+        return {
             "success": True,
             "analysis": analysis,
             "explanation": analysis,  # Add this for frontend compatibility
             "fixed_code": fixed_code,
             "fixed_script": fixed_code,  # Added for compatibility
-            "diff_html": generateDiffHtml(script_content, fixed_code),  # Better diff display
+            "diff_html": diff_engine.unified(script_content, fixed_code),
+            "regions": debug_result.get('regions'),  # Set when only some functions were sent to the model
+            "static_analysis": debug_result.get('static_analysis'),  # Local compile/lint findings and fixes
             "script_id": script_id if script else None,
             "new_version": version_dict # Include new version info if created
-        })
+        }, 200
 
     except Exception as e:
-        logger.error(f"Error in debug_script API: {e}")
+        logger.error(f"Error in run_debug_script: {e}")
         logger.error(traceback.format_exc())
         db.session.rollback()
-        return jsonify({"success": False, "error": str(e), "message": "Failed to debug script"}), 500
+        return {"success": False, "error": str(e), "message": "Failed to debug script"}, 500
 
 # Coding API - Modify Script
 @app.route('/api/coding/modify', methods=['POST'])
@@ -588,18 +1266,23 @@ def modify_script():
         else:
             logger.warning("No script_id provided, proceeding with content-only modification")
 
+        if request.args.get('stream', '').lower() == 'true':
+            return sse_response(stream_modified_script(script, script_id, script_content, modification_request))
+
         logger.debug(f"Calling coding_module.modify_script")
         # Call refactored modify method (returns modified code string or error string)
-        modify_result = coding_module.modify_script(script_content, modification_request)
+        modify_result = coding_module.modify_script(script_content, modification_request, script.language if script else None)
         
         # Check if the result is a dictionary or just a string
         if isinstance(modify_result, dict):
             explanation = modify_result.get('explanation', f"Script modified according to request: {modification_request[:100]}...")
             modified_code = modify_result.get('modified_code', '')
+            regions = modify_result.get('regions')
         else:
             # Backwards compatibility with older module versions that return just the code string
             explanation = f"Script modified according to request: {modification_request[:100]}..."
             modified_code = modify_result
+            regions = None
 
         if isinstance(modified_code, str) and modified_code.startswith("Error modifying script:"):
             logger.error(f"Module Error in modify_script: {modified_code}")
@@ -609,23 +1292,8 @@ def modify_script():
         version_dict = None
         if script and modified_code != script_content:
             logger.debug(f"Saving modified version for script ID: {script_id}")
-            latest_version = ScriptVersion.query.filter_by(script_id=script.id).order_by(ScriptVersion.version.desc()).first()
-            new_version_num = (latest_version.version + 1) if latest_version else 1
-            
-            new_version = ScriptVersion(
-                script_id=script.id,
-                version=new_version_num,
-                content=modified_code,
-                changes=f"Modified: {modification_request[:150]}..." # Truncate request for changes field
-            )
-            db.session.add(new_version)
-            
-            # Update the main script content as well
-            script.content = modified_code
-            script.updated_at = db.func.current_timestamp()
-            
-            db.session.commit()
-            logger.info(f"Created modified ScriptVersion ID: {new_version.id} for Script ID: {script.id}")
+            # Truncate request for changes field
+            new_version = save_script_version(script, modified_code, f"Modified: {modification_request[:150]}...")
             version_dict = new_version.to_dict()
         else:
             if script:
@@ -638,7 +1306,8 @@ def modify_script():
             "modified_code": modified_code,
             "modified_script": modified_code,  # Added for compatibility
             "explanation": explanation,
-            "diff_html": generateDiffHtml(script_content, modified_code),  # Better diff display
+            "diff_html": diff_engine.unified(script_content, modified_code),
+            "regions": regions,
             "script_id": script_id if script else None,
             "new_version": version_dict # Include new version info if created
         })
@@ -649,6 +1318,49 @@ def modify_script():
         db.session.rollback()
         return jsonify({"success": False, "error": str(e), "message": "Failed to modify script"}), 500
 
+def stream_modified_script(script, script_id, script_content, modification_request):
+    """Forward modified code as SSE chunks; save the new ScriptVersion only once the stream completes"""
+    yield sse_event({"initializing": True})
+
+    chunks = []
+    try:
+        logger.debug("Calling coding_module.stream_modify_script")
+        for chunk in coding_module.stream_modify_script(script_content, modification_request, script.language if script else None):
+            chunks.append(chunk)
+            yield sse_event({"chunk": chunk})
+    except GeneratorExit:
+        logger.info("Client disconnected during script modification stream; nothing saved.")
+        raise
+    except Exception as e:
+        logger.error(f"Error while streaming modified script: {e}")
+        logger.error(traceback.format_exc())
+        yield sse_event({"success": False, "error": f"Error modifying script: {e}"})
+        return
+
+    modified_code = ''.join(chunks)
+    version_dict = None
+    try:
+        if script and modified_code != script_content:
+            new_version = save_script_version(script, modified_code, f"Modified: {modification_request[:150]}...")
+            version_dict = new_version.to_dict()
+    except Exception as e:
+        logger.error(f"Error saving streamed modification: {e}")
+        logger.error(traceback.format_exc())
+        db.session.rollback()
+        yield sse_event({"success": False, "error": f"Failed to save modified script: {e}"})
+        return
+
+    yield sse_event({
+        "done": True,
+        "success": True,
+        "modified_code": modified_code,
+        "modified_script": modified_code,  # Added for compatibility
+        "explanation": f"Script modified according to request: {modification_request[:100]}...",
+        "diff_html": diff_engine.unified(script_content, modified_code),
+        "script_id": script_id if script else None,
+        "new_version": version_dict
+    })
+
 # Coding API - Diff Checker (Simplified - No AI Explanation)
 @app.route('/api/coding/diffcheck', methods=['POST'])
 def diffcheck():
@@ -657,25 +1369,35 @@ def diffcheck():
         data = request.json
         original_content = data.get('original_content')
         new_content = data.get('new_content')
-        version1_id = data.get('version1_id') # Optional, pass-through
-        version2_id = data.get('version2_id') # Optional, pass-through
+        version1_id = data.get('version1_id') # Optional: compare stored versions instead of posted text
+        version2_id = data.get('version2_id')
+        key = None
+
+        if (original_content is None or new_content is None) and version1_id and version2_id:
+            version1 = db.session.get(ScriptVersion, version1_id)
+            version2 = db.session.get(ScriptVersion, version2_id)
+            if not version1 or not version2:
+                return jsonify({"success": False, "error": "Script version not found"}), 404
+            original_content, new_content = version1.content, version2.content
+            key = ('version-id', version1.id, version2.id)
 
         if original_content is None or new_content is None:
             return jsonify({"success": False, "error": "Missing original_content or new_content"}), 400
 
         logger.debug("Generating diff between two content versions.")
-        # Use the static method from CodingModule
-        diff_html = generateDiffHtml(original_content, new_content)
+        result = diff_engine.render(original_content, new_content, data.get('format', 'unified'),
+                                    data.get('page', 1), data.get('page_size'), key=key)
         
-        return jsonify({
-            "success": True, 
-            "diff_html": diff_html,
+        return jsonify(dict(result,
+            success=True,
             # No AI explanation in this simplified version
-            "explanation": "Diff generated.", 
-            "version1_id": version1_id, # Pass back if provided
-            "version2_id": version2_id  # Pass back if provided
-        })
+            explanation="Diff generated.",
+            version1_id=version1_id, # Pass back if provided
+            version2_id=version2_id  # Pass back if provided
+        ))
 
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e), "message": str(e)}), 400
     except Exception as e:
         logger.error(f"Error in diffcheck API: {e}")
         logger.error(traceback.format_exc())
@@ -711,12 +1433,31 @@ def generate_test_case():
             logger.error(f"Script not found for ID: {script_id}")
             return jsonify({"success": False, "error": "Script not found"}), 404
         
+        if wants_async(data):
+            return submit_job('testing.generate', {"script_id": script.id, "requirements": requirements})
+
+        body, status = run_generate_test_case(script.id, requirements)
+        return jsonify(body), status
+
+    except Exception as e:
+        logger.error(f"Error in generate_test_case API: {e}")
+        logger.error(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e), "message": "Failed to generate test case"}), 500
+
+def run_generate_test_case(script_id, requirements):
+    """Generate test cases for a stored script and save them; returns (body, status)"""
+    try:
+        script = db.session.get(Script, script_id)
+        if not script:
+            return {"success": False, "error": "Script not found"}, 404
+        
         script_content = script.content
         language = script.language
 
         if not script_content or not language:
              logger.error(f"Missing script content or language for script ID: {script_id}")
-             return jsonify({"success": False, "error": "Script content or language missing in database for the selected script."}), 400
+             return {"success": False, "error": "Script content or language missing in database for the selected script."}, 400
 
         logger.debug(f"Calling testing_module.generate_test_cases for script ID: {script_id} ({language})")
         # Call refactored generate method (expects script content and language)
@@ -724,7 +1465,7 @@ def generate_test_case():
 
         if not result.get('success'):
             logger.error(f"Module Error in generate_test_case: {result.get('error')}")
-            return jsonify({"success": False, "error": result.get('error', 'Unknown error during test generation')}), 500
+            return {"success": False, "error": result.get('error', 'Unknown error during test generation')}, 500
 
         generated_tests = result.get('test_cases') # This is the generated code string
 
@@ -741,16 +1482,16 @@ def generate_test_case():
         db.session.commit()
         logger.info(f"Created new TestCase ID: {new_test_case.id} for Script ID: {script.id}")
 
-        return jsonify({
+        return {
             "success": True, 
             "test_case": new_test_case.to_dict() # Return saved test case data
-        }), 201
+        }, 201
 
     except Exception as e:
-        logger.error(f"Error in generate_test_case API: {e}")
+        logger.error(f"Error in run_generate_test_case: {e}")
         logger.error(traceback.format_exc())
         db.session.rollback()
-        return jsonify({"success": False, "error": str(e), "message": "Failed to generate test case"}), 500
+        return {"success": False, "error": str(e), "message": "Failed to generate test case"}, 500
 
 # Testing API - Execute Test Case
 @app.route('/api/testing/execute', methods=['POST'])
@@ -769,10 +1510,30 @@ def execute_test_case():
         test_case = TestCase.query.get(test_case_id)
         if not test_case:
             return jsonify({"success": False, "error": "Test Case not found"}), 404
+
+        if wants_async(data):
+            return submit_job('testing.execute', {"test_case_id": test_case.id})
+
+        body, status = run_execute_test_case(test_case.id)
+        return jsonify(body), status
+
+    except Exception as e:
+        logger.error(f"Error in execute_test_case API: {e}")
+        logger.error(traceback.format_exc())
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e), "message": "Failed to execute test case"}), 500
+
+def run_execute_test_case(test_case_id):
+    """Run a stored test case against its script and save the TestResult; returns (body, status)"""
+    test_case = None
+    try:
+        test_case = db.session.get(TestCase, test_case_id)
+        if not test_case:
+            return {"success": False, "error": "Test Case not found"}, 404
             
         script = Script.query.get(test_case.script_id)
         if not script:
-            return jsonify({"success": False, "error": "Associated Script not found"}), 404
+            return {"success": False, "error": "Associated Script not found"}, 404
             
         script_content = script.content
         test_content = test_case.content
@@ -780,7 +1541,7 @@ def execute_test_case():
         language = test_case.language if test_case.language else script.language 
 
         if not script_content or not test_content or not language:
-             return jsonify({"success": False, "error": "Missing content or language for script or test case."}), 400
+             return {"success": False, "error": "Missing content or language for script or test case."}, 400
 
         logger.debug(f"Calling testing_module.execute_test for TestCase ID: {test_case_id} ({language})")
         # Call the execute_test method from the module
@@ -812,18 +1573,18 @@ def execute_test_case():
         logger.info(f"Saved TestResult ID: {test_result.id} with status '{status}' for TestCase ID: {test_case.id}")
 
         # Return the result from the module along with the saved DB record
-        return jsonify({
+        return {
             "success": result.get('success', False), # Reflect the actual execution success 
             "test_result": test_result.to_dict(), # Include the saved result details
             "message": "Test execution completed."
-        })
+        }, 200
 
     except Exception as e:
-        logger.error(f"Error in execute_test_case API: {e}")
+        logger.error(f"Error in run_execute_test_case: {e}")
         logger.error(traceback.format_exc())
         # Attempt to save an error result to DB even if API call fails
         try:
-            if 'test_case' in locals() and test_case:
+            if test_case:
                 error_result = TestResult(
                     test_case_id=test_case.id,
                     status="error",
@@ -838,7 +1599,7 @@ def execute_test_case():
             logger.error(f"Failed to save error result to DB after API exception: {db_err}")
             db.session.rollback() # Rollback the failed attempt to save error result
             
-        return jsonify({"success": False, "error": str(e), "message": "Failed to execute test case"}), 500
+        return {"success": False, "error": str(e), "message": "Failed to execute test case"}, 500
 
 # Testing API - Improve Test Case (Not implemented with OpenRouter Module yet)
 @app.route('/api/testing/improve', methods=['POST'])
@@ -888,6 +1649,64 @@ def get_script(script_id):
         logger.error(traceback.format_exc())
         return jsonify({"success": False, "error": str(e), "message": "Failed to get script"}), 500
 
+# Get the version history of a script (without contents)
+@app.route('/api/coding/scripts/<int:script_id>/versions', methods=['GET'])
+def get_script_versions(script_id):
+    try:
+        script = db.session.get(Script, script_id)
+        if not script:
+            return jsonify({"success": False, "error": "Script not found"}), 404
+        rows = db.session.query(ScriptVersion.id, ScriptVersion.version, ScriptVersion.changes, ScriptVersion.created_at) \
+            .filter_by(script_id=script_id).order_by(ScriptVersion.version).all()
+        return jsonify({
+            "success": True,
+            "script_id": script_id,
+            "versions": [{
+                "id": version_id,
+                "version": version,
+                "changes": changes,
+                "created_at": created_at.isoformat() if created_at else None
+            } for version_id, version, changes, created_at in rows]
+        })
+    except Exception as e:
+        logger.error(f"Error in get_script_versions API: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e), "message": "Failed to get script versions"}), 500
+
+# Diff two stored versions of a script
+@app.route('/api/coding/scripts/<int:script_id>/diff', methods=['GET'])
+def diff_script_versions(script_id):
+    """Diff ?v1= against ?v2= (defaults: the previous and the latest version).
+
+    ?format=unified|side_by_side|json, ?page= and ?page_size= page through the hunks.
+    """
+    try:
+        versions = ScriptVersion.query.filter_by(script_id=script_id)
+        latest = versions.order_by(ScriptVersion.version.desc()).first()
+        if not latest:
+            return jsonify({"success": False, "error": "Script not found or has no versions"}), 404
+        v2 = request.args.get('v2', latest.version, type=int)
+        v1 = request.args.get('v1', max(1, v2 - 1), type=int)
+        version1 = versions.filter_by(version=v1).first()
+        version2 = latest if v2 == latest.version else versions.filter_by(version=v2).first()
+        if not version1 or not version2:
+            return jsonify({"success": False, "error": f"Version {v1 if not version1 else v2} not found"}), 404
+
+        result = diff_engine.render(
+            version1.content, version2.content,
+            request.args.get('format', 'unified'),
+            request.args.get('page', 1, type=int),
+            request.args.get('page_size', type=int),
+            key=('version', script_id, v1, v2)
+        )
+        return jsonify(dict(result, success=True, script_id=script_id, v1=v1, v2=v2))
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in diff_script_versions API: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e), "message": "Failed to generate diff"}), 500
+
 # Testing API - Get Test Cases
 @app.route('/api/testing/test-cases', methods=['GET'])
 def get_test_cases():
@@ -916,6 +1735,113 @@ def get_test_cases():
         logger.error(traceback.format_exc())
         return jsonify({"success": False, "error": str(e), "message": "Failed to get test cases"}), 500
 
+# Jobs API - Get Job Status
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = db.session.get(Job, job_id)
+        if not job:
+            return jsonify({"success": False, "error": "Job not found"}), 404
+        return jsonify({"success": True, "job": job.to_dict(include_result=False)})
+    except Exception as e:
+        logger.error(f"Error in get_job API: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e), "message": "Failed to get job"}), 500
+
+# Jobs API - Get Job Result (same body the synchronous route would have returned)
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    try:
+        job = db.session.get(Job, job_id)
+        if not job:
+            return jsonify({"success": False, "error": "Job not found"}), 404
+        if job.status in ('queued', 'running'):
+            return jsonify({"success": True, "job": job.to_dict(include_result=False)}), 202
+        result = json.loads(job.result) if job.result else None
+        if job.status == 'failed':
+            return jsonify(result or {"success": False, "error": job.error}), 500
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error in get_job_result API: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e), "message": "Failed to get job result"}), 500
+
+# Background job handlers (payload keys match the run_* keyword arguments)
+job_queue.register('coding.generate', job_handler(run_generate_script))
+job_queue.register('coding.debug', job_handler(run_debug_script))
+job_queue.register('testing.generate', job_handler(run_generate_test_case))
+job_queue.register('testing.execute', job_handler(run_execute_test_case))
+job_queue.register('fa_transcriber.transcribe', job_handler(run_fa_transcription))
+job_queue.register('fa_transcriber.batch', handle_fa_batch)
+job_queue.register('chat.fold_summary', handle_chat_summary_fold)
+
+# Metrics API - LLM call metrics in Prometheus text format
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    if not llm_gateway:
+        return Response("", mimetype='text/plain; version=0.0.4')
+    return Response(llm_gateway.metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# Metrics API - LLM usage report from the llm_usage table
+@app.route('/api/metrics/usage', methods=['GET'])
+def api_llm_usage():
+    """Aggregates stored LLM calls per model and endpoint over the last ?hours= (default 24)."""
+    try:
+        hours = request.args.get('hours', 24, type=float)
+        since = datetime.utcnow() - timedelta(hours=hours)
+        rows = db.session.query(
+            LLMUsage.model,
+            LLMUsage.endpoint,
+            db.func.count(LLMUsage.id),
+            db.func.sum(db.case((LLMUsage.outcome == 'error', 1), else_=0)),
+            db.func.avg(LLMUsage.latency_ms),
+            db.func.max(LLMUsage.latency_ms),
+            db.func.avg(LLMUsage.ttft_ms),
+            db.func.sum(LLMUsage.prompt_tokens),
+            db.func.sum(LLMUsage.completion_tokens)
+        ).filter(LLMUsage.created_at >= since).group_by(LLMUsage.model, LLMUsage.endpoint).all()
+        usage = [{
+            "model": model,
+            "endpoint": endpoint,
+            "calls": calls,
+            "errors": int(errors or 0),
+            "avg_latency_ms": round(avg_latency) if avg_latency is not None else None,
+            "max_latency_ms": max_latency,
+            "avg_ttft_ms": round(avg_ttft) if avg_ttft is not None else None,
+            "prompt_tokens": int(prompt_tokens or 0),
+            "completion_tokens": int(completion_tokens or 0)
+        } for model, endpoint, calls, errors, avg_latency, max_latency, avg_ttft, prompt_tokens, completion_tokens in rows]
+        return jsonify({"success": True, "since": since.isoformat(), "usage": usage})
+    except Exception as e:
+        logger.error(f"Error in api_llm_usage: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e), "message": "Failed to build usage report"}), 500
+
+# Search API - Ranked full-text search with snippets
+@app.route('/api/search', methods=['GET'])
+def search():
+    try:
+        if not search_index.ready():
+            return jsonify({"success": False, "error": "The search index has not been created; run 'flask init-db'."}), 503
+        types = request.args.get('type')
+        # Chat hits are limited to the visitor's own conversation
+        chat_db_session = ChatSession.query.filter_by(session_id=session.get('chat_session_id')).first()
+        result = search_index.search(
+            request.args.get('q', ''),
+            kinds=types.split(',') if types else None,
+            page=request.args.get('page', 1, type=int),
+            page_size=request.args.get('page_size', type=int),
+            all_versions=request.args.get('all_versions', 'false').lower() == 'true',
+            chat_session_id=chat_db_session.id if chat_db_session else None
+        )
+        return jsonify({"success": True, **result})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error in search API: {e}")
+        logger.error(traceback.format_exc())
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # API Status route (Updated for OpenRouter)
 @app.route('/api/status', methods=['GET'])
 def api_status():
@@ -943,9 +1869,18 @@ def api_status():
     if openrouter_configured and not modules_initialized:
         status["initialization_error"] = "One or more modules failed to initialize. Check logs and ensure OPENROUTER_API_KEY is valid."
         
+    # LLM cache, coalescing, scheduler and hedging counters
+    if llm_gateway:
+        status["llm_cache"] = llm_gateway.cache.stats()
+        status["llm_coalescing"] = llm_gateway.singleflight.stats()
+        status["llm_scheduler"] = llm_gateway.scheduler.stats()
+        status["llm_hedging"] = llm_gateway.hedging.stats()
+        status["llm_calls"] = llm_gateway.metrics.summary()
+        status["llm_usage_log"] = llm_usage_recorder.stats()
+
     # Optionally add DB connection check
     try:
-        db.session.execute('SELECT 1')
+        db.session.execute(text('SELECT 1'))
         status["database_connection"] = "connected"
     except Exception as db_err:
         logger.error(f"Database connection check failed: {db_err}")
@@ -980,14 +1915,136 @@ def server_error(e):
 # Command to create database tables
 @app.cli.command("init-db")
 def init_db_command():
-    """Creates the database tables."""
+    """Creates the database tables and adds any newer columns to existing ones."""
     with app.app_context():
         try:
             db.create_all()
+            upgrade_schema()
+            search_index.install()
             logger.info("Database tables created successfully.")
         except Exception as e:
             logger.error(f"Error creating database tables: {e}")
 
+# Command to hash images stored before content-addressing
+@app.cli.command("backfill-image-hashes")
+def backfill_image_hashes_command():
+    """Sets Image.sha256 on older rows; later duplicates of the same bytes are left unhashed."""
+    with app.app_context():
+        try:
+            known = {sha256 for (sha256,) in db.session.query(Image.sha256).filter(Image.sha256.isnot(None))}
+            updated = duplicates = 0
+            for image in Image.query.filter(Image.sha256.is_(None)).order_by(Image.id).yield_per(50):
+                sha256 = hashlib.sha256(load_image_data(image)).hexdigest()
+                if sha256 in known:
+                    duplicates += 1
+                    continue
+                image.sha256 = sha256
+                known.add(sha256)
+                updated += 1
+            db.session.commit()
+            logger.info(f"Hashed {updated} images; {duplicates} duplicates left unhashed.")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error backfilling image hashes: {e}")
+
+# Command to move image bytes from the images table into the blob store
+@app.cli.command("migrate-image-blobs")
+@click.option('--batch-size', default=50, show_default=True, help='Images moved per commit.')
+@click.option('--vacuum', is_flag=True, help='VACUUM a SQLite database afterwards to reclaim the space.')
+def migrate_image_blobs_command(batch_size, vacuum):
+    """Writes stored image bytes to the blob store and clears them from the database."""
+    if not blob_store:
+        logger.error("No blob store configured (BLOB_STORE_BACKEND=local); nothing to migrate to.")
+        return
+    with app.app_context():
+        moved = 0
+        try:
+            last_id = 0
+            while True:
+                images = Image.query.filter(Image.blob_key.is_(None), Image.id > last_id) \
+                    .order_by(Image.id).options(db.undefer(Image.data)).limit(batch_size).all()
+                if not images:
+                    break
+                for image in images:
+                    if image.data is not None:
+                        image.blob_key = blob_store.put(image.data, image.sha256)
+                        image.data = None
+                        moved += 1
+                    last_id = image.id
+                db.session.commit()
+                db.session.expunge_all()
+            logger.info(f"Moved {moved} images to the blob store at {blob_store.root}.")
+            if vacuum and db.engine.dialect.name == 'sqlite':
+                with db.engine.connect() as conn:
+                    conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+                logger.info("Vacuumed the SQLite database.")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error migrating image blobs after {moved} images: {e}")
+
+# Command to rebuild the ECU graph from stored transcriptions
+@app.cli.command("rebuild-ecu-graph")
+@click.option('--batch-size', default=200, show_default=True, help='Transcriptions indexed per commit.')
+def rebuild_ecu_graph_command(batch_size):
+    """Re-indexes ECU edges from the latest transcription of every image."""
+    with app.app_context():
+        try:
+            db.create_all()
+            upgrade_schema()
+            transcriptions, edges = ecu_graph.rebuild(batch_size)
+            logger.info(f"Indexed {edges} ECU edges from {transcriptions} transcriptions.")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error rebuilding the ECU graph: {e}")
+
+# Command to delta-compress script versions stored before checkpointing
+@app.cli.command("compact-script-versions")
+@click.option('--vacuum', is_flag=True, help='VACUUM a SQLite database afterwards to reclaim the space.')
+def compact_script_versions_command(vacuum):
+    """Rewrites full-text script versions between checkpoints as deltas against the previous version."""
+    interval = app.config.get('SCRIPT_VERSION_CHECKPOINT_INTERVAL', 10)
+    with app.app_context():
+        compacted = 0
+        try:
+            db.create_all()
+            upgrade_schema()
+            script_ids = [script_id for (script_id,) in db.session.query(Script.id).order_by(Script.id)]
+            for script_id in script_ids:
+                previous = None
+                for version in ScriptVersion.query.filter_by(script_id=script_id).order_by(ScriptVersion.version).all():
+                    if previous and version.is_checkpoint and (version.version - 1) % interval and version.store_as_delta(previous):
+                        compacted += 1
+                    previous = version
+                db.session.commit()
+                db.session.expunge_all()
+            logger.info(f"Stored {compacted} script versions as deltas.")
+            if vacuum and db.engine.dialect.name == 'sqlite':
+                with db.engine.connect() as conn:
+                    conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+                logger.info("Vacuumed the SQLite database.")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error compacting script versions after {compacted} versions: {e}")
+
+# Command to rebuild the full-text search index
+@app.cli.command("rebuild-search-index")
+@click.option('--batch-size', default=200, show_default=True, help='Scripts whose versions are indexed per commit.')
+def rebuild_search_index_command(batch_size):
+    """Re-indexes every script, script version, chat message and transcription item."""
+    with app.app_context():
+        try:
+            db.create_all()
+            upgrade_schema()
+            if not search_index.install():
+                search_index.rebuild(batch_size)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error rebuilding the search index: {e}")
+
+# Workers of a server process (the direct-run case starts them once the tables exist, below)
+if __name__ != '__main__' and should_start_job_workers():
+    job_queue.start()
+
 # For local development
 if __name__ == '__main__':
     # Create tables if DB doesn't exist (useful for first run)
@@ -997,8 +2054,12 @@ if __name__ == '__main__':
         with app.app_context():
              try:
                  db.create_all()
+                 upgrade_schema()
+                 search_index.install()
                  logger.info("Database tables created successfully.")
              except Exception as e:
                  logger.error(f"Error creating database tables on startup: {e}")
-                 
+    if should_start_job_workers():
+        job_queue.start()
+
     app.run(debug=app.config['DEBUG']) # Use debug setting from config
@@ -0,0 +1,182 @@
+"""Commit-count and latency benchmark for the request write paths.
+
+Compares the old commit-per-step persistence of transcriptions, generated
+scripts and chat turns against the current unit-of-work versions (flush for
+ids, bulk item inserts, one commit per write phase). No LLM is involved: the
+transcriber is replaced by a stub returning --items rows, so the numbers are
+the database share of each request. Runs against a throwaway SQLite file by
+default, where every commit is an fsync:
+
+    python benchmarks/bench_persistence.py --iterations 50 --items 40
+
+Pass --database-url to measure another database (its tables are dropped and
+recreated) and --json to save the raw numbers.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers (q in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(q / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def sample_rows(count):
+    return [{
+        "sheet_name": "SHEET-01",
+        "message": f"Message_{i:03d}",
+        "start_ecu": f"ECU_{i % 7}",
+        "end_ecu": f"ECU_{(i + 3) % 7}",
+        "sending_ecu": f"ECU_{i % 7}",
+        "receiving_ecu": f"ECU_{(i + 3) % 7}",
+        "dashed_line": "DL1" if i % 4 == 0 else ""
+    } for i in range(count)]
+
+
+def build_scenarios(app_module, rows):
+    """Returns {scenario: {variant: fn()}}; each fn performs one request's writes and builds its response data."""
+    db = app_module.db
+    Image, FATranscription, FATranscriptionItem = app_module.Image, app_module.FATranscription, app_module.FATranscriptionItem
+    Script, ScriptVersion = app_module.Script, app_module.ScriptVersion
+    ChatSession, ChatMessage = app_module.ChatSession, app_module.ChatMessage
+
+    def unique_bytes():
+        return b'\x89PNG bench ' + uuid.uuid4().bytes
+
+    def transcription_legacy():
+        image = Image(filename='bench.png', data=unique_bytes(), content_type='image/png')
+        db.session.add(image)
+        db.session.commit()
+        transcription = FATranscription(image_id=image.id, model='bench')
+        db.session.add(transcription)
+        db.session.commit()
+        items = [FATranscriptionItem(transcription_id=transcription.id, **row) for row in rows]
+        db.session.add_all(items)
+        db.session.commit()
+        return [item.to_dict() for item in items]
+
+    def transcription_unit_of_work():
+        # Same sequence as the transcribe route: commit the upload, then the transcription in one unit
+        image = app_module.get_or_create_images([('bench.png', unique_bytes(), 'image/png')])[0]
+        db.session.commit()
+        body, status = app_module.run_fa_transcription(image.id)
+        if status != 200:
+            raise RuntimeError(body.get('error'))
+        return body["items"]
+
+    def script_legacy():
+        script = Script(title='bench', language='python', content='print(1)\n' * 40)
+        db.session.add(script)
+        db.session.commit()
+        version = ScriptVersion(script_id=script.id, version=1, content=script.content, changes="Initial generation")
+        db.session.add(version)
+        db.session.commit()
+        return script.to_dict(), version.to_dict()
+
+    def script_unit_of_work():
+        script, version = app_module.save_generated_script('python', 'bench', 'bench', 'print(1)\n' * 40)
+        return script.to_dict(), version.to_dict()
+
+    def chat_legacy():
+        chat_session = ChatSession(session_id=str(uuid.uuid4()))
+        db.session.add(chat_session)
+        db.session.commit()
+        db.session.add(ChatMessage(session_id=chat_session.id, role='user', content='How is the gateway ECU addressed?'))
+        db.session.commit()
+        db.session.add(ChatMessage(session_id=chat_session.id, role='assistant', content='Through its diagnostic address.'))
+        db.session.commit()
+
+    def chat_unit_of_work():
+        # Same sequence as /api/chat/send: session row and user message before the model call, answer after
+        chat_session = ChatSession(session_id=str(uuid.uuid4()))
+        db.session.add(chat_session)
+        db.session.flush()
+        db.session.add(ChatMessage(session_id=chat_session.id, role='user', content='How is the gateway ECU addressed?'))
+        db.session.commit()
+        db.session.add(ChatMessage(session_id=chat_session.id, role='assistant', content='Through its diagnostic address.'))
+        db.session.commit()
+
+    return {
+        "fa_transcription": {"legacy": transcription_legacy, "unit_of_work": transcription_unit_of_work},
+        "script_generate": {"legacy": script_legacy, "unit_of_work": script_unit_of_work},
+        "chat_send": {"legacy": chat_legacy, "unit_of_work": chat_unit_of_work},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark commit-per-step vs unit-of-work persistence")
+    parser.add_argument('--iterations', type=int, default=30, help="Operations per scenario and variant")
+    parser.add_argument('--items', type=int, default=40, help="FATranscriptionItem rows per transcription")
+    parser.add_argument('--database-url', help="Database to use (default: a temporary SQLite file)")
+    parser.add_argument('--json', help="Write the result rows to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='tara-bench-')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # Keep image bytes in the table for both variants so only the commit pattern differs
+    os.environ['BLOB_STORE_BACKEND'] = 'database'
+    os.environ.setdefault('OPENROUTER_API_KEY', 'bench')
+    os.environ['LLM_USAGE_LOG_ENABLED'] = 'false'
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from sqlalchemy import event
+
+    rows = sample_rows(args.items)
+    if not app_module.fa_transcriber_module:
+        parser.error("FA transcriber module failed to initialize")
+    app_module.fa_transcriber_module.transcribe_image = lambda *a, **kw: {"success": True, "data": rows}
+
+    results = []
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        commits = [0]
+        event.listen(app_module.db.engine, 'commit', lambda conn: commits.__setitem__(0, commits[0] + 1))
+
+        for scenario, variants in build_scenarios(app_module, rows).items():
+            for variant, fn in variants.items():
+                fn()  # warm-up
+                commits[0] = 0
+                timings = []
+                for _ in range(args.iterations):
+                    start = time.perf_counter()
+                    fn()
+                    timings.append((time.perf_counter() - start) * 1000)
+                    app_module.db.session.expunge_all()
+                row = {
+                    "scenario": scenario,
+                    "variant": variant,
+                    "iterations": args.iterations,
+                    "commits_per_op": round(commits[0] / args.iterations, 2),
+                    "mean_ms": round(sum(timings) / len(timings), 2),
+                    "p50_ms": round(percentile(timings, 50), 2),
+                    "p95_ms": round(percentile(timings, 95), 2)
+                }
+                results.append(row)
+                print(f"{scenario}/{variant}: p50 {row['p50_ms']} ms, {row['commits_per_op']} commits/op", file=sys.stderr)
+
+    columns = ["scenario", "variant", "iterations", "commits_per_op", "mean_ms", "p50_ms", "p95_ms"]
+    widths = {c: max(len(c), *(len(str(row[c])) for row in results)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for row in results:
+        print('  '.join(str(row[c]).ljust(widths[c]) for c in columns))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"database_url": os.environ['DATABASE_URL'], "items": args.items,
+                       "timestamp": time.time(), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
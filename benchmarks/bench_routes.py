@@ -0,0 +1,281 @@
+"""Throughput and latency benchmark for the /api/* routes.
+
+Runs each route at one or more concurrency levels against a running app
+and reports requests/second and p50/p95/p99 latency (plus time to first
+byte for streamed routes). Start the app against the local stand-in so
+results do not depend on the network or a real key, with the per-model
+rate limit off (otherwise the LLM routes measure the token bucket):
+
+    python tools/mock_openrouter.py --port 8090 --ttft 0.3 --token-rate 60 &
+    LLM_RATE_LIMIT_RPM=0 OPENROUTER_API_KEY=mock OPENROUTER_BASE_URL=http://127.0.0.1:8090/api/v1 python app.py &
+    python benchmarks/bench_routes.py --base-url http://127.0.0.1:5000 --concurrency 1,8,32 --requests 64
+
+Use --routes to pick scenarios (see --list) and --json to save the raw
+numbers for comparing before/after a change.
+"""
+import argparse
+import json
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CSRF_PATTERN = re.compile(r'csrfToken\s*=\s*"([^"]+)"')
+
+SAMPLE_SCRIPT = '''def checksum(frame):
+    total = 0
+    for byte in frame:
+        total += byte
+    return total & 0xFF
+
+
+print(checksum(b"\\x01\\x02\\x03"))
+'''
+
+
+def tiny_png(width=64, height=48, seed=0):
+    """Returns a valid grayscale PNG so the transcription route has an image to upload.
+
+    seed is written into the first pixels, so each request number gets
+    different bytes (identical uploads are answered from the stored result).
+    """
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF)
+    first = struct.pack('>I', seed % 2 ** 32) + bytes((x * 4) & 0xFF for x in range(4, width))
+    rows = b'\x00' + first + b''.join(b'\x00' + bytes((x * 4) & 0xFF for x in range(width)) for _ in range(height - 1))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows))
+            + chunk(b'IEND', b''))
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers (q in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(q / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Client:
+    """A requests session with the app's CSRF token and chat session, one per worker thread."""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        # The chat page also assigns the Flask chat session used by /api/chat/*
+        page = self.session.get(self.base_url + '/chat', timeout=timeout)
+        match = CSRF_PATTERN.search(page.text)
+        if match:
+            self.session.headers['X-CSRFToken'] = match.group(1)
+
+    def request(self, method, path, stream=False, **kwargs):
+        """Sends one request; returns (status, latency seconds, time to first byte or None, JSON body or None)."""
+        started = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, timeout=self.timeout, stream=stream, **kwargs)
+        ttfb = None
+        if stream:
+            for block in response.iter_content(chunk_size=None):
+                if ttfb is None and block:
+                    ttfb = time.perf_counter() - started
+            body = None
+        else:
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+        latency = time.perf_counter() - started
+        response.close()
+        return response.status_code, latency, ttfb, body
+
+
+class Scenario:
+    """One route exercised by the benchmark."""
+
+    def __init__(self, name, method, path, body=None, stream=False, files=None, form=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.stream = stream
+        self.files = files
+        self.form = form
+
+    def run(self, client, ctx, i):
+        path = self.path(ctx) if callable(self.path) else self.path
+        kwargs = {}
+        if self.body is not None:
+            kwargs['json'] = self.body(ctx, i) if callable(self.body) else self.body
+        if self.files is not None:
+            kwargs['files'] = self.files(ctx, i)
+            kwargs['data'] = self.form or {}
+        return client.request(self.method, path, stream=self.stream, **kwargs)
+
+
+def scenarios():
+    """All benchmarked routes; POST bodies vary with the request number i."""
+    return [
+        Scenario('status', 'GET', '/api/status'),
+        Scenario('metrics', 'GET', '/api/metrics'),
+        Scenario('metrics.usage', 'GET', '/api/metrics/usage'),
+        Scenario('chat.send', 'POST', '/api/chat/send', body=lambda ctx, i: {"message": f"Explain the role of a gateway ECU ({i})"}),
+        Scenario('chat.send.stream', 'POST', '/api/chat/send?stream=true', stream=True,
+                 body=lambda ctx, i: {"message": f"List STRIDE threats for a telematics unit ({i})"}),
+        Scenario('chat.history', 'GET', '/api/chat/history'),
+        Scenario('chat.clear', 'POST', '/api/chat/clear', body={}),
+        Scenario('coding.generate', 'POST', '/api/coding/generate',
+                 body=lambda ctx, i: {"language": "python", "requirements": f"Parse CAN frames from a log file (variant {i})", "script_name": f"bench_{i}"}),
+        Scenario('coding.generate.stream', 'POST', '/api/coding/generate?stream=true', stream=True,
+                 body=lambda ctx, i: {"language": "python", "requirements": f"Compute a rolling checksum (variant {i})", "script_name": f"bench_stream_{i}"}),
+        Scenario('coding.debug', 'POST', '/api/coding/debug',
+                 body=lambda ctx, i: {"script_id": ctx['script_id'], "script_content": SAMPLE_SCRIPT, "error_log": f"checksum wrong for frame {i}"}),
+        Scenario('coding.modify', 'POST', '/api/coding/modify',
+                 body=lambda ctx, i: {"script_id": ctx['script_id'], "script_content": SAMPLE_SCRIPT, "modification_request": f"Add a docstring mentioning case {i}"}),
+        Scenario('coding.diffcheck', 'POST', '/api/coding/diffcheck',
+                 body=lambda ctx, i: {"original_content": SAMPLE_SCRIPT, "new_content": SAMPLE_SCRIPT.replace('0xFF', hex(i % 256))}),
+        Scenario('coding.scripts', 'GET', '/api/coding/scripts'),
+        Scenario('coding.script', 'GET', lambda ctx: f"/api/coding/scripts/{ctx['script_id']}"),
+        Scenario('testing.generate', 'POST', '/api/testing/generate',
+                 body=lambda ctx, i: {"script_id": ctx['script_id'], "requirements": f"Cover edge case {i}"}),
+        Scenario('testing.execute', 'POST', '/api/testing/execute', body=lambda ctx, i: {"test_case_id": ctx['test_case_id']}),
+        Scenario('testing.improve', 'POST', '/api/testing/improve', body=lambda ctx, i: {"test_case_id": ctx['test_case_id']}),
+        Scenario('testing.test_cases', 'GET', '/api/testing/test-cases'),
+        Scenario('fa.transcribe', 'POST', '/api/fa-transcriber/transcribe',
+                 files=lambda ctx, i: {"image": (f"bench_{i}.png", tiny_png(seed=i), "image/png")}),
+        Scenario('fa.transcription', 'GET', lambda ctx: f"/api/fa-transcriber/transcriptions/{ctx['transcription_id']}"),
+        Scenario('fa.image', 'GET', lambda ctx: f"/api/fa-transcriber/images/{ctx['image_id']}"),
+        Scenario('jobs.submit', 'POST', '/api/coding/generate?async=true',
+                 body=lambda ctx, i: {"language": "python", "requirements": f"Queued generation {i}", "script_name": f"bench_job_{i}"}),
+        Scenario('jobs.status', 'GET', lambda ctx: f"/api/jobs/{ctx['job_id']}"),
+        Scenario('jobs.result', 'GET', lambda ctx: f"/api/jobs/{ctx['job_id']}/result"),
+    ]
+
+
+def setup(base_url, timeout):
+    """Creates the script, test case, transcription and job that the read/update scenarios refer to."""
+    client = Client(base_url, timeout)
+    ctx = {}
+    _, _, _, body = client.request('POST', '/api/coding/generate', json={"language": "python", "requirements": "Benchmark fixture: checksum of CAN frames", "script_name": "bench_fixture"})
+    if body and body.get('success'):
+        ctx['script_id'] = body['script']['id']
+        _, _, _, body = client.request('POST', '/api/testing/generate', json={"script_id": ctx['script_id'], "requirements": "Benchmark fixture tests"})
+        if body and body.get('success'):
+            ctx['test_case_id'] = body['test_case']['id']
+    _, _, _, body = client.request('POST', '/api/fa-transcriber/transcribe', files={"image": ("bench_fixture.png", tiny_png(), "image/png")})
+    if body and body.get('success'):
+        ctx['image_id'] = body['image_id']
+        ctx['transcription_id'] = body['transcription_id']
+    _, _, _, body = client.request('POST', '/api/coding/generate?async=true', json={"language": "python", "requirements": "Benchmark fixture job", "script_name": "bench_fixture_job"})
+    if body and body.get('job_id'):
+        ctx['job_id'] = body['job_id']
+    return ctx
+
+
+def run_scenario(scenario, ctx, base_url, concurrency, total, timeout):
+    """Runs total requests of one scenario with concurrency workers and returns the summary row."""
+    local = threading.local()
+    # Request numbers are unique across runs so POST bodies never repeat (and never hit the LLM cache)
+    first = int(time.time() * 1000) % 10 ** 9
+    counter = iter(range(first, first + total))
+    lock = threading.Lock()
+    samples = []
+
+    def worker():
+        if not hasattr(local, 'client'):
+            local.client = Client(base_url, timeout)
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            try:
+                status, latency, ttfb, _ = scenario.run(local.client, ctx, i)
+            except (requests.RequestException, KeyError) as e:
+                status, latency, ttfb = type(e).__name__, None, None
+            with lock:
+                samples.append((status, latency, ttfb))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for status, latency, _ in samples if isinstance(status, int) and status < 400]
+    ttfbs = [ttfb for _, _, ttfb in samples if ttfb is not None]
+    statuses = {}
+    for status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        "route": scenario.name,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "ok": len(latencies),
+        "statuses": statuses,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "ttfb_p50_ms": ms(percentile(ttfbs, 50)),
+        "ttfb_p95_ms": ms(percentile(ttfbs, 95))
+    }
+
+
+def print_table(rows):
+    columns = ["route", "concurrency", "requests", "ok", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "ttfb_p50_ms"]
+    widths = {c: max(len(c), *(len(str(row[c])) for row in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print('  '.join(str(row[c] if row[c] is not None else '-').ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the TARA Assistant /api/* routes")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--concurrency', default='1,8', help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=32, help="Requests per route and concurrency level")
+    parser.add_argument('--routes', help="Comma-separated scenario names (default: all)")
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--json', help="Write the result rows to this file")
+    parser.add_argument('--list', action='store_true', help="List scenario names and exit")
+    args = parser.parse_args()
+
+    all_scenarios = scenarios()
+    if args.list:
+        for scenario in all_scenarios:
+            print(f"{scenario.name:24} {scenario.method:5} {scenario.path if isinstance(scenario.path, str) else '(fixture path)'}")
+        return 0
+    if args.routes:
+        wanted = {name.strip() for name in args.routes.split(',')}
+        unknown = wanted - {s.name for s in all_scenarios}
+        if unknown:
+            parser.error(f"Unknown routes: {', '.join(sorted(unknown))}")
+        all_scenarios = [s for s in all_scenarios if s.name in wanted]
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+
+    ctx = setup(args.base_url, args.timeout)
+    print(f"Fixtures: {ctx}", file=sys.stderr)
+    rows = []
+    for scenario in all_scenarios:
+        for level in levels:
+            row = run_scenario(scenario, ctx, args.base_url, level, args.requests, args.timeout)
+            rows.append(row)
+            print(f"{row['route']} @ {level}: {row['throughput_rps']} req/s, p95 {row['p95_ms']} ms, statuses {row['statuses']}", file=sys.stderr)
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"base_url": args.base_url, "timestamp": time.time(), "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,6 +16,129 @@ class Config:
     YOUR_SITE_URL = os.environ.get('YOUR_SITE_URL', '') 
     YOUR_SITE_NAME = os.environ.get('YOUR_SITE_NAME', 'TARA Assistant')
     OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL', 'meta-llama/llama-4-maverick:free')
+    OPENROUTER_BASE_URL = os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+    
+    # LLM gateway configuration (one upstream connection pool shared by all modules)
+    LLM_HTTP2 = os.environ.get('LLM_HTTP2', 'true').lower() == 'true'
+    LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 20))
+    LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('LLM_MAX_KEEPALIVE_CONNECTIONS', 10))
+    LLM_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_KEEPALIVE_EXPIRY', 60))  # seconds
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 16))  # concurrent upstream calls
+    LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 10))
+    LLM_READ_TIMEOUT = float(os.environ.get('LLM_READ_TIMEOUT', 120))
+    LLM_WRITE_TIMEOUT = float(os.environ.get('LLM_WRITE_TIMEOUT', 30))
+    LLM_POOL_TIMEOUT = float(os.environ.get('LLM_POOL_TIMEOUT', 30))  # wait for a free pooled connection
+    LLM_COALESCE_REQUESTS = os.environ.get('LLM_COALESCE_REQUESTS', 'true').lower() == 'true'  # share in-flight identical calls
+    
+    # Upstream scheduling: per-model rate limit, queueing and retries
+    LLM_RATE_LIMIT_RPM = int(os.environ.get('LLM_RATE_LIMIT_RPM', 20))  # requests per minute per model; 0 disables
+    LLM_RATE_LIMIT_BURST = int(os.environ.get('LLM_RATE_LIMIT_BURST', 5))
+    LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 60))  # max wait for a rate-limit token or slot
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 4))  # for 429, 5xx and connection errors
+    LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', 1))  # seconds, doubled per attempt (with jitter)
+    LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', 30))
+    LLM_MAX_RETRY_AFTER = float(os.environ.get('LLM_MAX_RETRY_AFTER', 60))  # longer Retry-After fails fast
+    
+    # Model fallback chains (comma-separated OpenRouter model ids tried after OPENROUTER_MODEL)
+    CHAT_FALLBACK_MODELS = os.environ.get('CHAT_FALLBACK_MODELS', '')
+    CODING_FALLBACK_MODELS = os.environ.get('CODING_FALLBACK_MODELS', '')
+    TESTING_FALLBACK_MODELS = os.environ.get('TESTING_FALLBACK_MODELS', '')
+    FA_TRANSCRIBER_FALLBACK_MODELS = os.environ.get('FA_TRANSCRIBER_FALLBACK_MODELS', '')  # vision-capable models only
+    # Hedging: start the next model if the first has no token by its p95 time to first token
+    LLM_HEDGING_ENABLED = os.environ.get('LLM_HEDGING_ENABLED', 'true').lower() == 'true'
+    LLM_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', 0.95))
+    LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', 20))  # below this, use the default delay
+    LLM_HEDGE_DEFAULT_DELAY = float(os.environ.get('LLM_HEDGE_DEFAULT_DELAY', 8))  # seconds
+    LLM_HEDGE_MIN_DELAY = float(os.environ.get('LLM_HEDGE_MIN_DELAY', 1))
+    
+    # Region-based debugging/modification of long scripts: 'auto' for scripts of CODING_REGION_MIN_LINES lines or more,
+    # 'off' to always send them whole
+    CODING_REGION_MODE = os.environ.get('CODING_REGION_MODE', 'auto')
+    CODING_REGION_MIN_LINES = int(os.environ.get('CODING_REGION_MIN_LINES', 150))
+    CODING_REGION_MAX_LINES = int(os.environ.get('CODING_REGION_MAX_LINES', 400))  # lines of relevant regions sent per request
+    
+    # Static pre-analysis before debugging (compile/pyflakes for Python; gcc/g++ and node --check when installed)
+    STATIC_ANALYSIS_ENABLED = os.environ.get('STATIC_ANALYSIS_ENABLED', 'true').lower() == 'true'
+    STATIC_ANALYSIS_TIMEOUT = float(os.environ.get('STATIC_ANALYSIS_TIMEOUT', 5))  # seconds per compiler run
+    STATIC_ANALYSIS_CC = os.environ.get('STATIC_ANALYSIS_CC')  # defaults to gcc or clang on PATH
+    STATIC_ANALYSIS_CXX = os.environ.get('STATIC_ANALYSIS_CXX')  # defaults to g++ or clang++ on PATH
+    
+    # Per-call usage rows in the llm_usage table (latency, tokens, outcome)
+    LLM_USAGE_LOG_ENABLED = os.environ.get('LLM_USAGE_LOG_ENABLED', 'true').lower() == 'true'
+    LLM_USAGE_FLUSH_INTERVAL = float(os.environ.get('LLM_USAGE_FLUSH_INTERVAL', 5))  # seconds between batch writes
+    LLM_USAGE_BATCH_SIZE = int(os.environ.get('LLM_USAGE_BATCH_SIZE', 200))
+    
+    # FA diagram preprocessing before upload to the vision model (needs Pillow)
+    IMAGE_PREPROCESSING_ENABLED = os.environ.get('IMAGE_PREPROCESSING_ENABLED', 'true').lower() == 'true'
+    IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 2048))  # longest side in pixels
+    IMAGE_OUTPUT_FORMAT = os.environ.get('IMAGE_OUTPUT_FORMAT', 'JPEG')  # JPEG, WEBP or PNG
+    IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 90))
+    IMAGE_GRAYSCALE = os.environ.get('IMAGE_GRAYSCALE', 'false').lower() == 'true'  # keeps red/blue dashed-line cues
+    IMAGE_COLOR_THRESHOLD = int(os.environ.get('IMAGE_COLOR_THRESHOLD', 60))
+    
+    # Uploaded image storage: 'local' keeps blobs on disk (default: <instance>/blobs), 'database' in the images table
+    BLOB_STORE_BACKEND = os.environ.get('BLOB_STORE_BACKEND', 'local')
+    BLOB_STORE_PATH = os.environ.get('BLOB_STORE_PATH')
+    # Let the web server (nginx/Apache) stream image files via X-Sendfile
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+    
+    # Batch FA transcription (/api/fa-transcriber/transcribe/batch)
+    FA_BATCH_WORKERS = int(os.environ.get('FA_BATCH_WORKERS', 8))  # sheets transcribed concurrently per batch
+    FA_BATCH_MAX_FILES = int(os.environ.get('FA_BATCH_MAX_FILES', 100))
+    FA_BATCH_MAX_BYTES = int(os.environ.get('FA_BATCH_MAX_BYTES', 200 * 1024 * 1024))  # total uncompressed size of zip members
+    
+    # Tiled transcription of large FA sheets: 'auto' tiles sheets of FA_TILE_MIN_DIMENSION px or more
+    # (and retries tiled when a whole-sheet answer is cut off), 'always' or 'never'
+    FA_TILING = os.environ.get('FA_TILING', 'auto')
+    FA_TILE_MIN_DIMENSION = int(os.environ.get('FA_TILE_MIN_DIMENSION', 3000))
+    FA_TILE_SIZE = int(os.environ.get('FA_TILE_SIZE', 1600))  # source pixels per tile before overlap
+    FA_TILE_OVERLAP = float(os.environ.get('FA_TILE_OVERLAP', 0.15))  # fraction of a tile added on inner edges
+    FA_MAX_TILES = int(os.environ.get('FA_MAX_TILES', 9))
+    FA_MAX_TOKENS = int(os.environ.get('FA_MAX_TOKENS', 2500))  # per transcription call (whole sheet or tile)
+    
+    # ECU communication graph queries
+    ECU_GRAPH_MAX_PAGE_SIZE = int(os.environ.get('ECU_GRAPH_MAX_PAGE_SIZE', 500))
+    ECU_GRAPH_MAX_DEPTH = int(os.environ.get('ECU_GRAPH_MAX_DEPTH', 3))  # hops /api/ecus/<name>/neighbours may follow
+    
+    # Transcription exports (CSV / NDJSON / XLSX)
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))  # items read and written per chunk
+    
+    # Script version history: full text every N versions, diff-match-patch deltas in between
+    SCRIPT_VERSION_CHECKPOINT_INTERVAL = int(os.environ.get('SCRIPT_VERSION_CHECKPOINT_INTERVAL', 10))
+    SCRIPT_VERSION_CACHE_SIZE = int(os.environ.get('SCRIPT_VERSION_CACHE_SIZE', 128))  # materialized versions kept in memory
+    
+    # Script diffs
+    DIFF_CONTEXT_LINES = int(os.environ.get('DIFF_CONTEXT_LINES', 3))
+    DIFF_PAGE_SIZE = int(os.environ.get('DIFF_PAGE_SIZE', 50))  # hunks per page of /api/coding/scripts/<id>/diff
+    DIFF_MAX_PAGE_SIZE = int(os.environ.get('DIFF_MAX_PAGE_SIZE', 500))
+    DIFF_CACHE_SIZE = int(os.environ.get('DIFF_CACHE_SIZE', 128))  # computed diffs and rendered pages kept in memory
+    
+    # Full-text search (/api/search)
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+    SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 100))
+    SEARCH_SNIPPET_TOKENS = int(os.environ.get('SEARCH_SNIPPET_TOKENS', 16))  # words of context per snippet
+    
+    # LLM response cache (content-hash keyed, local SQLite file; opt-in per endpoint)
+    LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+    LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH')  # defaults to llm_cache.sqlite3 in the instance folder
+    LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))  # seconds
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 5000))
+    # Comma-separated endpoint names: coding.generate, coding.debug, coding.modify, testing.generate
+    LLM_CACHE_ENDPOINTS = os.environ.get('LLM_CACHE_ENDPOINTS', 'coding.generate,testing.generate')
+    
+    # Chat context window (token budget for history sent to the model)
+    CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 3000))
+    CHAT_CONTEXT_MAX_MESSAGES = int(os.environ.get('CHAT_CONTEXT_MAX_MESSAGES', 40))  # rows loaded per request
+    CHAT_SUMMARY_ENABLED = os.environ.get('CHAT_SUMMARY_ENABLED', 'true').lower() == 'true'
+    CHAT_SUMMARY_MIN_FOLD = int(os.environ.get('CHAT_SUMMARY_MIN_FOLD', 6))  # turns out of window before summarizing
+    CHAT_SUMMARY_MAX_FOLD = int(os.environ.get('CHAT_SUMMARY_MAX_FOLD', 40))
+    
+    # Background jobs (?async=true on generate/debug/test/transcribe routes)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # worker threads per process; 0 disables
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2.0))  # seconds between queue polls
+    JOB_HEARTBEAT_INTERVAL = int(os.environ.get('JOB_HEARTBEAT_INTERVAL', 30))  # seconds between heartbeats of a running job
+    JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 180))  # requeue 'running' jobs with no heartbeat for this long
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
     
     # Database configuration
     DATABASE_URL = os.environ.get('DATABASE_URL') or 'sqlite:///tara_assistant.db'
@@ -23,7 +146,7 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
     # Application configuration
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # raise for large transcription batches
 
 # Development configuration
 class DevelopmentConfig(Config):
@@ -1,14 +1,127 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import MetaData, func, insert, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+from contextlib import contextmanager
+from collections import OrderedDict
 from datetime import datetime
+from diff_match_patch import diff_match_patch
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
 
 # Initialize SQLAlchemy
 db = SQLAlchemy()
 
+@contextmanager
+def unit_of_work():
+    """Group a request's writes into one transaction with a single commit.
+
+    Inside the block use db.session.flush() where generated ids are needed
+    instead of committing. The outermost block commits on exit and rolls back
+    if it raises; nested blocks join it, so helpers that open their own unit
+    can be called from a caller's unit. Do not keep a unit open across an LLM
+    call: on SQLite the write lock is held until the commit.
+    """
+    info = db.session.info
+    depth = info.get('unit_of_work_depth', 0)
+    info['unit_of_work_depth'] = depth + 1
+    try:
+        yield db.session
+        if depth == 0:
+            db.session.commit()
+    except Exception:
+        if depth == 0:
+            db.session.rollback()
+        raise
+    finally:
+        info['unit_of_work_depth'] = depth
+
+def bulk_insert(model, rows):
+    """Insert rows (dicts of column values) with one executemany and return the new objects in order."""
+    if not rows:
+        return []
+    statement = insert(model).returning(model, sort_by_parameter_order=True)
+    return list(db.session.scalars(statement, rows))
+
+def _rebuild_sqlite_table(conn, table, existing_columns):
+    """Recreate a SQLite table from its current model definition, keeping its rows.
+
+    SQLite cannot ALTER a column's constraints, so the table is copied into a
+    new one, the old one dropped and the copy renamed (indexes are recreated
+    by the caller).
+    """
+    metadata = MetaData()
+    # Foreign keys are compiled against the referenced tables, so those need a copy too
+    for foreign_key in table.foreign_keys:
+        if foreign_key.column.table.name not in metadata.tables:
+            foreign_key.column.table.to_metadata(metadata)
+    new_table = table.to_metadata(metadata, name=f'_{table.name}_rebuild')
+    columns = ', '.join(column.name for column in table.columns if column.name in existing_columns)
+    conn.execute(CreateTable(new_table))
+    conn.execute(text(f'INSERT INTO {new_table.name} ({columns}) SELECT {columns} FROM {table.name}'))
+    conn.execute(text(f'DROP TABLE {table.name}'))
+    conn.execute(text(f'ALTER TABLE {new_table.name} RENAME TO {table.name}'))
+
+def upgrade_schema():
+    """Add columns and indexes introduced after a table was first created.
+
+    db.create_all() only creates missing tables, so existing databases would
+    lack newer columns and indexes. Added columns must be nullable (or have a
+    server default). Columns that the models have since made nullable lose
+    their NOT NULL constraint, and indexes whose uniqueness changed are
+    recreated.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns_info = inspector.get_columns(table.name)
+            existing_columns = {col['name'] for col in columns_info}
+            relaxed = [col['name'] for col in columns_info
+                       if not col['nullable'] and col['name'] in table.columns
+                       and table.columns[col['name']].nullable and not table.columns[col['name']].primary_key]
+            if relaxed and db.engine.dialect.name == 'sqlite':
+                _rebuild_sqlite_table(conn, table, existing_columns)
+                logger.info(f"Rebuilt table {table.name} to make {', '.join(relaxed)} nullable")
+                inspector = inspect(conn)
+                existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+            else:
+                for name in relaxed:
+                    conn.execute(text(f'ALTER TABLE {table.name} ALTER COLUMN {name} DROP NOT NULL'))
+                    logger.info(f"Made column {table.name}.{name} nullable")
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f"Added column {table.name}.{column.name} ({column_type})")
+            existing_indexes = {index['name']: bool(index['unique']) for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    logger.info(f"Created index {index.name} on {table.name}")
+                elif existing_indexes[index.name] != bool(index.unique):
+                    try:
+                        with conn.begin_nested():
+                            index.drop(conn)
+                            index.create(conn)
+                    except IntegrityError:
+                        # Duplicate rows from before the index became unique have to be resolved by hand
+                        logger.error(f"Could not make index {index.name} on {table.name} unique: the table has duplicate rows")
+                        continue
+                    logger.info(f"Recreated index {index.name} on {table.name} ({'unique' if index.unique else 'not unique'})")
+
 class Script(db.Model):
     """Model for storing scripts generated or modified by the application."""
     __tablename__ = 'scripts'
     
-    id = db.Column(db.BigInteger, primary_key=True)
+    # SQLite only autoincrements INTEGER primary keys
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
     language = db.Column(db.String(50), default='python')
@@ -31,17 +144,140 @@ class Script(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
 
+class VersionCache:
+    """Thread-safe LRU of materialized script version texts, keyed by (script_id, version)."""
+    
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+    
+    def put(self, key, text):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+script_version_cache = VersionCache()
+_dmp = diff_match_patch()
+
+def make_delta(old_text, new_text):
+    """diff-match-patch delta that turns old_text into new_text"""
+    diffs = _dmp.diff_main(old_text, new_text)
+    _dmp.diff_cleanupEfficiency(diffs)
+    return _dmp.diff_toDelta(diffs)
+
+def apply_delta(old_text, delta):
+    """Inverse of make_delta; raises ValueError if delta was not made from old_text"""
+    return _dmp.diff_text2(_dmp.diff_fromDelta(old_text, delta))
+
+def materialize_script_version(script_id, version):
+    """Rebuild a version's text from its checkpoint and the deltas after it"""
+    key = (script_id, version)
+    text = script_version_cache.get(key)
+    if text is not None:
+        return text
+    
+    # One query for the chain: the nearest checkpoint at or below version and every row after it
+    checkpoint = select(func.max(ScriptVersion.version)).where(
+        ScriptVersion.script_id == script_id,
+        ScriptVersion.version <= version,
+        ScriptVersion.stored_content.isnot(None)
+    ).scalar_subquery()
+    rows = {row.version: row for row in db.session.execute(
+        select(ScriptVersion.version, ScriptVersion.stored_content, ScriptVersion.delta, ScriptVersion.base_version)
+        .where(ScriptVersion.script_id == script_id, ScriptVersion.version <= version, ScriptVersion.version >= checkpoint)
+    )}
+    
+    # Walk back to a checkpoint (or a cached version), then apply the deltas forwards
+    chain = []
+    current = version
+    while True:
+        row = rows.get(current)
+        if row is None:
+            raise LookupError(f"Script {script_id} version {current} is missing from its delta chain")
+        if row.stored_content is not None:
+            text = row.stored_content
+            break
+        chain.append(row)
+        current = row.base_version
+        text = script_version_cache.get((script_id, current))
+        if text is not None:
+            break
+    for row in reversed(chain):
+        text = apply_delta(text, row.delta)
+    script_version_cache.put(key, text)
+    return text
+
 class ScriptVersion(db.Model):
-    """Model for storing versions of scripts for comparison."""
+    """Model for storing versions of scripts for comparison.
+    
+    Checkpoint rows hold the full text in the content column. Other rows
+    hold a diff-match-patch delta against version base_version and are
+    rebuilt on read (see materialize_script_version); the content property
+    hides the difference.
+    """
     __tablename__ = 'script_versions'
+    __table_args__ = (
+        db.Index('ix_script_versions_script_version', 'script_id', 'version', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     script_id = db.Column(db.BigInteger, db.ForeignKey('scripts.id'), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    stored_content = db.Column('content', db.Text)  # NULL on delta rows
+    delta = db.Column(db.Text)
+    base_version = db.Column(db.Integer)
     version = db.Column(db.Integer, nullable=False)
     changes = db.Column(db.Text)  # Description of changes
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    def __init__(self, content=None, **kwargs):
+        super().__init__(**kwargs)
+        self.content = content
+    
+    @property
+    def is_checkpoint(self):
+        return self.stored_content is not None
+    
+    @property
+    def content(self):
+        # _text is a plain attribute, so it survives the expiry of mapped columns on commit
+        text = self.__dict__.get('_text')
+        if text is None:
+            text = self.stored_content if self.is_checkpoint else materialize_script_version(self.script_id, self.version)
+            self.__dict__['_text'] = text
+        return text
+    
+    @content.setter
+    def content(self, text):
+        self.stored_content = text
+        self.delta = None
+        self.base_version = None
+        self.__dict__['_text'] = text
+    
+    def store_as_delta(self, base):
+        """Keep only a delta against base (an earlier version) if it is much smaller than the full text"""
+        text = self.content
+        delta = make_delta(base.content, text)
+        if len(delta) * 2 >= len(text):
+            return False
+        self.stored_content = None
+        self.delta = delta
+        self.base_version = base.version
+        return True
+    
     def __repr__(self):
         return f'<ScriptVersion {self.script_id}-{self.version}>'
     
@@ -63,6 +299,8 @@ class TestCase(db.Model):
     script_id = db.Column(db.BigInteger, db.ForeignKey('scripts.id'), nullable=False)
     title = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
+    language = db.Column(db.String(50))  # Language the tests were generated for
+    requirements = db.Column(db.Text)  # Requirements given at generation time
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -112,6 +350,9 @@ class ChatSession(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(50), unique=True, nullable=False)
+    # Rolling summary of turns that no longer fit in the model's context window
+    summary = db.Column(db.Text)
+    summary_upto_id = db.Column(db.Integer)  # Last ChatMessage.id folded into the summary
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -134,7 +375,7 @@ class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
     
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), nullable=False)
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), nullable=False, index=True)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -158,9 +399,14 @@ class Image(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
-    data = db.Column(db.LargeBinary, nullable=False)
+    # Image bytes when kept in the database; deferred so listing images never loads them
+    data = db.deferred(db.Column(db.LargeBinary))
     content_type = db.Column(db.String(100), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # SHA-256 of the uploaded bytes; identical uploads share one row
+    sha256 = db.Column(db.String(64), unique=True, index=True)
+    # Key in the blob store when the bytes live outside the database
+    blob_key = db.Column(db.String(128))
     
     # Relationship with transcriptions
     transcriptions = db.relationship('FATranscription', backref='image', lazy='dynamic', cascade='all, delete-orphan')
@@ -173,7 +419,8 @@ class Image(db.Model):
             'id': self.id,
             'filename': self.filename,
             'content_type': self.content_type,
-            'uploaded_at': self.uploaded_at.isoformat()
+            'uploaded_at': self.uploaded_at.isoformat(),
+            'sha256': self.sha256
         }
 
 class FATranscription(db.Model):
@@ -181,11 +428,15 @@ class FATranscription(db.Model):
     __tablename__ = 'fa_transcriptions'
     
     id = db.Column(db.Integer, primary_key=True)
-    image_id = db.Column(db.Integer, db.ForeignKey('images.id'), nullable=False)
-    processed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    image_id = db.Column(db.Integer, db.ForeignKey('images.id'), nullable=False, index=True)
+    processed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # date-range exports
+    # Model the transcription was requested from; reused for repeat uploads of the same image
+    model = db.Column(db.String(100))
     
     # Relationship with transcription items
     items = db.relationship('FATranscriptionItem', backref='transcription', lazy='dynamic', cascade='all, delete-orphan')
+    # ECU graph edges indexed from the items
+    ecu_edges = db.relationship('EcuEdge', backref='transcription', lazy='dynamic', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<FATranscription {self.id}>'
@@ -194,7 +445,8 @@ class FATranscription(db.Model):
         return {
             'id': self.id,
             'image_id': self.image_id,
-            'processed_at': self.processed_at.isoformat()
+            'processed_at': self.processed_at.isoformat(),
+            'model': self.model
         }
 
 class FATranscriptionItem(db.Model):
@@ -202,7 +454,7 @@ class FATranscriptionItem(db.Model):
     __tablename__ = 'fa_transcription_items'
     
     id = db.Column(db.Integer, primary_key=True)
-    transcription_id = db.Column(db.Integer, db.ForeignKey('fa_transcriptions.id'), nullable=False)
+    transcription_id = db.Column(db.Integer, db.ForeignKey('fa_transcriptions.id'), nullable=False, index=True)
     sheet_name = db.Column(db.String(255))
     message = db.Column(db.Text)
     start_ecu = db.Column(db.String(255))
@@ -228,3 +480,137 @@ class FATranscriptionItem(db.Model):
             'dashed_line': self.dashed_line,
             'created_at': self.created_at.isoformat()
         }
+
+class Ecu(db.Model):
+    """Model for an ECU named in FA transcriptions (one row per normalized name)."""
+    __tablename__ = 'ecus'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)  # spelling first seen
+    normalized_name = db.Column(db.String(255), nullable=False, unique=True, index=True)  # whitespace-collapsed, casefolded
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Ecu {self.name}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name
+        }
+
+class EcuEdge(db.Model):
+    """Model for one message sent from one ECU to another, indexed from a transcription item."""
+    __tablename__ = 'ecu_edges'
+    __table_args__ = (
+        db.Index('ix_ecu_edges_source_target', 'source_ecu_id', 'target_ecu_id'),
+        db.Index('ix_ecu_edges_target_source', 'target_ecu_id', 'source_ecu_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('fa_transcription_items.id', ondelete='CASCADE'), nullable=False, unique=True, index=True)
+    transcription_id = db.Column(db.Integer, db.ForeignKey('fa_transcriptions.id', ondelete='CASCADE'), nullable=False, index=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('images.id'), nullable=False, index=True)
+    source_ecu_id = db.Column(db.Integer, db.ForeignKey('ecus.id'), nullable=False)
+    target_ecu_id = db.Column(db.Integer, db.ForeignKey('ecus.id'), nullable=False)
+    message = db.Column(db.String(255), index=True)
+    sheet_name = db.Column(db.String(255), index=True)
+    dashed_line = db.Column(db.String(255))
+    
+    # Lets a transcription delete remove edges before the items they point at
+    item = db.relationship('FATranscriptionItem')
+    source = db.relationship('Ecu', foreign_keys=[source_ecu_id])
+    target = db.relationship('Ecu', foreign_keys=[target_ecu_id])
+    
+    def __repr__(self):
+        return f'<EcuEdge {self.source_ecu_id}->{self.target_ecu_id}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'item_id': self.item_id,
+            'transcription_id': self.transcription_id,
+            'image_id': self.image_id,
+            'source_ecu_id': self.source_ecu_id,
+            'target_ecu_id': self.target_ecu_id,
+            'message': self.message,
+            'sheet_name': self.sheet_name,
+            'dashed_line': self.dashed_line
+        }
+
+class Job(db.Model):
+    """Model for background jobs (LLM calls, test execution) processed by worker threads."""
+    __tablename__ = 'jobs'
+    __table_args__ = (db.Index('ix_jobs_status_created_at', 'status', 'created_at'),)
+    
+    id = db.Column(db.String(36), primary_key=True)  # uuid4
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'succeeded', 'failed'
+    payload = db.Column(db.Text)  # JSON-encoded handler input
+    result = db.Column(db.Text)  # JSON-encoded handler output
+    error = db.Column(db.Text)
+    progress = db.Column(db.Float, default=0.0)  # 0.0 - 1.0
+    progress_message = db.Column(db.String(255))
+    attempts = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # refreshed while a worker runs the job; stale means the worker died
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<Job {self.kind}-{self.id}>'
+    
+    def to_dict(self, include_result=True):
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'progress_message': self.progress_message,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+        if include_result:
+            data['result'] = json.loads(self.result) if self.result else None
+        return data
+
+class LLMUsage(db.Model):
+    """Model for per-call LLM usage records (latency, tokens, outcome)."""
+    __tablename__ = 'llm_usage'
+    __table_args__ = (db.Index('ix_llm_usage_model_created_at', 'model', 'created_at'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    endpoint = db.Column(db.String(50))  # e.g. 'chat.send', 'coding.generate'
+    model = db.Column(db.String(100), nullable=False)
+    outcome = db.Column(db.String(20), nullable=False)  # 'success', 'error', 'cancelled', 'cache_hit'
+    streamed = db.Column(db.Boolean, default=False)
+    latency_ms = db.Column(db.Integer)
+    ttft_ms = db.Column(db.Integer)
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    tokens_estimated = db.Column(db.Boolean, default=False)  # True when the upstream reported no usage
+    error = db.Column(db.String(100))  # exception class name
+    
+    def __repr__(self):
+        return f'<LLMUsage {self.model}-{self.outcome}>'
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'created_at': self.created_at.isoformat(),
+            'endpoint': self.endpoint,
+            'model': self.model,
+            'outcome': self.outcome,
+            'streamed': self.streamed,
+            'latency_ms': self.latency_ms,
+            'ttft_ms': self.ttft_ms,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'tokens_estimated': self.tokens_estimated,
+            'error': self.error
+        }
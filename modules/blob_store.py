@@ -0,0 +1,90 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Keys are lowercase hex digests, so they can never escape the store directory
+KEY_PATTERN = re.compile(r'^[0-9a-f]{16,128}$')
+
+
+class LocalBlobStore:
+    """Content-addressed blob store in a local directory.
+
+    Blobs are keyed by the SHA-256 of their bytes and sharded into two levels
+    of subdirectories (ab/cd/abcd...). Writes go to a temporary file that is
+    renamed into place, so readers never see a partial blob and storing the
+    same bytes twice is a no-op.
+    """
+
+    backend = 'local'
+
+    def __init__(self, root):
+        """Initialize the LocalBlobStore, creating its root directory if needed."""
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        """Absolute path of the blob for key (which may not exist)."""
+        if not KEY_PATTERN.match(key or ''):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data, key=None):
+        """Stores data and returns its key (the SHA-256 hex digest unless given)."""
+        key = key or hashlib.sha256(data).hexdigest()
+        path = self.path(key)
+        if os.path.exists(path):
+            return key
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key
+
+    def get(self, key):
+        """Returns the blob's bytes."""
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+def create_blob_store(config, default_root):
+    """Returns the blob store selected by BLOB_STORE_BACKEND, or None to keep blobs in the database."""
+    backend = (config.get('BLOB_STORE_BACKEND') or 'local').lower()
+    if backend == 'database':
+        return None
+    if backend != 'local':
+        logger.warning(f"Unknown BLOB_STORE_BACKEND '{backend}', keeping blobs in the database.")
+        return None
+    root = config.get('BLOB_STORE_PATH') or default_root
+    try:
+        store = LocalBlobStore(root)
+    except OSError as e:
+        # e.g. a read-only filesystem on serverless hosts
+        logger.warning(f"Blob store directory {root} is not usable ({e}); keeping blobs in the database.")
+        return None
+    logger.info(f"Storing image blobs in {store.root}")
+    return store
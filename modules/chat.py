@@ -1,7 +1,9 @@
 import logging
-from openai import OpenAI, OpenAIError
+from openai import OpenAIError
+from modules.llm_gateway import get_gateway
+from modules.llm_scheduler import PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from modules.llm_hedging import parse_model_list
 import os
-import httpx
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,28 +14,14 @@ class ChatModule:
 
     def __init__(self, config):
         """Initialize the ChatModule with application configuration."""
-        if not config.get('OPENROUTER_API_KEY'):
-            raise ValueError("OpenRouter API key not found in configuration.")
-            
-        # Create an httpx client that doesn't trust environment proxy settings
-        httpx_client = httpx.Client(trust_env=False)
-            
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=config['OPENROUTER_API_KEY'],
-            http_client=httpx_client
-        )
+        # All modules share one pooled upstream client (raises ValueError if the API key is missing)
+        self.gateway = get_gateway(config)
         self.model = config.get('OPENROUTER_MODEL', 'meta-llama/llama-4-maverick:free')
-        self.site_url = config.get('YOUR_SITE_URL')
-        self.site_name = config.get('YOUR_SITE_NAME')
-        self.extra_headers = {}
-        if self.site_url:
-            self.extra_headers["HTTP-Referer"] = self.site_url
-        if self.site_name:
-            self.extra_headers["X-Title"] = self.site_name
+        # Tried/raced after the primary model when it is slow or failing
+        self.fallback_models = parse_model_list(config.get('CHAT_FALLBACK_MODELS'))
 
-    def get_response(self, user_message, chat_history=None):
-        """Gets a response from the OpenRouter chat model based on the user message and history."""
+    def _build_messages(self, user_message, chat_history=None):
+        """Builds the message list (system prompt, history, current message) sent to the model."""
         system_prompt = "You are TARA Assistant, an expert AI knowledgeable about automotive cybersecurity, ECUs (Electronic Control Units), Threat Analysis and Risk Assessment (TARA), STRIDE, and related security concepts. Be helpful, informative, and concise."
         
         messages = [
@@ -50,21 +38,27 @@ class ChatModule:
 
         # Add the current user message
         messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def get_response(self, user_message, chat_history=None):
+        """Gets a response from the OpenRouter chat model based on the user message and history."""
+        messages = self._build_messages(user_message, chat_history)
 
         try:
-            logger.info(f"Calling OpenRouter model: {self.model} for chat with headers: {self.extra_headers}")
-            completion = self.client.chat.completions.create(
-                extra_headers=self.extra_headers,
+            logger.info(f"Calling OpenRouter model: {self.model} for chat")
+            response_content = self.gateway.complete_text(
+                messages,
+                endpoint='chat.send',
                 model=self.model,
-                messages=messages,
                 temperature=0.7, 
-                max_tokens=1500 # Adjust as needed
+                max_tokens=1500, # Adjust as needed
+                priority=PRIORITY_INTERACTIVE,
+                fallback_models=self.fallback_models
             )
-            response_content = completion.choices[0].message.content
             logger.info("OpenRouter chat call successful.")
             return {
                 "success": True,
-                "response": response_content.strip()
+                "response": response_content
             }
         except OpenAIError as e:
             logger.error(f"OpenRouter API call failed in chat module: {e}")
@@ -72,3 +66,45 @@ class ChatModule:
         except Exception as e:
             logger.error(f"An unexpected error occurred during OpenRouter call: {e}")
             return {"success": False, "error": f"An unexpected error occurred: {e}"} # Return error dict
+
+    def stream_response(self, user_message, chat_history=None):
+        """Streams the chat model's response, yielding text chunks as they arrive.
+
+        Unlike get_response, upstream errors are raised to the caller, which is
+        responsible for reporting them over the open stream.
+        """
+        messages = self._build_messages(user_message, chat_history)
+        logger.info(f"Streaming OpenRouter model: {self.model} for chat")
+        yield from self.gateway.stream_completion(
+            endpoint='chat.send',
+            model=self.model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=1500,
+            priority=PRIORITY_INTERACTIVE,
+            fallback_models=self.fallback_models
+        )
+        logger.info("OpenRouter chat stream completed.")
+
+    def summarize_history(self, previous_summary, messages):
+        """Folds older chat turns into a rolling summary; upstream errors are raised to the caller."""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        previous = previous_summary or "(none yet)"
+        prompt = (
+            f"Current summary of the conversation:\n{previous}\n\n"
+            f"Newer turns to fold in:\n{transcript}\n\n"
+            "Write the updated summary. Keep facts, ECU names, decisions and open questions; stay under 250 words."
+        )
+        logger.info(f"Summarizing {len(messages)} chat messages with model: {self.model}")
+        return self.gateway.complete_text(
+            [
+                {"role": "system", "content": "You maintain a concise running summary of a TARA Assistant chat session."},
+                {"role": "user", "content": prompt}
+            ],
+            endpoint='chat.summary',
+            model=self.model,
+            temperature=0.3,
+            max_tokens=400,
+            priority=PRIORITY_BATCH,
+            fallback_models=self.fallback_models
+        )
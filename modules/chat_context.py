@@ -0,0 +1,109 @@
+import logging
+from database import db, ChatMessage, ChatSession
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ChatContextBuilder:
+    """Builds the chat history sent to the model within a token budget.
+
+    Only the newest turns that fit CHAT_CONTEXT_TOKEN_BUDGET are loaded (with a
+    bounded query); older turns are folded into a rolling summary stored on
+    the ChatSession and sent ahead of the window.
+    """
+
+    def __init__(self, config):
+        """Initialize the ChatContextBuilder with application configuration."""
+        self.token_budget = config.get('CHAT_CONTEXT_TOKEN_BUDGET', 3000)
+        self.max_messages = config.get('CHAT_CONTEXT_MAX_MESSAGES', 40)
+        self.summary_enabled = bool(config.get('CHAT_SUMMARY_ENABLED', True))
+        self.min_fold = config.get('CHAT_SUMMARY_MIN_FOLD', 6)
+        self.max_fold = config.get('CHAT_SUMMARY_MAX_FOLD', 40)
+
+    @staticmethod
+    def estimate_tokens(text):
+        """Rough token estimate (about 4 characters per token plus per-message overhead)."""
+        return len(text or '') // 4 + 4
+
+    def _window(self, chat_session, exclude_message_id=None):
+        """Returns the newest unsummarized messages that fit the budget, oldest first."""
+        query = ChatMessage.query.filter(ChatMessage.session_id == chat_session.id)
+        if chat_session.summary_upto_id:
+            query = query.filter(ChatMessage.id > chat_session.summary_upto_id)
+        if exclude_message_id is not None:
+            query = query.filter(ChatMessage.id != exclude_message_id)
+        newest_first = query.order_by(ChatMessage.id.desc()).limit(self.max_messages).all()
+
+        budget = self.token_budget
+        if chat_session.summary:
+            budget -= self.estimate_tokens(chat_session.summary)
+
+        window = []
+        used = 0
+        for message in newest_first:
+            cost = self.estimate_tokens(message.content)
+            if window and used + cost > budget:
+                break
+            window.append(message)
+            used += cost
+        window.reverse()
+        return window
+
+    def build(self, chat_session, exclude_message_id=None):
+        """Returns the history for ChatModule: the rolling summary (if any) followed by the newest turns."""
+        history = []
+        if chat_session.summary:
+            history.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{chat_session.summary}"
+            })
+        window = self._window(chat_session, exclude_message_id)
+        history.extend({"role": message.role, "content": message.content} for message in window)
+        logger.debug(f"Built chat context for session {chat_session.id}: {len(window)} messages, summary={'yes' if chat_session.summary else 'no'}")
+        return history
+
+    def _overflow(self, chat_session):
+        """Returns the unsummarized messages older than the window (at most CHAT_SUMMARY_MAX_FOLD), oldest first."""
+        window = self._window(chat_session)
+        if not window:
+            return []
+        return ChatMessage.query.filter(
+            ChatMessage.session_id == chat_session.id,
+            ChatMessage.id < window[0].id,
+            ChatMessage.id > (chat_session.summary_upto_id or 0)
+        ).order_by(ChatMessage.id.asc()).limit(self.max_fold).all()
+
+    def needs_fold(self, chat_session):
+        """True if at least CHAT_SUMMARY_MIN_FOLD turns have fallen out of the window (no model call)."""
+        return self.summary_enabled and len(self._overflow(chat_session)) >= self.min_fold
+
+    def fold(self, chat_session, summarize):
+        """Folds turns that have slid out of the window into the stored summary.
+
+        summarize(previous_summary, messages) must return the new summary text.
+        Folding waits until at least CHAT_SUMMARY_MIN_FOLD turns have fallen
+        out, so the summarizer runs once per several turns rather than every turn.
+        The summary is only stored if no other fold of the session finished in
+        the meantime. Returns True if the summary was updated.
+        """
+        if not self.summary_enabled:
+            return False
+        overflow = self._overflow(chat_session)
+        if len(overflow) < self.min_fold:
+            return False
+
+        summary_upto_id = chat_session.summary_upto_id
+        new_summary = summarize(chat_session.summary, [{"role": m.role, "content": m.content} for m in overflow])
+        if not new_summary:
+            return False
+        # Conditional on the summary we started from, so overlapping folds cannot both apply
+        updated = ChatSession.query.filter_by(id=chat_session.id, summary_upto_id=summary_upto_id).update(
+            {"summary": new_summary, "summary_upto_id": overflow[-1].id}, synchronize_session=False)
+        db.session.commit()
+        if not updated:
+            logger.info(f"Chat session {chat_session.id} was folded concurrently; dropping this summary")
+            return False
+        logger.info(f"Folded {len(overflow)} messages into the summary for chat session {chat_session.id}")
+        return True
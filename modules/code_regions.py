@@ -0,0 +1,384 @@
+import ast
+import logging
+import re
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BRACE_LANGUAGES = {'c', 'c++', 'cpp', 'javascript', 'js', 'typescript', 'ts', 'java', 'c#', 'csharp', 'go', 'rust', 'kotlin', 'swift'}
+PYTHON_COMPOUND = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.If, ast.For, ast.AsyncFor,
+                   ast.While, ast.With, ast.AsyncWith, ast.Try) + ((ast.Match,) if hasattr(ast, 'Match') else ())
+CONTAINER_PATTERN = re.compile(r'\b(class|namespace|extern|struct|interface|impl|module)\b')
+CALL_NAME_PATTERN = re.compile(r'([A-Za-z_~][\w:~]*)\s*\(')
+TYPE_NAME_PATTERN = re.compile(r'\b(?:class|struct|enum|union|namespace|interface|impl|fn|func|function)\s*\*?\s*([A-Za-z_]\w*)')
+ASSIGNED_NAME_PATTERN = re.compile(r'([A-Za-z_$][\w$]*)\s*[:=]\s*(?:async\s*)?(?:function\b|\()')
+NOT_NAMES = {'if', 'for', 'while', 'switch', 'return', 'catch', 'sizeof', 'elif', 'else', 'do', 'defined'}
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_][A-Za-z0-9_]{2,}')
+LINE_REFERENCE_PATTERNS = [re.compile(r'\bline\s+(\d+)', re.IGNORECASE), re.compile(r':(\d+)(?::\d+)?(?=[:\s)]|$)', re.MULTILINE)]
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'into', 'all', 'add', 'use', 'make', 'should', 'when',
+    'not', 'are', 'but', 'can', 'please', 'change', 'fix', 'error', 'line', 'file', 'function', 'code', 'script',
+    'new', 'each', 'its', 'has', 'have', 'return', 'value', 'values', 'also', 'instead', 'sure', 'traceback',
+    'most', 'recent', 'call', 'last', 'self', 'true', 'false', 'none', 'null', 'int', 'str', 'void', 'const'
+}
+REGION_HEADER = re.compile(r'^#{2,}\s*(REGION\s+(\d+)|IMPORTS)\b.*$', re.MULTILINE)
+
+
+def detect_language(source, language=None):
+    """'python', 'brace' or None for a script (the stored language wins when known)."""
+    name = (language or '').strip().lower()
+    if name in ('python', 'py'):
+        return 'python'
+    if name in BRACE_LANGUAGES:
+        return 'brace'
+    if name:
+        return None
+    try:
+        ast.parse(source)
+        return 'python'
+    except (SyntaxError, ValueError):
+        pass
+    if source.count('{') >= 2 and source.count('{') == source.count('}'):
+        return 'brace'
+    # A Python script that does not parse (the usual case when debugging)
+    return 'python' if re.search(r'^(def|class)\s+\w+.*:\s*$', source, re.MULTILINE) else None
+
+
+def _python_regions(source):
+    tree = ast.parse(source)
+    regions = []
+
+    def add(node, prefix=''):
+        start = min([node.lineno] + [d.lineno for d in getattr(node, 'decorator_list', [])]) - 1
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            name = prefix + node.name
+        else:
+            name = source.splitlines()[node.lineno - 1].strip().rstrip(':')[:60]
+        regions.append({"name": name, "start": start, "end": node.end_lineno})
+
+    for node in tree.body:
+        if not isinstance(node, PYTHON_COMPOUND):
+            continue
+        methods = [child for child in getattr(node, 'body', []) if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))]
+        if isinstance(node, ast.ClassDef) and methods:
+            # Methods are the regions; the class line and class attributes stay in the outline
+            for method in methods:
+                add(method, node.name + '.')
+        else:
+            add(node)
+    return regions
+
+
+def _indent_regions(source):
+    """Top-level blocks of a Python script that does not parse: a zero-indent line ending in ':' up to the next zero-indent line."""
+    lines = source.splitlines()
+    regions = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line[:1].strip() and line.rstrip().endswith(':') and not line.startswith('#'):
+            start = i
+            while start > 0 and lines[start - 1].startswith('@'):
+                start -= 1
+            end = i + 1
+            while end < len(lines) and (not lines[end].strip() or lines[end][:1].isspace() or lines[end].startswith(('#', ')', ']', '}'))):
+                end += 1
+            while end > i + 1 and not lines[end - 1].strip():
+                end -= 1
+            match = re.match(r'(?:async\s+)?(?:def|class)\s+(\w+)', line)
+            regions.append({"name": match.group(1) if match else line.strip().rstrip(':')[:60], "start": start, "end": end})
+            i = end
+        else:
+            i += 1
+    return regions
+
+
+def _brace_depths(lines):
+    """Brace depth before each line, ignoring braces in strings and comments (heuristic)."""
+    depths = []
+    depth = 0
+    in_block_comment = False
+    for line in lines:
+        depths.append(depth)
+        i = 0
+        quote = None
+        while i < len(line):
+            pair = line[i:i + 2]
+            char = line[i]
+            if in_block_comment:
+                if pair == '*/':
+                    in_block_comment = False
+                    i += 1
+            elif quote:
+                if char == '\\':
+                    i += 1
+                elif char == quote:
+                    quote = None
+            elif pair == '//':
+                break
+            elif pair == '/*':
+                in_block_comment = True
+                i += 1
+            elif char in '"\'`':
+                quote = char
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth = max(0, depth - 1)
+            i += 1
+    depths.append(depth)
+    return depths
+
+
+def _brace_name(signature, start):
+    for pattern in (TYPE_NAME_PATTERN, ASSIGNED_NAME_PATTERN):
+        match = pattern.search(signature)
+        if match:
+            return match.group(1)
+    names = [name for name in CALL_NAME_PATTERN.findall(signature) if name not in NOT_NAMES]
+    return names[-1] if names else f"block@{start + 1}"
+
+
+def _brace_blocks(lines, depths, level, lo, hi):
+    """Blocks opening at brace depth level within lines[lo:hi], with their signature lines."""
+    blocks = []
+    i = lo
+    while i < hi:
+        if depths[i] == level and depths[i + 1] > level:
+            end = i + 1
+            while end < hi and depths[end] > level:
+                end += 1
+            # Pull in a multi-line signature and the comment right above it
+            start = i
+            while start > lo and depths[start - 1] == level:
+                previous = lines[start - 1].strip()
+                if not previous or previous.endswith((';', '}')) or previous.startswith('#'):
+                    break
+                start -= 1
+            if end - i > 1:
+                signature = ' '.join(line.strip() for line in lines[start:i + 1])
+                blocks.append({"name": _brace_name(signature, start), "start": start, "end": end, "opens": i, "signature": signature})
+            i = end
+        else:
+            i += 1
+    return blocks
+
+
+def _brace_regions(source):
+    lines = source.splitlines()
+    depths = _brace_depths(lines)
+    regions = []
+    pending = _brace_blocks(lines, depths, 0, 0, len(lines))
+    while pending:
+        block = pending.pop(0)
+        inner = []
+        if CONTAINER_PATTERN.search(block["signature"].split('(')[0]):
+            inner = _brace_blocks(lines, depths, depths[block["opens"]] + 1, block["opens"] + 1, block["end"] - 1)
+        if inner:
+            # Classes and namespaces are split into their members; their own header stays in the outline
+            for member in inner:
+                member["name"] = f"{block['name']}.{member['name']}"
+            pending = inner + pending
+        else:
+            regions.append({"name": block["name"], "start": block["start"], "end": block["end"]})
+    return sorted(regions, key=lambda region: region["start"])
+
+
+def split_regions(source, language=None):
+    """Top-level functions/blocks of a script as [{name, start, end}] (0-based line range), or None.
+
+    Python uses the AST (methods of a class are separate regions), or
+    indentation if the script does not parse; C-like languages use brace
+    depth. None means the script could not be split and
+    must be sent whole.
+    """
+    kind = detect_language(source, language)
+    try:
+        if kind == 'python':
+            try:
+                regions = _python_regions(source)
+            except SyntaxError:
+                regions = _indent_regions(source)
+        elif kind == 'brace':
+            regions = _brace_regions(source)
+        else:
+            return None
+    except (SyntaxError, ValueError) as e:
+        logger.info(f"Could not split script into regions: {e}")
+        return None
+    return regions or None
+
+
+def _query_terms(text):
+    return {term.lower() for term in IDENTIFIER_PATTERN.findall(text or '')} - STOPWORDS
+
+
+def select_regions(source, regions, instruction, error_log='', max_lines=400):
+    """Indexes of the regions relevant to instruction/error_log, best first, within max_lines; [] if none stand out.
+
+    Regions named in the text or containing a line number cited by the
+    error log are always candidates; otherwise regions sharing at least two
+    identifiers with the text are.
+    """
+    lines = source.splitlines()
+    text = f"{instruction or ''}\n{error_log or ''}"
+    terms = _query_terms(text)
+    cited_lines = set()
+    for pattern in LINE_REFERENCE_PATTERNS:
+        cited_lines.update(int(number) - 1 for number in pattern.findall(error_log or ''))
+
+    scored = []
+    for index, region in enumerate(regions):
+        score = 0
+        for name in {region["name"], region["name"].rsplit('.', 1)[-1]}:
+            if re.search(rf'(?<![\w.]){re.escape(name)}(?!\w)', text):
+                score += 10
+        if any(region["start"] <= line < region["end"] for line in cited_lines):
+            score += 20
+        overlap = len(terms & _query_terms('\n'.join(lines[region["start"]:region["end"]])))
+        if score or overlap >= 2:
+            scored.append((score + overlap, index))
+
+    selected = []
+    budget = max_lines
+    for _, index in sorted(scored, reverse=True):
+        size = regions[index]["end"] - regions[index]["start"]
+        if size <= budget:
+            selected.append(index)
+            budget -= size
+    return selected
+
+
+def outline(source, regions, selected, max_gap_lines=12):
+    """The script with selected regions replaced by [[REGION n]] markers and the others by their first line."""
+    lines = source.splitlines()
+    owner = {}
+    for index, region in enumerate(regions):
+        for line in range(region["start"], region["end"]):
+            owner.setdefault(line, index)
+
+    out = []
+    gap = []
+
+    def flush_gap():
+        if len(gap) > max_gap_lines:
+            out.extend(gap[:max_gap_lines // 2] + [f"    ... ({len(gap) - max_gap_lines // 2} more lines)"])
+        else:
+            out.extend(gap)
+        gap.clear()
+
+    line = 0
+    while line < len(lines):
+        index = owner.get(line)
+        if index is None:
+            gap.append(lines[line])
+            line += 1
+            continue
+        flush_gap()
+        region = regions[index]
+        if index in selected:
+            out.append(f"[[REGION {selected.index(index) + 1}: {region['name']}]]")
+        else:
+            first = lines[region["start"]]
+            indent = first[:len(first) - len(first.lstrip())]
+            out.append(first)
+            out.append(f"{indent}    ... ({region['end'] - region['start'] - 1} lines)")
+        line = region["end"]
+    flush_gap()
+    return '\n'.join(out)
+
+
+def region_prompt(source, regions, selected, language=None):
+    """Outline plus the numbered selected regions, for the user prompt."""
+    lines = source.splitlines()
+    parts = [f"Outline of the {language or ''} script (other code elided):\n```\n{outline(source, regions, selected)}\n```\n"]
+    for number, index in enumerate(selected, 1):
+        region = regions[index]
+        code = '\n'.join(lines[region["start"]:region["end"]])
+        parts.append(f"### REGION {number}: {region['name']} (lines {region['start'] + 1}-{region['end']})\n```\n{code}\n```")
+    return '\n'.join(parts)
+
+
+REGION_INSTRUCTIONS = (
+    "You are given an outline of a long script and only the regions of it relevant to the task. "
+    "Reply with each region you change as a '### REGION <n>' heading followed by the complete new code of that "
+    "region in a code block, keeping its original indentation. A region may grow to include new helper functions. "
+    "Omit regions you do not change. If new imports or includes are needed, add a '### IMPORTS' heading with them in a code block. "
+    "Do not output the rest of the script."
+)
+
+
+def _strip_fences(text):
+    text = text.strip('\n')
+    match = re.search(r'```[^\n]*\n(.*?)(?:\n```|$)', text, re.DOTALL)
+    return match.group(1) if match else text
+
+
+def parse_region_reply(reply):
+    """Returns (text before the first heading, {region number: code}, [import lines])."""
+    matches = list(REGION_HEADER.finditer(reply or ''))
+    preamble = reply[:matches[0].start()] if matches else (reply or '')
+    replacements, imports = {}, []
+    for i, match in enumerate(matches):
+        body = reply[match.end():matches[i + 1].start() if i + 1 < len(matches) else len(reply)]
+        code = _strip_fences(body)
+        if match.group(2):
+            replacements[int(match.group(2))] = code
+        else:
+            imports.extend(line for line in code.splitlines() if line.strip())
+    return preamble, replacements, imports
+
+
+def _reindent(code, original_first_line):
+    """Restore the region's indentation if the model returned it dedented."""
+    indent = original_first_line[:len(original_first_line) - len(original_first_line.lstrip())]
+    code_lines = code.splitlines()
+    first = next((line for line in code_lines if line.strip()), '')
+    if indent and not first.startswith(indent):
+        return '\n'.join(indent + line if line.strip() else line for line in code_lines)
+    return code
+
+
+def _import_anchor(lines, kind):
+    """Index of the line after the last top-of-file import/include (0 if none)."""
+    anchor = 0
+    for number, line in enumerate(lines):
+        stripped = line.strip()
+        if kind == 'python':
+            if line.startswith(('import ', 'from ')):
+                anchor = number + 1
+        elif stripped.startswith(('#include', 'import ', 'using ')) or re.match(r'(const|let|var)\s+\w+\s*=\s*require\(', stripped):
+            anchor = number + 1
+    return anchor
+
+
+def splice(source, regions, selected, replacements, imports=(), language=None):
+    """Source with the given region numbers replaced (and imports added); None if valid Python stops parsing."""
+    lines = source.splitlines()
+    numbers = [number for number in replacements if 1 <= number <= len(selected)]
+    for number in sorted(numbers, key=lambda n: regions[selected[n - 1]]["start"], reverse=True):
+        region = regions[selected[number - 1]]
+        code = _reindent(replacements[number], lines[region["start"]])
+        lines[region["start"]:region["end"]] = code.splitlines()
+    kind = detect_language(source, language)
+    new_imports = [line for line in imports if line not in lines]
+    if new_imports:
+        anchor = _import_anchor(lines, kind)
+        lines[anchor:anchor] = new_imports
+    result = '\n'.join(lines) + ('\n' if source.endswith('\n') else '')
+    if kind == 'python' and _parses(source):
+        try:
+            ast.parse(result)
+        except SyntaxError as e:
+            logger.warning(f"Spliced script does not parse ({e}); discarding the region edit")
+            return None
+    return result
+
+
+def _parses(source):
+    try:
+        ast.parse(source)
+        return True
+    except (SyntaxError, ValueError):
+        return False
@@ -1,61 +1,104 @@
 import logging
-from openai import OpenAI, OpenAIError
-import httpx
-from diff_match_patch import diff_match_patch
+from openai import OpenAIError
+from modules.llm_gateway import get_gateway
+from modules.llm_hedging import parse_model_list
+from modules.code_regions import REGION_INSTRUCTIONS, parse_region_reply, region_prompt, select_regions, splice, split_regions
+from modules.static_analysis import StaticAnalyzer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class CodeFenceStripper:
+    """Incrementally removes markdown code fences from streamed model output.
+
+    Mirrors the post-processing done on full responses: a leading ```lang line
+    is dropped and a trailing ``` fence is withheld, so only code is emitted.
+    """
+
+    FENCE = "```"
+
+    def __init__(self):
+        self._buffer = ""
+        self._head_checked = False
+
+    def feed(self, text):
+        """Adds a chunk of model output and returns the code that is safe to emit."""
+        self._buffer += text
+        if not self._head_checked:
+            stripped = self._buffer.lstrip()
+            if not stripped:
+                return ""
+            if stripped.startswith(self.FENCE) or self.FENCE.startswith(stripped):
+                if '\n' not in stripped:
+                    return "" # Wait for the rest of the opening fence line
+                stripped = stripped.split('\n', 1)[1] # Skip the first line like ```python
+            self._buffer = stripped
+            self._head_checked = True
+
+        # Hold back trailing whitespace and a last line that could still turn into the closing fence
+        code = self._buffer.rstrip()
+        last_newline = code.rfind('\n')
+        if last_newline != -1 and self.FENCE.startswith(code[last_newline + 1:].strip()):
+            cut = last_newline
+        else:
+            cut = len(code) - min(len(code) - len(code.rstrip('`')), len(self.FENCE))
+        emit, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        return emit
+
+    def finish(self):
+        """Flushes the withheld tail, minus any closing fence."""
+        tail = self._buffer.rstrip()
+        if not self._head_checked:
+            tail = tail.lstrip()
+            if tail.startswith(self.FENCE):
+                tail = tail.split('\n', 1)[1] if '\n' in tail else tail[len(self.FENCE):]
+        if tail.endswith(self.FENCE):
+            tail = tail[:-len(self.FENCE)]
+            if tail.endswith('\n'):
+                tail = tail[:-1]
+        self._buffer = ""
+        return tail
+
 class CodingModule:
     """Handles script generation, debugging, and modification using an AI model via OpenRouter."""
 
     def __init__(self, config):
         """Initialize the CodingModule with application configuration."""
-        if not config.get('OPENROUTER_API_KEY'):
-            raise ValueError("OpenRouter API key not found in configuration.")
-            
-        # Create an httpx client that doesn't trust environment proxy settings
-        httpx_client = httpx.Client(trust_env=False)
-        
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=config['OPENROUTER_API_KEY'],
-            http_client=httpx_client
-        )
+        # All modules share one pooled upstream client (raises ValueError if the API key is missing)
+        self.gateway = get_gateway(config)
         self.model = config.get('OPENROUTER_MODEL', 'meta-llama/llama-4-maverick:free')
-        self.site_url = config.get('YOUR_SITE_URL') 
-        self.site_name = config.get('YOUR_SITE_NAME') 
-        self.extra_headers = {}
-        if self.site_url:
-            self.extra_headers["HTTP-Referer"] = self.site_url
-        if self.site_name:
-            self.extra_headers["X-Title"] = self.site_name
-
-    def _call_openrouter(self, system_prompt, user_prompt):
-        """Helper method to make calls to the OpenRouter API."""
+        # Tried/raced after the primary model when it is slow or failing
+        self.fallback_models = parse_model_list(config.get('CODING_FALLBACK_MODELS'))
+        # Long scripts are debugged/modified region by region instead of being sent and returned whole
+        self.region_mode = (config.get('CODING_REGION_MODE') or 'auto').lower()
+        self.region_min_lines = config.get('CODING_REGION_MIN_LINES', 150)
+        self.region_max_lines = config.get('CODING_REGION_MAX_LINES', 400)
+        # Compile/lint checks run before debugging; trivial fixes never reach the model
+        self.static_analyzer = StaticAnalyzer(config)
+
+    def _call_openrouter(self, system_prompt, user_prompt, endpoint=None):
+        """Helper method to make calls to the OpenRouter API (endpoint names the caller for response caching)."""
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
         
-        # Log the prompts and payload before sending
-        logger.info(f"_call_openrouter - System Prompt: {system_prompt}")
-        logger.info(f"_call_openrouter - User Prompt: {user_prompt}")
-        logger.info(f"_call_openrouter - Sending messages payload: {messages}") 
-        logger.info(f"Calling OpenRouter model: {self.model} for coding with headers: {self.extra_headers}")
+        # Prompt sizes only; the prompts themselves contain user code and requirements
+        logger.debug(f"_call_openrouter - prompt sizes: system={len(system_prompt)} user={len(user_prompt)} chars")
+        logger.info(f"Calling OpenRouter model: {self.model} for coding ({endpoint or 'coding'})")
         
         try:
-            completion = self.client.chat.completions.create(
-                extra_headers=self.extra_headers,
+            response_content = self.gateway.complete_text(
+                messages,
+                endpoint=endpoint,
                 model=self.model,
-                messages=messages,
                 temperature=0.7, # Adjust temperature as needed
-                max_tokens=2048 # Adjust max tokens as needed
+                max_tokens=2048, # Adjust max tokens as needed
+                fallback_models=self.fallback_models
             )
-            response_content = completion.choices[0].message.content
             logger.info("OpenRouter call successful.")
-            return response_content.strip()
+            return response_content
         except OpenAIError as e:
             logger.error(f"OpenRouter API call failed: {e}")
             raise
@@ -63,13 +106,110 @@ class CodingModule:
             logger.error(f"An unexpected error occurred during OpenRouter call: {e}")
             raise
 
-    def generate_script(self, language, requirements):
-        """Generates a script based on language and requirements using OpenRouter."""
+    def _stream_openrouter(self, system_prompt, user_prompt, endpoint=None):
+        """Streams a call to the OpenRouter API, yielding code with markdown fences stripped on the fly."""
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        logger.info(f"Streaming OpenRouter model: {self.model} for coding")
+
+        stripper = CodeFenceStripper()
+        for delta in self.gateway.stream_completion(
+            messages,
+            endpoint=endpoint,
+            model=self.model,
+            temperature=0.7,
+            max_tokens=2048,
+            fallback_models=self.fallback_models
+        ):
+            code = stripper.feed(delta)
+            if code:
+                yield code
+        tail = stripper.finish()
+        if tail:
+            yield tail
+        logger.info("OpenRouter coding stream completed.")
+
+    @staticmethod
+    def _generate_prompts(language, requirements):
+        """Builds the system and user prompts for script generation."""
         system_prompt = f"You are an expert programmer specializing in {language} for automotive cybersecurity applications. Generate a complete, well-commented, and functional script based ONLY on the user's requirements. Output ONLY the raw code for the script, without any introduction, explanation, or surrounding text."
         user_prompt = f"Language: {language}\nRequirements: {requirements}"
+        return system_prompt, user_prompt
+
+    @staticmethod
+    def _modify_prompts(script_content, modification_prompt):
+        """Builds the system and user prompts for script modification."""
+        system_prompt = "You are an expert programmer. Modify the following script based ONLY on the user's instructions. Output ONLY the raw modified code, without any introduction, explanation, or surrounding text."
+        user_prompt = f"Script to modify:\n```\n{script_content}\n```\n\nModification instructions: {modification_prompt}"
+        return system_prompt, user_prompt
+
+    def _plan_regions(self, script_content, instruction, error_log='', language=None):
+        """Returns (regions, selected) if the script should be edited by region, else None."""
+        if self.region_mode == 'off' or script_content.count('\n') + 1 < self.region_min_lines:
+            return None
+        regions = split_regions(script_content, language)
+        if not regions:
+            return None
+        selected = select_regions(script_content, regions, instruction, error_log, self.region_max_lines)
+        if not selected:
+            logger.info("No region of the script stands out for this request; sending the whole script.")
+            return None
+        sent = sum(regions[i]["end"] - regions[i]["start"] for i in selected)
+        logger.info(f"Region mode: sending {sent} of {script_content.count(chr(10)) + 1} lines ({', '.join(regions[i]['name'] for i in selected)})")
+        return regions, selected
+
+    def _edit_regions(self, plan, script_content, system_prompt, user_prompt, endpoint, language=None):
+        """Calls the model on the planned regions; returns (reply preamble, spliced script or None, edited region names)."""
+        regions, selected = plan
+        reply = self._call_openrouter(system_prompt, user_prompt, endpoint=endpoint)
+        preamble, replacements, imports = parse_region_reply(reply)
+        if not replacements and not imports:
+            return preamble, script_content, []
+        edited = [regions[selected[n - 1]]["name"] for n in sorted(replacements) if 1 <= n <= len(selected)]
+        return preamble, splice(script_content, regions, selected, replacements, imports, language), edited
+
+    def _modify_regions(self, script_content, modification_prompt, language=None):
+        """Region-scoped modification; returns a result dict, or None to fall back to sending the whole script."""
+        plan = self._plan_regions(script_content, modification_prompt, language=language)
+        if not plan:
+            return None
+        system_prompt = "You are an expert programmer. Modify the script based ONLY on the user's instructions. " + REGION_INSTRUCTIONS
+        user_prompt = f"{region_prompt(script_content, *plan, language)}\n\nModification instructions: {modification_prompt}"
+        _, modified_code, edited = self._edit_regions(plan, script_content, system_prompt, user_prompt, 'coding.modify', language)
+        if modified_code is None or not edited and modified_code == script_content:
+            logger.warning("Region edit returned nothing usable; sending the whole script instead.")
+            return None
+        return {
+            "modified_code": modified_code,
+            "explanation": f"Script modified according to request: {modification_prompt[:100]}... (edited: {', '.join(edited) or 'imports'})",
+            "regions": edited
+        }
+
+    def _debug_regions(self, script_content, error_log, language=None, hints=''):
+        """Region-scoped debugging driven by the error log and static analysis hints; returns a result dict, or None to fall back."""
+        plan = self._plan_regions(script_content, '', f"{error_log}\n{hints}", language)
+        if not plan:
+            return None
+        system_prompt = ("You are an expert code debugger. Find the cause of the reported error in the regions shown and fix it. "
+                         "Start with a concise 'Analysis:' section, then give the corrected regions. " + REGION_INSTRUCTIONS)
+        user_prompt = f"{region_prompt(script_content, *plan, language)}\n\nError log/description: {error_log}"
+        if hints:
+            user_prompt += f"\n\n{hints}"
+        preamble, fixed_code, edited = self._edit_regions(plan, script_content, system_prompt, user_prompt, 'coding.debug', language)
+        if fixed_code is None or not edited and fixed_code == script_content:
+            logger.warning("Region edit returned nothing usable; sending the whole script instead.")
+            return None
+        analysis = preamble.split("Analysis:", 1)[-1].strip() or "Analysis not explicitly found."
+        return {"analysis": analysis, "fixed_code": fixed_code, "regions": edited}
+
+    def generate_script(self, language, requirements):
+        """Generates a script based on language and requirements using OpenRouter."""
+        system_prompt, user_prompt = self._generate_prompts(language, requirements)
         
         try:
-            generated_code = self._call_openrouter(system_prompt, user_prompt)
+            generated_code = self._call_openrouter(system_prompt, user_prompt, endpoint='coding.generate')
             # Post-processing: Ensure it looks like code, remove potential ``` markdown
             if generated_code.startswith(f"```{language}"):
                 generated_code = generated_code[len(f"```{language}\n"):]
@@ -89,16 +229,33 @@ class CodingModule:
             logger.error(f"Error in generate_script: {e}")
             return f"Error generating script: {e}"
 
-    def debug_script(self, script_content, error_log=''):
+    def stream_generate_script(self, language, requirements):
+        """Streams a generated script chunk by chunk; upstream errors are raised to the caller."""
+        system_prompt, user_prompt = self._generate_prompts(language, requirements)
+        yield from self._stream_openrouter(system_prompt, user_prompt, endpoint='coding.generate')
+
+    def debug_script(self, script_content, error_log='', language=None):
         """Debugs the provided script using OpenRouter, identifying issues and suggesting fixes."""
         system_prompt = "You are an expert code debugger. Analyze the following script, identify any bugs, security vulnerabilities, or potential issues. Provide a concise analysis of the problems found and then provide the corrected version of the script. Format your response clearly with 'Analysis:' section and 'Corrected Script:' section. Output ONLY the analysis and the raw corrected code, without any other introduction or explanation."
-        
-        # Include error log in user prompt if provided
-        error_info = f"\n\nError log/description: {error_log}" if error_log else ""
-        user_prompt = f"Script to debug:\n```\n{script_content}\n```{error_info}"
+        original_script = script_content
 
         try:
-            response = self._call_openrouter(system_prompt, user_prompt)
+            # Local compile/lint first: trivial fixes are returned directly, other findings become prompt hints
+            pre = self.static_analyzer.quick_debug(script_content, error_log, language)
+            if pre["result"]:
+                return dict(pre["result"], static_analysis=pre["summary"])
+            script_content = pre["script"]  # the model sees the script with the local fixes already applied
+
+            # Include error log and static analysis findings in user prompt if provided
+            error_info = f"\n\nError log/description: {error_log}" if error_log else ""
+            if pre["hints"]:
+                error_info += f"\n\n{pre['hints']}"
+            user_prompt = f"Script to debug:\n```\n{script_content}\n```{error_info}"
+
+            region_result = self._debug_regions(script_content, error_log, language, pre["hints"])
+            if region_result:
+                return dict(region_result, static_analysis=pre["summary"])
+            response = self._call_openrouter(system_prompt, user_prompt, endpoint='coding.debug')
             
             # Parse the response to separate analysis and fixed code
             analysis = "Could not parse analysis from response."
@@ -144,22 +301,25 @@ class CodingModule:
 
             return {
                 "analysis": analysis,
-                "fixed_code": fixed_code
+                "fixed_code": fixed_code,
+                "static_analysis": pre["summary"]
             }
         except Exception as e:
             logger.error(f"Error in debug_script: {e}")
             return {
                 "analysis": f"Error during debugging: {e}",
-                "fixed_code": script_content # Return original script on error
+                "fixed_code": original_script # Return original script on error
             }
 
-    def modify_script(self, script_content, modification_prompt):
+    def modify_script(self, script_content, modification_prompt, language=None):
         """Modifies the provided script based on the modification prompt using OpenRouter."""
-        system_prompt = "You are an expert programmer. Modify the following script based ONLY on the user's instructions. Output ONLY the raw modified code, without any introduction, explanation, or surrounding text."
-        user_prompt = f"Script to modify:\n```\n{script_content}\n```\n\nModification instructions: {modification_prompt}"
+        system_prompt, user_prompt = self._modify_prompts(script_content, modification_prompt)
         
         try:
-            modified_code = self._call_openrouter(system_prompt, user_prompt)
+            region_result = self._modify_regions(script_content, modification_prompt, language)
+            if region_result:
+                return region_result
+            modified_code = self._call_openrouter(system_prompt, user_prompt, endpoint='coding.modify')
             # Post-processing: Ensure it looks like code, remove potential ``` markdown
             if modified_code.startswith("```"):
                 lines = modified_code.split('\n', 1)
@@ -177,21 +337,12 @@ class CodingModule:
             logger.error(f"Error in modify_script: {e}")
             return f"Error modifying script: {e}"
 
-    @staticmethod
-    def calculate_diff(text1, text2):
-        """Calculates the difference between two texts using diff-match-patch."""
-        dmp = diff_match_patch()
-        diffs = dmp.diff_main(text1, text2)
-        dmp.diff_cleanupSemantic(diffs)
-        
-        # Format diff for HTML display (similar to GitHub diff view)
-        html_diff = []
-        for (op, data) in diffs:
-            text = data.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\n", "&para;\n")
-            if op == dmp.DIFF_INSERT:
-                html_diff.append(f'<span class="diff-line-added">+{text}</span>')
-            elif op == dmp.DIFF_DELETE:
-                html_diff.append(f'<span class="diff-line-removed">-{text}</span>')
-            elif op == dmp.DIFF_EQUAL:
-                html_diff.append(f'<span>{text}</span>')
-        return "".join(html_diff)
+    def stream_modify_script(self, script_content, modification_prompt, language=None):
+        """Streams the modified script chunk by chunk; upstream errors are raised to the caller."""
+        # A region edit is short, so it is made in one call and the spliced script sent as a single chunk
+        region_result = self._modify_regions(script_content, modification_prompt, language)
+        if region_result:
+            yield region_result["modified_code"]
+            return
+        system_prompt, user_prompt = self._modify_prompts(script_content, modification_prompt)
+        yield from self._stream_openrouter(system_prompt, user_prompt, endpoint='coding.modify')
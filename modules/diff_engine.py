@@ -0,0 +1,186 @@
+import difflib
+import hashlib
+import html
+import logging
+import math
+import threading
+from collections import OrderedDict
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DIFF_FORMATS = ('unified', 'side_by_side', 'json')
+IDENTICAL_HTML = "<div class='bg-yellow-100 p-2 rounded'>No changes made - code is identical.</div>"
+
+
+class DiffEngine:
+    """Line diffs of scripts as hunks, rendered as unified HTML, side-by-side HTML or JSON.
+
+    The hunks of a pair of texts are computed once (difflib with autojunk
+    off, so repeated lines such as blank lines and closing braces still
+    align) and kept in an LRU, as is every rendered page. Callers comparing
+    stored versions pass a key like ('version', script_id, v1, v2) since
+    those texts never change; otherwise the texts' hashes are the key.
+    Large diffs are served DIFF_PAGE_SIZE hunks at a time.
+    """
+
+    def __init__(self, config):
+        """Initialize the DiffEngine with application configuration."""
+        self.context_lines = config.get('DIFF_CONTEXT_LINES', 3)
+        self.page_size = config.get('DIFF_PAGE_SIZE', 50)
+        self.max_page_size = config.get('DIFF_MAX_PAGE_SIZE', 500)
+        self.cache_size = config.get('DIFF_CACHE_SIZE', 128)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key, compute):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._cache[key] = value
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def _text_key(self, old_text, new_text):
+        digest = hashlib.sha256()
+        for text in (old_text, new_text):
+            data = text.encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'big'))
+            digest.update(data)
+        return ('text', digest.hexdigest())
+
+    def compute(self, old_text, new_text):
+        """Returns {"identical", "stats", "hunks"} for two texts (uncached)."""
+        old_lines, new_lines = old_text.splitlines(), new_text.splitlines()
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        hunks = []
+        added = removed = 0
+        for group in matcher.get_grouped_opcodes(self.context_lines):
+            lines = []
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    lines.extend({"op": " ", "old": i + 1, "new": j1 + (i - i1) + 1, "text": old_lines[i]} for i in range(i1, i2))
+                    continue
+                if tag in ('replace', 'delete'):
+                    lines.extend({"op": "-", "old": i + 1, "new": None, "text": old_lines[i]} for i in range(i1, i2))
+                    removed += i2 - i1
+                if tag in ('replace', 'insert'):
+                    lines.extend({"op": "+", "old": None, "new": j + 1, "text": new_lines[j]} for j in range(j1, j2))
+                    added += j2 - j1
+            first, last = group[0], group[-1]
+            hunks.append({
+                "old_start": first[1] + 1,
+                "old_lines": last[2] - first[1],
+                "new_start": first[3] + 1,
+                "new_lines": last[4] - first[3],
+                "lines": lines
+            })
+        return {
+            "identical": old_text == new_text,
+            "stats": {"added": added, "removed": removed, "hunks": len(hunks)},
+            "hunks": hunks
+        }
+
+    def diff(self, old_text, new_text, key=None):
+        """Cached compute(); key identifies the pair when the texts are immutable (e.g. stored versions)."""
+        key = key or self._text_key(old_text, new_text)
+        return self._cached(('hunks',) + tuple(key), lambda: self.compute(old_text, new_text))
+
+    def render(self, old_text, new_text, diff_format='unified', page=1, page_size=None, key=None):
+        """One page of the diff in diff_format, with paging information.
+
+        HTML formats return "diff_html"; json returns the page's "hunks".
+        """
+        if diff_format not in DIFF_FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(DIFF_FORMATS)}")
+        page_size = max(1, min(int(page_size or self.page_size), self.max_page_size))
+        key = key or self._text_key(old_text, new_text)
+        result = self.diff(old_text, new_text, key)
+        pages = max(1, math.ceil(len(result["hunks"]) / page_size))
+        page = max(1, min(int(page or 1), pages))
+
+        def build():
+            hunks = result["hunks"][(page - 1) * page_size:page * page_size]
+            body = {
+                "identical": result["identical"],
+                "stats": result["stats"],
+                "format": diff_format,
+                "page": page,
+                "pages": pages,
+                "page_size": page_size
+            }
+            if diff_format == 'json':
+                body["hunks"] = hunks
+            elif result["identical"]:
+                body["diff_html"] = IDENTICAL_HTML
+            elif diff_format == 'unified':
+                body["diff_html"] = self.unified_html(hunks)
+            else:
+                body["diff_html"] = self.side_by_side_html(hunks)
+            return body
+
+        return self._cached(('page',) + tuple(key) + (diff_format, page, page_size), build)
+
+    def unified(self, old_text, new_text):
+        """The whole diff as unified HTML (the inline view after a debug or modify)."""
+        result = self.diff(old_text, new_text)
+        if result["identical"]:
+            return IDENTICAL_HTML
+        return self.unified_html(result["hunks"])
+
+    def unified_html(self, hunks):
+        parts = []
+        for hunk in hunks:
+            header = f"@@ -{hunk['old_start']},{hunk['old_lines']} +{hunk['new_start']},{hunk['new_lines']} @@"
+            parts.append(f"<div class='diff-line-info bg-blue-100 text-blue-800'>{header}</div>")
+            for line in hunk["lines"]:
+                css = {"+": "diff-line-added", "-": "diff-line-removed"}.get(line["op"], "diff-line")
+                parts.append(f"<div class='{css}'>{html.escape(line['op'] + line['text'])}</div>")
+        return f"<div class='font-mono text-sm whitespace-pre-wrap'>{''.join(parts)}</div>"
+
+    def side_by_side_html(self, hunks):
+        rows = []
+        for hunk in hunks:
+            header = f"@@ -{hunk['old_start']},{hunk['old_lines']} +{hunk['new_start']},{hunk['new_lines']} @@"
+            rows.append(f"<tr><td colspan='4' class='diff-line-info bg-blue-100 text-blue-800'>{header}</td></tr>")
+            removed, added = [], []
+
+            def flush():
+                # A run of removals followed by additions is shown as changed lines side by side
+                for index in range(max(len(removed), len(added))):
+                    left = removed[index] if index < len(removed) else None
+                    right = added[index] if index < len(added) else None
+                    rows.append(self._side_by_side_row(left, right, 'diff-line-removed', 'diff-line-added'))
+                removed.clear()
+                added.clear()
+
+            for line in hunk["lines"]:
+                if line["op"] == "-":
+                    if added:
+                        flush()
+                    removed.append(line)
+                elif line["op"] == "+":
+                    added.append(line)
+                else:
+                    flush()
+                    rows.append(self._side_by_side_row(line, line, 'diff-line', 'diff-line'))
+            flush()
+        return f"<table class='diff-side-by-side font-mono text-sm'>{''.join(rows)}</table>"
+
+    def _side_by_side_row(self, left, right, left_css, right_css):
+        cells = []
+        for line, number_key, css in ((left, "old", left_css), (right, "new", right_css)):
+            if line is None:
+                cells.append("<td class='diff-line-number'></td><td class='diff-line-empty'></td>")
+            else:
+                cells.append(f"<td class='diff-line-number'>{line[number_key]}</td><td class='{css}'>{html.escape(line['text'])}</td>")
+        return f"<tr>{''.join(cells)}</tr>"
@@ -0,0 +1,254 @@
+import logging
+from sqlalchemy import delete, func, insert, or_, select
+from sqlalchemy.orm import aliased
+from database import db, Ecu, EcuEdge, FATranscription
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+GROUP_BY_OPTIONS = ('sender', 'receiver', 'pair', 'sheet', 'message')
+# Message filters; exact and prefix can use the index on ecu_edges.message, contains scans every edge
+MESSAGE_MATCH_OPTIONS = ('exact', 'prefix', 'contains')
+
+
+def normalize_ecu_name(name):
+    """Key an ECU name is matched on: whitespace collapsed, case folded."""
+    return ' '.join(str(name or '').split()).casefold()
+
+
+class EcuGraph:
+    """ECU communication graph built from FA transcription items.
+
+    Each item whose sending (or start) and receiving (or end) ECU are known
+    becomes an edge between two rows of the ecus table, so questions such as
+    "everything Gateway sends" are indexed lookups instead of scans over
+    every transcription. Only the latest transcription of an image is
+    indexed; indexing a newer one drops the edges of the older ones.
+    """
+
+    def __init__(self, config):
+        """Initialize the EcuGraph with application configuration."""
+        self.max_page_size = config.get('ECU_GRAPH_MAX_PAGE_SIZE', 500)
+        self.max_depth = config.get('ECU_GRAPH_MAX_DEPTH', 3)
+
+    def _insert_missing_ecus(self, rows):
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        elif dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            db.session.execute(insert(Ecu), rows)
+            return
+        # Another request may add the same ECU concurrently; the unique index decides and we re-read
+        db.session.execute(dialect_insert(Ecu).on_conflict_do_nothing(index_elements=['normalized_name']), rows)
+
+    def ecu_ids(self, names):
+        """Returns {normalized name: Ecu id} for names, adding ECUs not seen before."""
+        wanted = {}
+        for name in names:
+            key = normalize_ecu_name(name)
+            if key and key not in wanted:
+                wanted[key] = ' '.join(str(name).split())[:255]
+        if not wanted:
+            return {}
+        lookup = select(Ecu.normalized_name, Ecu.id)
+        ids = dict(db.session.execute(lookup.where(Ecu.normalized_name.in_(list(wanted)))).all())
+        missing = [key for key in wanted if key not in ids]
+        if missing:
+            self._insert_missing_ecus([{"name": wanted[key], "normalized_name": key[:255]} for key in missing])
+            ids.update(db.session.execute(lookup.where(Ecu.normalized_name.in_(missing))).all())
+        return ids
+
+    def index_items(self, transcription, items, replace_older=True):
+        """Adds edges for items of transcription (in the caller's transaction); returns the edge count.
+
+        With replace_older the edges of earlier transcriptions of the same
+        image are removed, so a re-transcribed sheet is not counted twice.
+        """
+        # Items missing either end (e.g. a line leaving the sheet) are not edges
+        endpoints = []
+        for item in items:
+            source = item.sending_ecu or item.start_ecu
+            target = item.receiving_ecu or item.end_ecu
+            if normalize_ecu_name(source) and normalize_ecu_name(target):
+                endpoints.append((item, source, target))
+        ids = self.ecu_ids(name for _, source, target in endpoints for name in (source, target))
+
+        if replace_older:
+            self.drop_superseded(transcription)
+        rows = []
+        for item, source, target in endpoints:
+            rows.append({
+                "item_id": item.id,
+                "transcription_id": transcription.id,
+                "image_id": transcription.image_id,
+                "source_ecu_id": ids[normalize_ecu_name(source)],
+                "target_ecu_id": ids[normalize_ecu_name(target)],
+                "message": (item.message or '')[:255] or None,
+                "sheet_name": item.sheet_name or None,
+                "dashed_line": item.dashed_line or None
+            })
+        if rows:
+            db.session.execute(insert(EcuEdge), rows)
+        return len(rows)
+
+    def drop_superseded(self, transcription):
+        """Removes edges of other transcriptions of the same image."""
+        db.session.execute(
+            delete(EcuEdge)
+            .where(EcuEdge.image_id == transcription.image_id, EcuEdge.transcription_id != transcription.id)
+            .execution_options(synchronize_session=False)
+        )
+
+    def rebuild(self, batch_size=200):
+        """Rebuilds the graph from the latest transcription of every image; returns (transcriptions, edges)."""
+        db.session.execute(delete(EcuEdge))
+        db.session.execute(delete(Ecu))
+        db.session.commit()
+
+        latest = select(func.max(FATranscription.id)).group_by(FATranscription.image_id)
+        transcription_ids = sorted(db.session.scalars(latest))
+        edges = 0
+        for start in range(0, len(transcription_ids), batch_size):
+            batch = db.session.scalars(select(FATranscription).where(FATranscription.id.in_(transcription_ids[start:start + batch_size]))).all()
+            for transcription in batch:
+                edges += self.index_items(transcription, transcription.items.all(), replace_older=False)
+            db.session.commit()
+            db.session.expunge_all()
+        logger.info(f"Rebuilt ECU graph: {len(transcription_ids)} transcriptions, {edges} edges")
+        return len(transcription_ids), edges
+
+    def find_ecu(self, name):
+        return db.session.scalars(select(Ecu).where(Ecu.normalized_name == normalize_ecu_name(name))).first()
+
+    def _page(self, limit, offset):
+        limit = max(1, min(int(limit or 100), self.max_page_size))
+        return limit, max(0, int(offset or 0))
+
+    def list_ecus(self, query=None, limit=100, offset=0):
+        """ECUs (optionally name-filtered) with their outgoing and incoming message counts."""
+        limit, offset = self._page(limit, offset)
+        outgoing = select(EcuEdge.source_ecu_id.label('ecu_id'), func.count().label('count')).group_by(EcuEdge.source_ecu_id).subquery()
+        incoming = select(EcuEdge.target_ecu_id.label('ecu_id'), func.count().label('count')).group_by(EcuEdge.target_ecu_id).subquery()
+        statement = (
+            select(Ecu, func.coalesce(outgoing.c.count, 0), func.coalesce(incoming.c.count, 0))
+            .outerjoin(outgoing, outgoing.c.ecu_id == Ecu.id)
+            .outerjoin(incoming, incoming.c.ecu_id == Ecu.id)
+        )
+        if query:
+            statement = statement.where(Ecu.normalized_name.contains(normalize_ecu_name(query), autoescape=True))
+        total = db.session.scalar(select(func.count()).select_from(statement.subquery()))
+        rows = db.session.execute(statement.order_by(Ecu.name).limit(limit).offset(offset)).all()
+        return {
+            "total": total,
+            "ecus": [dict(ecu.to_dict(), sends=sends, receives=receives) for ecu, sends, receives in rows]
+        }
+
+    def find_edges(self, sender=None, receiver=None, ecu=None, message=None, sheet=None,
+                   transcription_id=None, image_id=None, limit=100, offset=0, match='exact'):
+        """Edges matching every given filter, with both ECU names; returns {"total", "edges"}.
+
+        message is compared as given by match: the whole name (exact), its
+        start (prefix) or, case-insensitively, any part of it (contains).
+        LIKE wildcards in message are matched literally.
+        """
+        match = match or 'exact'
+        if match not in MESSAGE_MATCH_OPTIONS:
+            raise ValueError(f"match must be one of: {', '.join(MESSAGE_MATCH_OPTIONS)}")
+        limit, offset = self._page(limit, offset)
+        source, target = aliased(Ecu), aliased(Ecu)
+        statement = (
+            select(EcuEdge, source.name, target.name)
+            .join(source, EcuEdge.source_ecu_id == source.id)
+            .join(target, EcuEdge.target_ecu_id == target.id)
+        )
+        if sender:
+            statement = statement.where(source.normalized_name == normalize_ecu_name(sender))
+        if receiver:
+            statement = statement.where(target.normalized_name == normalize_ecu_name(receiver))
+        if ecu:
+            key = normalize_ecu_name(ecu)
+            statement = statement.where(or_(source.normalized_name == key, target.normalized_name == key))
+        if message:
+            if match == 'exact':
+                statement = statement.where(EcuEdge.message == message)
+            elif match == 'prefix':
+                statement = statement.where(EcuEdge.message.startswith(message, autoescape=True))
+            else:
+                statement = statement.where(EcuEdge.message.icontains(message, autoescape=True))
+        if sheet:
+            statement = statement.where(EcuEdge.sheet_name == sheet)
+        if transcription_id:
+            statement = statement.where(EcuEdge.transcription_id == transcription_id)
+        if image_id:
+            statement = statement.where(EcuEdge.image_id == image_id)
+        total = db.session.scalar(select(func.count()).select_from(statement.subquery()))
+        rows = db.session.execute(statement.order_by(EcuEdge.id).limit(limit).offset(offset)).all()
+        return {
+            "total": total,
+            "edges": [dict(edge.to_dict(), sender=sender_name, receiver=receiver_name) for edge, sender_name, receiver_name in rows]
+        }
+
+    def neighbours(self, name, direction='both', depth=1):
+        """ECUs reachable from name within depth hops; None if the ECU is unknown.
+
+        Each neighbour is reported once, at the hop it is first reached, with
+        the number of messages on the edges that reached it.
+        """
+        ecu = self.find_ecu(name)
+        if not ecu:
+            return None
+        depth = max(1, min(int(depth or 1), self.max_depth))
+        directions = ('out', 'in') if direction == 'both' else (direction,)
+        seen = {ecu.id}
+        frontier = {ecu.id}
+        found = {}
+        for hop in range(1, depth + 1):
+            reached = {}
+            for way in directions:
+                near, far = (EcuEdge.source_ecu_id, EcuEdge.target_ecu_id) if way == 'out' else (EcuEdge.target_ecu_id, EcuEdge.source_ecu_id)
+                statement = select(far, func.count(), func.count(func.distinct(EcuEdge.sheet_name))).where(near.in_(frontier)).group_by(far)
+                for ecu_id, messages, sheets in db.session.execute(statement):
+                    if ecu_id in seen:
+                        continue
+                    entry = reached.setdefault(ecu_id, {"hop": hop, "directions": [], "messages": 0, "sheets": 0})
+                    entry["directions"].append(way)
+                    entry["messages"] += messages
+                    entry["sheets"] = max(entry["sheets"], sheets)
+            if not reached:
+                break
+            found.update(reached)
+            seen.update(reached)
+            frontier = set(reached)
+
+        names = dict(db.session.execute(select(Ecu.id, Ecu.name).where(Ecu.id.in_(list(found)))).all()) if found else {}
+        neighbours = [dict(entry, id=ecu_id, name=names.get(ecu_id)) for ecu_id, entry in found.items()]
+        neighbours.sort(key=lambda entry: (entry["hop"], -entry["messages"], entry["name"] or ''))
+        return {"ecu": ecu.to_dict(), "direction": direction, "depth": depth, "neighbours": neighbours}
+
+    def aggregate(self, group_by='pair', limit=100, offset=0):
+        """Message and sheet counts grouped by sender, receiver, sender/receiver pair, sheet or message."""
+        if group_by not in GROUP_BY_OPTIONS:
+            raise ValueError(f"group_by must be one of: {', '.join(GROUP_BY_OPTIONS)}")
+        limit, offset = self._page(limit, offset)
+        source, target = aliased(Ecu), aliased(Ecu)
+        keys = {
+            'sender': [source.name.label('sender')],
+            'receiver': [target.name.label('receiver')],
+            'pair': [source.name.label('sender'), target.name.label('receiver')],
+            'sheet': [EcuEdge.sheet_name.label('sheet')],
+            'message': [EcuEdge.message.label('message')],
+        }[group_by]
+        messages = func.count().label('messages')
+        statement = (
+            select(*keys, messages, func.count(func.distinct(EcuEdge.sheet_name)).label('sheets'))
+            .select_from(EcuEdge)
+            .join(source, EcuEdge.source_ecu_id == source.id)
+            .join(target, EcuEdge.target_ecu_id == target.id)
+            .group_by(*keys)
+        )
+        total = db.session.scalar(select(func.count()).select_from(statement.subquery()))
+        rows = db.session.execute(statement.order_by(messages.desc(), *keys).limit(limit).offset(offset)).mappings().all()
+        return {"group_by": group_by, "total": total, "groups": [dict(row) for row in rows]}
@@ -1,57 +1,20 @@
 import logging
 import base64
 import json
-from openai import OpenAI, OpenAIError
-import httpx
+import re
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAIError
+from modules.llm_gateway import get_gateway
+from modules.llm_hedging import parse_model_list
+from modules.image_preprocessing import ImagePreprocessor
+from modules.json_stream import JSONArrayStream
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class FATranscriberModule:
-    """Handles FA diagram transcription using AI."""
-
-    def __init__(self, config):
-        """Initialize the FATranscriberModule with application configuration."""
-        if not config.get('OPENROUTER_API_KEY'):
-            raise ValueError("OpenRouter API key not found in configuration.")
-            
-        # Create an httpx client that doesn't trust environment proxy settings
-        httpx_client = httpx.Client(trust_env=False)
-            
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=config['OPENROUTER_API_KEY'],
-            http_client=httpx_client
-        )
-        # Only use the configured model
-        self.model = config.get('OPENROUTER_MODEL', 'meta-llama/llama-4-maverick:free')
-        self.site_url = config.get('YOUR_SITE_URL')
-        self.site_name = config.get('YOUR_SITE_NAME')
-        self.extra_headers = {}
-        if self.site_url:
-            self.extra_headers["HTTP-Referer"] = self.site_url
-        if self.site_name:
-            self.extra_headers["X-Title"] = self.site_name
-
-    def transcribe_image(self, image_data, filename=None, content_type=None):
-        """Transcribes a FA diagram image using OpenRouter AI vision capabilities."""
-        try:
-            # Set default content type if not provided
-            if not content_type:
-                content_type = "image/jpeg"
-                
-            # Prepare base64 encoded image
-            if isinstance(image_data, bytes):
-                encoded_image = base64.b64encode(image_data).decode('utf-8')
-            else:
-                # Assume already base64 encoded
-                encoded_image = image_data
-            
-            logger.info(f"Processing image with content type: {content_type}")
-            
-            # Create the system prompt to instruct the AI
-            system_prompt = """
+# Instructions for the vision model; the answer is a JSON array with one object per message row
+SYSTEM_PROMPT = """
 You are an expert in functional architecture (FA) diagrams analysis for automotive systems. You need to extract information from a car architecture diagram showing ECUs and their communications. Follow these instructions precisely:
 
 1. Identify the **Sheet Name** at the top-left corner of the diagram.
@@ -84,39 +47,245 @@ You are an expert in functional architecture (FA) diagrams analysis for automoti
 Format your response as a clean JSON array with each object having the 7 fields mentioned above.
 Do not include any text outside the JSON array. Use the exact column names shown above as keys.
 """
+
+
+def standardize_item(item):
+    """Maps a row object from the model (column-name keys) onto the FATranscriptionItem fields."""
+    return {
+        "sheet_name": item.get("Sheet Name", ""),
+        "message": item.get("Message", ""),
+        "start_ecu": item.get("Start ECU", ""),
+        "end_ecu": item.get("End ECU", ""),
+        "sending_ecu": item.get("Sending ECU", ""),
+        "receiving_ecu": item.get("Receiving ECU", ""),
+        "dashed_line": item.get("Dashed Line", "")
+    }
+
+
+class FATranscriberModule:
+    """Handles FA diagram transcription using AI."""
+
+    def __init__(self, config):
+        """Initialize the FATranscriberModule with application configuration."""
+        # All modules share one pooled upstream client (raises ValueError if the API key is missing)
+        self.gateway = get_gateway(config)
+        # Primary model; fallbacks must also accept image input
+        self.model = config.get('OPENROUTER_MODEL', 'meta-llama/llama-4-maverick:free')
+        self.fallback_models = parse_model_list(config.get('FA_TRANSCRIBER_FALLBACK_MODELS'))
+        # Downscales/re-encodes uploads before they are base64-encoded into the request
+        self.preprocessor = ImagePreprocessor(config)
+        # Large sheets are split into overlapping tiles transcribed concurrently ('auto', 'always' or 'never')
+        self.tiling = (config.get('FA_TILING') or 'auto').lower()
+        self.tile_min_dimension = config.get('FA_TILE_MIN_DIMENSION', 3000)
+        self.tile_size = config.get('FA_TILE_SIZE', 1600)
+        self.tile_overlap = config.get('FA_TILE_OVERLAP', 0.15)
+        self.max_tiles = config.get('FA_MAX_TILES', 9)
+        self.max_tokens = config.get('FA_MAX_TOKENS', 2500)
+
+    def transcribe_image(self, image_data, filename=None, content_type=None, tiling=None):
+        """Transcribes a FA diagram image using OpenRouter AI vision capabilities.
+
+        tiling overrides FA_TILING for this call: 'always' tiles the image,
+        'never' sends it whole, 'auto' tiles sheets of FA_TILE_MIN_DIMENSION
+        or more and retries tiled when a whole-sheet answer was cut off.
+        """
+        tiling = (tiling or self.tiling).lower()
+        try:
+            # Set default content type if not provided
+            if not content_type:
+                content_type = "image/jpeg"
             
-            # User message with the image
-            user_message = {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": "Analyze this functional architecture diagram and extract the information as instructed."
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:{content_type};base64,{encoded_image}"
-                        }
-                    }
-                ]
-            }
+            if not isinstance(image_data, bytes):
+                # Assume already base64 encoded
+                return self._transcribe_encoded(image_data, content_type)
+            
+            if tiling != 'never':
+                min_dimension = None if tiling == 'always' else self.tile_min_dimension
+                tiles = self.preprocessor.tiles(image_data, self.tile_size, self.tile_overlap, self.max_tiles, min_dimension)
+                if tiles:
+                    return self._transcribe_tiles(tiles)
+            
+            # Prepare base64 encoded image
+            processed_data, processed_type, _ = self.preprocessor.process(image_data, content_type)
+            encoded_image = base64.b64encode(processed_data).decode('utf-8')
+            result = self._transcribe_encoded(encoded_image, processed_type)
             
-            # Create the messages array
-            messages = [
-                {"role": "system", "content": system_prompt},
-                user_message
+            if result.get("truncated") and tiling == 'auto':
+                tiles = self.preprocessor.tiles(image_data, self.tile_size, self.tile_overlap, self.max_tiles)
+                if tiles:
+                    logger.warning(f"Whole-sheet transcription was cut off; retrying as {len(tiles)} tiles")
+                    return self._transcribe_tiles(tiles)
+            return result
+                
+        except OpenAIError as e:
+            logger.error(f"OpenRouter API call failed in FA transcriber module: {e}")
+            return {
+                "success": False,
+                "error": f"OpenRouter API Error: {e}"
+            }
+        except Exception as e:
+            logger.error(f"An unexpected error occurred during OpenRouter call: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return {
+                "success": False, 
+                "error": f"An unexpected error occurred: {e}"
+            }
+
+    def stream_transcription(self, image_data, content_type=None, tiling=None):
+        """Transcribes image bytes, yielding each row as soon as the model has written it.
+
+        Yields ('item', row) events and then one ('done', info) event, where
+        info may hold tiles, truncated, partial and warning. Upstream errors
+        are raised. Tiled sheets have to be merged first, so their rows all
+        arrive when the last tile finishes. With tiling 'auto', a whole-sheet
+        answer that was cut off is retried tiled, as in transcribe_image: a
+        ('reset', info) event then tells the consumer to drop the rows it got
+        so far. When no retry is possible the rows are kept and info has
+        partial=True.
+        """
+        tiling = (tiling or self.tiling).lower()
+        content_type = content_type or "image/jpeg"
+        
+        if tiling != 'never':
+            min_dimension = None if tiling == 'always' else self.tile_min_dimension
+            tiles = self.preprocessor.tiles(image_data, self.tile_size, self.tile_overlap, self.max_tiles, min_dimension)
+            if tiles:
+                yield from self._stream_tiles(tiles)
+                return
+        
+        processed_data, processed_type, _ = self.preprocessor.process(image_data, content_type)
+        encoded_image = base64.b64encode(processed_data).decode('utf-8')
+        messages = self._build_messages(encoded_image, processed_type)
+        
+        logger.info(f"Streaming transcription from model: {self.model}")
+        parser = JSONArrayStream()
+        deltas = self.gateway.stream_completion(
+            messages,
+            model=self.model,
+            endpoint='fa_transcriber.transcribe',
+            temperature=0.3,
+            max_tokens=self.max_tokens,
+            fallback_models=self.fallback_models
+        )
+        try:
+            for delta in deltas:
+                for item in parser.feed(delta):
+                    if isinstance(item, dict):
+                        yield 'item', standardize_item(item)
+        finally:
+            # Also closes the upstream response if our consumer stopped early
+            deltas.close()
+        
+        info = {}
+        if not parser.closed:
+            # Cut off at max_tokens (or not an array at all): the complete rows were already yielded
+            tiles = self.preprocessor.tiles(image_data, self.tile_size, self.tile_overlap, self.max_tiles) if tiling == 'auto' else None
+            if tiles:
+                logger.warning(f"Streamed transcription was cut off after {parser.count} rows; retrying as {len(tiles)} tiles")
+                yield 'reset', {"warning": f"Response ended early; transcribing the sheet again as {len(tiles)} tiles."}
+                yield from self._stream_tiles(tiles)
+                return
+            logger.warning(f"Streamed transcription ended before the JSON array closed ({parser.count} rows kept)")
+            info = {"truncated": True, "partial": True,
+                    "warning": f"Response ended early; the transcription is partial ({parser.count} complete rows kept)."}
+        logger.info(f"Streamed transcription produced {parser.count} rows")
+        yield 'done', info
+
+    def _stream_tiles(self, tiles):
+        """Yields the merged rows of a tiled transcription as stream_transcription events."""
+        result = self._transcribe_tiles(tiles)
+        if not result["success"]:
+            raise RuntimeError(result["error"])
+        for row in result["data"]:
+            yield 'item', row
+        yield 'done', {key: result[key] for key in ("tiles", "warning") if key in result}
+
+    def _transcribe_tiles(self, tiles):
+        """Transcribes tiles concurrently and merges their rows into one result."""
+        rows = max(tile["row"] for tile in tiles) + 1
+        cols = max(tile["col"] for tile in tiles) + 1
+        
+        def transcribe_tile(tile):
+            region = (
+                f"This image is one tile (row {tile['row'] + 1} of {rows}, column {tile['col'] + 1} of {cols}) "
+                "cut from a larger diagram, overlapping its neighbours. Transcribe only messages whose text is "
+                "fully visible in this tile. If the sheet name is not visible here, leave Sheet Name empty."
+            )
+            encoded_image = base64.b64encode(tile["data"]).decode('utf-8')
+            try:
+                return self._transcribe_encoded(encoded_image, tile["content_type"], region)
+            except Exception as e:
+                logger.error(f"Tile {tile['row']},{tile['col']} failed: {e}")
+                return {"success": False, "error": str(e)}
+        
+        # Every tile runs at once; the gateway's scheduler bounds the upstream concurrency
+        with ThreadPoolExecutor(max_workers=len(tiles), thread_name_prefix='fa-tile') as pool:
+            results = list(pool.map(transcribe_tile, tiles))
+        
+        for tile, result in zip(tiles, results):
+            if not result["success"]:
+                # A missing tile would silently drop rows, so the sheet fails as a whole
+                return {
+                    "success": False,
+                    "error": f"Tile row {tile['row'] + 1}, column {tile['col'] + 1} failed: {result.get('error')}"
+                }
+        
+        merged = merge_tile_rows([result["data"] for result in results])
+        logger.info(f"Merged {sum(len(result['data']) for result in results)} tile rows into {len(merged)} items")
+        transcription = {"success": True, "data": merged, "tiles": len(tiles)}
+        warnings = [result["warning"] for result in results if result.get("warning")]
+        if warnings:
+            transcription["warning"] = f"{len(warnings)} of {len(tiles)} tiles returned incomplete output: {warnings[0]}"
+        return transcription
+
+    def _build_messages(self, encoded_image, content_type, region=None):
+        """Builds the system prompt and image message for one transcription call."""
+        # User message with the image
+        user_message = {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": "Analyze this functional architecture diagram and extract the information as instructed." + (f" {region}" if region else "")
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{content_type};base64,{encoded_image}"
+                    }
+                }
             ]
+        }
+
+        # Create the messages array
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            user_message
+        ]
+        return messages
+
+    def _transcribe_encoded(self, encoded_image, content_type, region=None):
+        """Makes one transcription call for a base64 image; returns the result dict.
+
+        region is extra instruction text for tiles. The result has
+        truncated=True when the answer hit the token limit or was not JSON.
+        """
+        try:
+            logger.info(f"Processing image with content type: {content_type}")
+            
+            messages = self._build_messages(encoded_image, content_type, region)
             
             # API call to the model
             try:
                 logger.info(f"Calling OpenRouter with model: {self.model}")
-                completion = self.client.chat.completions.create(
+                completion = self.gateway.create_completion(
+                    endpoint='fa_transcriber.transcribe',
                     model=self.model,
                     messages=messages,
                     temperature=0.3,
-                    max_tokens=2500,
-                    extra_headers=self.extra_headers  # Using extra_headers instead of headers
+                    max_tokens=self.max_tokens,
+                    fallback_models=self.fallback_models
                 )
                 logger.info(f"API Response received from {self.model}")
             except Exception as api_err:
@@ -184,6 +353,10 @@ Do not include any text outside the JSON array. Use the exact column names shown
                 }
                 
             response_content = message.content
+            # 'length' means the JSON array was cut off at max_tokens and rows are missing
+            truncated = getattr(first_choice, 'finish_reason', None) == 'length'
+            if truncated:
+                logger.warning(f"Transcription hit the {self.max_tokens} token limit; output is incomplete")
             
             logger.info("OpenRouter FA transcription call successful.")
             logger.info(f"Response content length: {len(response_content)} characters")
@@ -205,7 +378,6 @@ Do not include any text outside the JSON array. Use the exact column names shown
             
             # If the response doesn't look like JSON, try to extract it
             if not (response_content.startswith('[') or response_content.startswith('{')):
-                import re
                 json_pattern = r'\[\s*\{.*?\}\s*\]'
                 json_match = re.search(json_pattern, response_content, re.DOTALL)
                 
@@ -238,16 +410,7 @@ Do not include any text outside the JSON array. Use the exact column names shown
                         logger.warning(f"Skipping non-dictionary item in result: {str(item)[:50]}...")
                         continue
                         
-                    standardized_item = {
-                        "sheet_name": item.get("Sheet Name", ""),
-                        "message": item.get("Message", ""),
-                        "start_ecu": item.get("Start ECU", ""),
-                        "end_ecu": item.get("End ECU", ""),
-                        "sending_ecu": item.get("Sending ECU", ""),
-                        "receiving_ecu": item.get("Receiving ECU", ""),
-                        "dashed_line": item.get("Dashed Line", "")
-                    }
-                    standardized_result.append(standardized_item)
+                    standardized_result.append(standardize_item(item))
                 
                 logger.info(f"Processed {len(standardized_result)} items from the transcription")
                 
@@ -256,18 +419,26 @@ Do not include any text outside the JSON array. Use the exact column names shown
                     logger.warning("No valid items found in API response")
                     standardized_result = []
                 
-                return {
+                transcription = {
                     "success": True,
                     "data": standardized_result
                 }
+                if truncated:
+                    transcription["truncated"] = True
+                    transcription["warning"] = f"Response was cut off at {self.max_tokens} tokens; some rows may be missing."
+                return transcription
             except json.JSONDecodeError as json_err:
                 logger.error(f"Failed to parse AI response as JSON: {json_err}")
                 logger.error(f"Raw response content: {response_content[:200]}...")
                 
-                # If all extraction attempts fail, return empty data
+                # Keep every row that was complete before the output broke off
+                salvaged = [standardize_item(item) for item in JSONArrayStream().feed(message.content) if isinstance(item, dict)]
+                if salvaged:
+                    logger.info(f"Recovered {len(salvaged)} complete rows from the unparsable response")
                 return {
                     "success": True,
-                    "data": [],
+                    "data": salvaged,
+                    "truncated": True,
                     "warning": f"Could not parse response as JSON. Raw response: {response_content[:200]}..."
                 }
                 
@@ -285,3 +456,48 @@ Do not include any text outside the JSON array. Use the exact column names shown
                 "success": False, 
                 "error": f"An unexpected error occurred: {e}"
             }
+
+
+def _row_key(value):
+    return ' '.join(str(value or '').split()).casefold()
+
+
+def merge_tile_rows(tile_rows):
+    """Merges row lists from overlapping tiles (row-major, top-left first) into one list.
+
+    Rows are matched on their message text; a row whose non-empty fields do
+    not conflict with a row for the same message from another tile is the
+    same row seen again in the overlap (possibly cut at a tile edge) and
+    only fills that row's empty fields. Rows of the same tile are never
+    merged with each other, nor are rows without a message, so distinct
+    rows are not lost. Every row gets the sheet name from the top-left-most
+    tile that shows one.
+    """
+    fields = ("message", "start_ecu", "end_ecu", "sending_ecu", "receiving_ecu", "dashed_line")
+    sheet_name = next((row["sheet_name"] for rows in tile_rows for row in rows if row.get("sheet_name")), "")
+    merged = []
+    by_message = {}
+    for tile, rows in enumerate(tile_rows):
+        for row in rows:
+            key = _row_key(row.get("message"))
+            if not key:
+                merged.append(dict(row))
+                continue
+            candidates = by_message.setdefault(key, [])
+            for existing, tiles in candidates:
+                if tile in tiles:
+                    continue
+                if all(not _row_key(row.get(field)) or not _row_key(existing.get(field))
+                       or _row_key(row.get(field)) == _row_key(existing.get(field)) for field in fields):
+                    for field in fields:
+                        if not _row_key(existing.get(field)) and _row_key(row.get(field)):
+                            existing[field] = row[field]
+                    tiles.add(tile)
+                    break
+            else:
+                item = dict(row)
+                candidates.append((item, {tile}))
+                merged.append(item)
+    for item in merged:
+        item["sheet_name"] = sheet_name
+    return merged
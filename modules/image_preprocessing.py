@@ -0,0 +1,185 @@
+import io
+import logging
+import math
+
+# Pillow is optional; without it images are sent to the model unchanged
+try:
+    from PIL import Image as PILImage, ImageChops, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FORMAT_CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+class ImagePreprocessor:
+    """Shrinks FA diagram uploads before they are sent to the vision model.
+
+    The image is decoded, EXIF-rotated, scaled down so its longest side is at
+    most IMAGE_MAX_DIMENSION and re-encoded as IMAGE_OUTPUT_FORMAT. With
+    IMAGE_GRAYSCALE the colour is dropped except for clearly red or blue
+    pixels, which carry the dashed-line cues the transcription prompt uses.
+    The original bytes are kept if the image was not downscaled and the
+    re-encoded result would not be smaller.
+    """
+
+    def __init__(self, config):
+        """Initialize the ImagePreprocessor with application configuration."""
+        self.enabled = bool(config.get('IMAGE_PREPROCESSING_ENABLED', True))
+        self.max_dimension = config.get('IMAGE_MAX_DIMENSION', 2048)
+        self.output_format = (config.get('IMAGE_OUTPUT_FORMAT') or 'JPEG').upper()
+        self.quality = config.get('IMAGE_QUALITY', 90)
+        self.grayscale = bool(config.get('IMAGE_GRAYSCALE', False))
+        # Minimum margin (0-255) by which red/blue must exceed the other channels to be kept
+        self.color_threshold = config.get('IMAGE_COLOR_THRESHOLD', 60)
+
+        if self.output_format not in FORMAT_CONTENT_TYPES:
+            logger.warning(f"Unsupported IMAGE_OUTPUT_FORMAT '{self.output_format}', using JPEG.")
+            self.output_format = 'JPEG'
+        if self.enabled and not PIL_AVAILABLE:
+            logger.warning("Image preprocessing is enabled but Pillow is not installed; images will be sent unchanged.")
+            self.enabled = False
+
+    def _color_cue_mask(self, rgb):
+        """Returns an L-mode mask that is white where a pixel is distinctly red or blue."""
+        r, g, b = rgb.split()
+        red = ImageChops.darker(ImageChops.subtract(r, g), ImageChops.subtract(r, b))
+        blue = ImageChops.darker(ImageChops.subtract(b, r), ImageChops.subtract(b, g))
+        threshold = self.color_threshold
+        return ImageChops.lighter(red, blue).point(lambda v: 255 if v > threshold else 0)
+
+    def _encode(self, image, output_format):
+        buffer = io.BytesIO()
+        if output_format == 'JPEG':
+            # 4:4:4 chroma keeps thin red/blue dashed lines from smearing
+            image.save(buffer, 'JPEG', quality=self.quality, optimize=True, subsampling=0)
+        elif output_format == 'WEBP':
+            image.save(buffer, 'WEBP', quality=self.quality, method=4)
+        else:
+            if self.grayscale:
+                # Gray plus a few cue colours compresses far better as a palette image
+                image = image.quantize(colors=64)
+            image.save(buffer, 'PNG', optimize=True)
+        return buffer.getvalue()
+
+    def _size(self, image_data):
+        """Upright (width, height) of image_data, read from the header without decoding the pixels."""
+        image = PILImage.open(io.BytesIO(image_data))
+        width, height = image.size
+        # EXIF orientations 5-8 are rotated by 90 degrees, so exif_transpose swaps the sides
+        if image.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            return height, width
+        return width, height
+
+    def _decode(self, image_data, draft=True):
+        """Opens image_data as an upright RGB image; returns (image, source_format, original_size)."""
+        image = PILImage.open(io.BytesIO(image_data))
+        source_format = image.format
+        original_size = image.size
+        if draft:
+            # JPEG can decode straight at a reduced scale, which is much faster for large photos
+            image.draft('RGB', (self.max_dimension, self.max_dimension))
+        image = ImageOps.exif_transpose(image)
+
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            background = PILImage.new('RGB', image.size, (255, 255, 255))
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').split()[-1])
+            image = background
+        else:
+            image = image.convert('RGB')
+        return image, source_format, original_size
+
+    def _finish(self, image, source_format, source_bytes):
+        """Downscales, optionally grays and encodes image; returns (image, output_format, bytes)."""
+        if max(image.size) > self.max_dimension:
+            image.thumbnail((self.max_dimension, self.max_dimension), PILImage.LANCZOS)
+
+        if self.grayscale:
+            gray = image.convert('L').convert('RGB')
+            image = PILImage.composite(image, gray, self._color_cue_mask(image))
+
+        output_format = self.output_format
+        encoded = self._encode(image, output_format)
+        if output_format != 'PNG' and source_format in ('PNG', 'GIF') and len(encoded) > source_bytes:
+            # Flat line-art diagrams often compress better losslessly; keep whichever is smaller
+            candidate = self._encode(image, 'PNG')
+            if len(candidate) < len(encoded):
+                output_format, encoded = 'PNG', candidate
+        return image, output_format, encoded
+
+    def process(self, image_data, content_type=None):
+        """Returns (bytes, content_type, info) for the image to send; falls back to the input on any failure."""
+        info = {"original_bytes": len(image_data), "processed": False}
+        if not self.enabled:
+            return image_data, content_type, info
+
+        try:
+            image, source_format, info["original_size"] = self._decode(image_data)
+            resized = max(image.size) > self.max_dimension
+            image, output_format, encoded = self._finish(image, source_format, len(image_data))
+        except Exception as e:
+            logger.warning(f"Image preprocessing failed, sending original upload: {e}")
+            info["error"] = str(e)
+            return image_data, content_type, info
+
+        if len(encoded) >= len(image_data) and not resized:
+            logger.info(f"Preprocessed image ({len(encoded)} bytes) is not smaller than the upload ({len(image_data)} bytes); keeping the original")
+            return image_data, content_type, info
+
+        info.update({"processed": True, "processed_bytes": len(encoded), "processed_size": image.size, "format": output_format})
+        logger.info(f"Preprocessed image {info['original_size']} {len(image_data)} bytes -> {image.size} {len(encoded)} bytes ({output_format})")
+        return encoded, FORMAT_CONTENT_TYPES[output_format], info
+
+    def tiles(self, image_data, tile_size, overlap=0.1, max_tiles=9, min_dimension=None):
+        """Splits a large image into overlapping tiles, each prepared like process() output.
+
+        The grid has roughly tile_size source pixels per cell (grown so there
+        are at most max_tiles cells), and each cell is extended by overlap (a
+        fraction of the cell) on every inner edge so shapes cut by one border
+        appear whole in a neighbouring tile. Returns None if Pillow is missing,
+        the image cannot be decoded or its longest side is below
+        min_dimension; otherwise a row-major list of dicts with row, col, box,
+        data and content_type (at least a 2x2 grid when min_dimension is None).
+        """
+        if not PIL_AVAILABLE:
+            return None
+        try:
+            # Most sheets are below min_dimension, so check the size before decoding the pixels
+            if min_dimension is not None and max(self._size(image_data)) < min_dimension:
+                return None
+            # Full resolution: tiling exists to keep detail a single downscaled image loses
+            image, source_format, _ = self._decode(image_data, draft=False)
+            width, height = image.size
+
+            cols, rows = max(1, math.ceil(width / tile_size)), max(1, math.ceil(height / tile_size))
+            while cols * rows > max_tiles:
+                tile_size *= 1.25
+                cols, rows = max(1, math.ceil(width / tile_size)), max(1, math.ceil(height / tile_size))
+            if cols * rows == 1:
+                if min_dimension is not None:
+                    return None
+                cols = rows = 2
+
+            step_x, step_y = width / cols, height / rows
+            tiles = []
+            for row in range(rows):
+                for col in range(cols):
+                    box = (
+                        max(0, int(col * step_x - overlap * step_x)),
+                        max(0, int(row * step_y - overlap * step_y)),
+                        min(width, int((col + 1) * step_x + overlap * step_x)),
+                        min(height, int((row + 1) * step_y + overlap * step_y))
+                    )
+                    _, output_format, encoded = self._finish(image.crop(box), source_format, len(image_data) // (rows * cols))
+                    tiles.append({"row": row, "col": col, "box": box, "data": encoded,
+                                  "content_type": FORMAT_CONTENT_TYPES[output_format]})
+        except Exception as e:
+            logger.warning(f"Could not split image into tiles: {e}")
+            return None
+
+        logger.info(f"Split {width}x{height} image into {rows}x{cols} tiles")
+        return tiles
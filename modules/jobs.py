@@ -0,0 +1,200 @@
+import logging
+import os
+import threading
+import json
+import uuid
+from datetime import datetime, timedelta
+from database import db, Job
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class JobError(Exception):
+    """Raised by a job handler to fail the job while still recording a result body."""
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+class JobContext:
+    """Handle passed to job handlers for reporting progress."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def update_progress(self, progress, message=None):
+        """Records progress (0.0 - 1.0) without touching the handler's own DB session; also a heartbeat."""
+        with db.engine.begin() as conn:
+            conn.execute(
+                Job.__table__.update()
+                .where(Job.__table__.c.id == self.job_id)
+                .values(progress=progress, progress_message=(message or '')[:255], heartbeat_at=datetime.utcnow())
+            )
+
+    def heartbeat(self):
+        """Marks the job as still being worked on."""
+        with db.engine.begin() as conn:
+            conn.execute(
+                Job.__table__.update()
+                .where(Job.__table__.c.id == self.job_id, Job.__table__.c.status == 'running')
+                .values(heartbeat_at=datetime.utcnow())
+            )
+
+
+class JobQueue:
+    """Database-backed job queue drained by worker threads.
+
+    Jobs are rows in the jobs table, so queued work survives a restart and can
+    be claimed by any process sharing the database. A job is claimed with a
+    conditional UPDATE, so two workers never run the same job. While a
+    handler runs, its worker refreshes the job's heartbeat_at every
+    JOB_HEARTBEAT_INTERVAL seconds (as does every progress update); a
+    'running' job whose heartbeat is older than JOB_STALE_AFTER (its process
+    died) is requeued until JOB_MAX_ATTEMPTS is reached. Long jobs are never
+    requeued while their worker is alive.
+    """
+
+    def __init__(self, app):
+        """Initialize the JobQueue with the Flask app (used for worker app contexts)."""
+        self.app = app
+        self.num_workers = app.config.get('JOB_WORKERS', 2)
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', 2.0)
+        self.heartbeat_interval = app.config.get('JOB_HEARTBEAT_INTERVAL', 30)
+        self.stale_after = timedelta(seconds=max(app.config.get('JOB_STALE_AFTER', 180), 3 * self.heartbeat_interval))
+        self.max_attempts = app.config.get('JOB_MAX_ATTEMPTS', 3)
+        self._handlers = {}
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        self._workers = []
+        self._pid = None
+
+    def register(self, kind, handler):
+        """Registers handler(payload, job_context) -> result dict for a job kind."""
+        self._handlers[kind] = handler
+
+    def submit(self, kind, payload):
+        """Persists a new queued job and wakes a worker; returns the Job."""
+        if kind not in self._handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        job = Job(id=str(uuid.uuid4()), kind=kind, status='queued', payload=json.dumps(payload), progress=0.0, attempts=0)
+        db.session.add(job)
+        db.session.commit()
+        logger.info(f"Queued job {job.id} ({kind})")
+        self.start()
+        self._wakeup.set()
+        return job
+
+    def start(self):
+        """Starts the worker threads once per process."""
+        # Threads do not survive a fork (e.g. gunicorn --preload), so a child process starts its own
+        if (self._workers and self._pid == os.getpid()) or self.num_workers <= 0:
+            return
+        with self._start_lock:
+            if self._workers and self._pid == os.getpid():
+                return
+            self._workers = []
+            self._pid = os.getpid()
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            logger.info(f"Started {self.num_workers} job worker threads")
+
+    def _requeue_stale(self):
+        """Requeues jobs whose worker stopped sending heartbeats, failing those out of attempts."""
+        cutoff = datetime.utcnow() - self.stale_after
+        table = Job.__table__
+        # Rows claimed before heartbeats existed fall back to started_at
+        stale = db.func.coalesce(table.c.heartbeat_at, table.c.started_at) < cutoff
+        with db.engine.begin() as conn:
+            conn.execute(
+                table.update()
+                .where(table.c.status == 'running', stale, table.c.attempts >= self.max_attempts)
+                .values(status='failed', error='Job abandoned after maximum attempts', finished_at=datetime.utcnow())
+            )
+            requeued = conn.execute(
+                table.update()
+                .where(table.c.status == 'running', stale)
+                .values(status='queued', heartbeat_at=None)
+            )
+            if requeued.rowcount:
+                logger.warning(f"Requeued {requeued.rowcount} job(s) with no heartbeat for {self.stale_after.total_seconds():.0f}s")
+
+    def _claim_next(self):
+        """Atomically moves the oldest queued job to 'running' and returns its id, or None."""
+        table = Job.__table__
+        with db.engine.begin() as conn:
+            candidates = conn.execute(
+                db.select(table.c.id)
+                .where(table.c.status == 'queued')
+                .order_by(table.c.created_at)
+                .limit(5)
+            ).scalars().all()
+            for job_id in candidates:
+                claimed = conn.execute(
+                    table.update()
+                    .where(table.c.id == job_id, table.c.status == 'queued')
+                    .values(status='running', started_at=datetime.utcnow(), heartbeat_at=datetime.utcnow(), attempts=table.c.attempts + 1)
+                )
+                if claimed.rowcount == 1:
+                    return job_id
+        return None
+
+    def _worker_loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self._requeue_stale()
+                    job_id = self._claim_next()
+                    if job_id is not None:
+                        self._run(job_id)
+                        continue
+            except Exception as e:
+                logger.error(f"Job worker error: {e}", exc_info=True)
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _heartbeat_loop(self, context, stop):
+        """Refreshes the job's heartbeat until stop is set (runs beside the handler)."""
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                with self.app.app_context():
+                    context.heartbeat()
+            except Exception as e:
+                logger.warning(f"Heartbeat for job {context.job_id} failed: {e}")
+
+    def _run(self, job_id):
+        job = db.session.get(Job, job_id)
+        handler = self._handlers.get(job.kind)
+        logger.info(f"Running job {job.id} ({job.kind}), attempt {job.attempts}")
+        context = JobContext(job.id)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat_loop, args=(context, stop), name=f"job-heartbeat-{job.id[:8]}", daemon=True)
+        heartbeat.start()
+        try:
+            if handler is None:
+                raise JobError(f"No handler registered for job kind '{job.kind}'")
+            result = handler(json.loads(job.payload or '{}'), context)
+            status, error = 'succeeded', None
+        except JobError as e:
+            db.session.rollback()
+            result, status, error = e.result, 'failed', str(e)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}", exc_info=True)
+            db.session.rollback()
+            result, status, error = None, 'failed', str(e)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        job = db.session.get(Job, job_id)
+        job.status = status
+        job.error = error
+        job.result = json.dumps(result) if result is not None else None
+        job.progress = 1.0
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        logger.info(f"Job {job.id} ({job.kind}) {status}")
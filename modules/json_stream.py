@@ -0,0 +1,79 @@
+import json
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class JSONArrayStream:
+    """Incremental parser for a JSON array of objects arriving in chunks.
+
+    feed() returns each object of the array as soon as its closing brace has
+    arrived, so a consumer can act on rows while the rest is still being
+    generated. Anything before the first '[' (a ```json fence, a sentence of
+    prose) is skipped, as is anything after the array closes. If the text is
+    cut off, every object that was complete is still returned and
+    closed stays False.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.closed = False
+        self.count = 0
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+
+    def feed(self, chunk):
+        """Adds chunk to the input and returns the list of objects completed by it."""
+        self.text += chunk
+        items = []
+        text = self.text
+        while self._pos < len(text) and not self.closed:
+            if not self._started:
+                start = text.find('[', self._pos)
+                if start < 0:
+                    self._pos = len(text)
+                    break
+                self._started = True
+                self._depth = 1
+                self._pos = start + 1
+                continue
+
+            char = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if self._depth == 1 and char == '{':
+                    self._item_start = self._pos
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 1 and char == '}' and self._item_start is not None:
+                    item = self._parse(text[self._item_start:self._pos + 1])
+                    self._item_start = None
+                    if item is not None:
+                        items.append(item)
+                elif self._depth == 0:
+                    self.closed = True
+            self._pos += 1
+        self.count += len(items)
+        return items
+
+    def _parse(self, raw):
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Skipping malformed array element: {e}")
+            return None
@@ -0,0 +1,119 @@
+import logging
+import os
+import sqlite3
+import threading
+import hashlib
+import json
+import time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LLMResponseCache:
+    """Content-hash keyed store of LLM responses in a local SQLite file.
+
+    Only endpoints listed in LLM_CACHE_ENDPOINTS are cached. Entries expire
+    after LLM_CACHE_TTL seconds and the least recently used ones are evicted
+    once LLM_CACHE_MAX_ENTRIES is exceeded.
+    """
+
+    def __init__(self, config, instance_path=None):
+        """Initialize the cache with application configuration.
+
+        Without LLM_CACHE_PATH the file lives in the app's instance folder,
+        never in whatever directory the process was started from.
+        """
+        self.path = config.get('LLM_CACHE_PATH') or os.path.join(instance_path or 'instance', 'llm_cache.sqlite3')
+        self.ttl = config.get('LLM_CACHE_TTL', 7 * 24 * 3600)
+        self.max_entries = config.get('LLM_CACHE_MAX_ENTRIES', 5000)
+        endpoints = config.get('LLM_CACHE_ENDPOINTS', '')
+        if isinstance(endpoints, str):
+            endpoints = [e.strip() for e in endpoints.split(',')]
+        self.endpoints = {e for e in endpoints if e}
+        self.enabled = bool(config.get('LLM_CACHE_ENABLED', True)) and bool(self.endpoints)
+
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._conn = None
+        if self.enabled:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, endpoint TEXT, model TEXT, response TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+                self._conn.commit()
+                logger.info(f"LLM response cache enabled at {self.path} for endpoints: {sorted(self.endpoints)}")
+            except (sqlite3.Error, OSError) as e:
+                # e.g. read-only filesystem on serverless deployments
+                logger.warning(f"Could not open LLM response cache at {self.path}, caching disabled: {e}")
+                self.enabled = False
+                self._conn = None
+
+    @staticmethod
+    def make_key(model, messages, **params):
+        """Returns the SHA-256 fingerprint of a request's model, messages and sampling parameters."""
+        payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def enabled_for(self, endpoint):
+        """True if responses for this endpoint may be served from the cache."""
+        return self.enabled and endpoint in self.endpoints
+
+    def _count(self, endpoint, field):
+        stats = self._stats.setdefault(endpoint, {"hits": 0, "misses": 0, "stores": 0})
+        stats[field] += 1
+
+    def get(self, endpoint, key):
+        """Returns the cached response for key, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                self._count(endpoint, "misses")
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._count(endpoint, "hits")
+        logger.info(f"LLM cache hit for {endpoint}")
+        return row[0]
+
+    def put(self, endpoint, key, model, response):
+        """Stores a response, dropping expired entries and evicting the least recently used beyond the limit."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, endpoint, model, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, model, response, now, now)
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+            self._count(endpoint, "stores")
+
+    def stats(self):
+        """Returns hit/miss counters per endpoint plus the current entry count."""
+        if not self.enabled:
+            return {"enabled": False}
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            return {
+                "enabled": True,
+                "endpoints": sorted(self.endpoints),
+                "entries": entries,
+                "counters": {endpoint: dict(counts) for endpoint, counts in self._stats.items()}
+            }
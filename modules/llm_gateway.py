@@ -0,0 +1,328 @@
+import logging
+import threading
+import atexit
+import time
+import httpx
+from openai import OpenAI, APIStatusError, APIConnectionError
+from modules.llm_cache import LLMResponseCache
+from modules.singleflight import SingleFlight
+from modules.llm_scheduler import LLMScheduler, SchedulerBusyError, PRIORITY_NORMAL
+from modules.llm_hedging import LatencyTracker, HedgedStream
+from modules.llm_metrics import LLMMetrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# HTTP/2 support in httpx needs the optional 'h2' package
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# Kept for callers that catch the gateway's own name
+GatewayBusyError = SchedulerBusyError
+
+
+def estimate_tokens(messages=None, text=None):
+    """Rough token count (about 4 characters per token) for when the upstream reports no usage."""
+    chars = len(text or '')
+    for message in messages or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get('text', '')) for part in content if isinstance(part, dict))
+    return chars // 4
+
+
+def usage_tokens(usage):
+    """Returns (prompt_tokens, completion_tokens) from a usage object or dict, or (None, None)."""
+    if usage is None:
+        return None, None
+    if isinstance(usage, dict):
+        return usage.get('prompt_tokens'), usage.get('completion_tokens')
+    return getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None)
+
+
+class LLMGateway:
+    """Single shared OpenRouter client used by all modules.
+
+    Owns one pooled httpx client (keep-alive, optional HTTP/2), the OpenRouter
+    attribution headers and the upstream timeouts. Every upstream request goes
+    through the LLMScheduler (rate limits, priorities, retries). Callers may
+    pass fallback_models: streamed and text completions then hedge across the
+    chain (see HedgedStream), plain completions fall back on failure.
+    """
+
+    def __init__(self, config, instance_path=None):
+        """Initialize the LLMGateway with application configuration (instance_path holds the response cache)."""
+        if not config.get('OPENROUTER_API_KEY'):
+            raise ValueError("OpenRouter API key not found in configuration.")
+
+        http2 = bool(config.get('LLM_HTTP2', True))
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("LLM_HTTP2 is enabled but the 'h2' package is not installed; falling back to HTTP/1.1.")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=config.get('LLM_MAX_CONNECTIONS', 20),
+            max_keepalive_connections=config.get('LLM_MAX_KEEPALIVE_CONNECTIONS', 10),
+            keepalive_expiry=config.get('LLM_KEEPALIVE_EXPIRY', 60.0)
+        )
+        self.timeout = httpx.Timeout(
+            connect=config.get('LLM_CONNECT_TIMEOUT', 10.0),
+            read=config.get('LLM_READ_TIMEOUT', 120.0),
+            write=config.get('LLM_WRITE_TIMEOUT', 30.0),
+            pool=config.get('LLM_POOL_TIMEOUT', 30.0)
+        )
+
+        # Create an httpx client that doesn't trust environment proxy settings
+        self.http_client = httpx.Client(trust_env=False, http2=http2, limits=limits, timeout=self.timeout)
+
+        self.client = OpenAI(
+            base_url=config.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1'),
+            api_key=config['OPENROUTER_API_KEY'],
+            http_client=self.http_client,
+            timeout=self.timeout,
+            max_retries=0  # retries are handled by the scheduler
+        )
+        self.http2 = http2
+        self.default_model = config.get('OPENROUTER_MODEL', 'meta-llama/llama-4-maverick:free')
+        self.scheduler = LLMScheduler(config)
+
+        self.extra_headers = {}
+        site_url = config.get('YOUR_SITE_URL')
+        site_name = config.get('YOUR_SITE_NAME')
+        if site_url:
+            self.extra_headers["HTTP-Referer"] = site_url
+        if site_name:
+            self.extra_headers["X-Title"] = site_name
+
+        self.cache = LLMResponseCache(config, instance_path)
+        # Concurrent identical requests share one upstream call
+        self.coalesce = bool(config.get('LLM_COALESCE_REQUESTS', True))
+        self.singleflight = SingleFlight()
+        # Time-to-first-token samples drive the hedge deadlines
+        self.latency = LatencyTracker()
+        self.hedging = HedgedStream(self._open_stream, self.latency, config)
+        # Per-call latency/TTFT/token/outcome records (see /api/metrics)
+        self.metrics = LLMMetrics()
+
+        logger.info(f"LLMGateway ready (http2={http2}, max_connections={limits.max_connections}, max_concurrency={self.scheduler.max_concurrency})")
+
+    @staticmethod
+    def _model_chain(model, fallback_models):
+        """Returns the primary model followed by its distinct fallbacks."""
+        chain = [model]
+        for fallback in fallback_models or []:
+            if fallback not in chain:
+                chain.append(fallback)
+        return chain
+
+    def _coalesced(self, model, messages, fn, **kwargs):
+        """Runs fn() once for concurrent calls sharing the request fingerprint."""
+        if not self.coalesce:
+            return fn()
+        key = self.cache.make_key(model, messages, **kwargs)
+        return self.singleflight.do(key, fn)
+
+    def create_completion(self, messages, model=None, priority=PRIORITY_NORMAL, fallback_models=None, endpoint=None, **kwargs):
+        """Runs a chat completion through the shared client and the scheduler.
+
+        Concurrent calls with the same fingerprint (model, messages, sampling
+        parameters) wait on a single upstream request and share its result.
+        If the model fails after its retries, each fallback model is tried in turn.
+        """
+        chain = self._model_chain(model or self.default_model, fallback_models)
+
+        def complete():
+            for index, candidate in enumerate(chain):
+                try:
+                    return self._complete_upstream(candidate, messages, priority, endpoint=endpoint, **kwargs)
+                except (APIStatusError, APIConnectionError, SchedulerBusyError) as e:
+                    if index == len(chain) - 1:
+                        raise
+                    logger.warning(f"Model {candidate} failed ({e.__class__.__name__}), falling back to {chain[index + 1]}")
+        return self._coalesced(chain[0], messages, complete, **kwargs)
+
+    def _complete_upstream(self, model, messages, priority, endpoint=None, **kwargs):
+        """Sends one non-streaming request upstream, retried by the scheduler on transient errors."""
+        started_at = time.monotonic()
+        try:
+            completion = self.scheduler.call(
+                model,
+                lambda: self.client.chat.completions.create(
+                    extra_headers=self.extra_headers,
+                    model=model,
+                    messages=messages,
+                    **kwargs
+                ),
+                priority=priority
+            )
+        except Exception as e:
+            self.metrics.record(model, endpoint, 'error', latency=time.monotonic() - started_at, error=e.__class__.__name__)
+            raise
+
+        prompt_tokens, completion_tokens = usage_tokens(getattr(completion, 'usage', None))
+        estimated = prompt_tokens is None
+        if estimated and completion.choices:
+            prompt_tokens = estimate_tokens(messages)
+            completion_tokens = estimate_tokens(text=completion.choices[0].message.content)
+        self.metrics.record(
+            model, endpoint, 'success', latency=time.monotonic() - started_at,
+            prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, tokens_estimated=estimated
+        )
+        return completion
+
+    def complete_text(self, messages, endpoint=None, model=None, priority=PRIORITY_NORMAL, fallback_models=None, **kwargs):
+        """Returns the text of a chat completion, served from the response cache when the endpoint opts in.
+
+        With fallback_models the completion is streamed through HedgedStream
+        and joined, so a slow first model is raced against the next one.
+        """
+        model = model or self.default_model
+        use_cache = endpoint is not None and self.cache.enabled_for(endpoint)
+        if use_cache:
+            key = self.cache.make_key(model, messages, **kwargs)
+            cached = self.cache.get(endpoint, key)
+            if cached is not None:
+                self.metrics.record(model, endpoint, 'cache_hit')
+                return cached
+
+        if fallback_models:
+            chain = self._model_chain(model, fallback_models)
+            content = self._coalesced(
+                model, messages,
+                lambda: ''.join(self.hedging.stream(chain, messages, priority, endpoint=endpoint, **kwargs)).strip(),
+                **kwargs
+            )
+        else:
+            completion = self.create_completion(messages, model=model, priority=priority, endpoint=endpoint, **kwargs)
+            content = completion.choices[0].message.content.strip()
+        if use_cache and content:
+            self.cache.put(endpoint, key, model, content)
+        return content
+
+    def stream_completion(self, messages, model=None, endpoint=None, priority=PRIORITY_NORMAL, fallback_models=None, **kwargs):
+        """Streams a chat completion, yielding text deltas as they arrive.
+
+        The concurrency slot is held until the stream is exhausted or the
+        generator is closed; closing it early (e.g. client disconnect) also
+        closes the upstream response. For cache-enabled endpoints a hit is
+        yielded as a single chunk, and a fully received stream is stored.
+        With fallback_models the stream is hedged across the model chain.
+        """
+        model = model or self.default_model
+        use_cache = endpoint is not None and self.cache.enabled_for(endpoint)
+        if use_cache:
+            key = self.cache.make_key(model, messages, **kwargs)
+            cached = self.cache.get(endpoint, key)
+            if cached is not None:
+                self.metrics.record(model, endpoint, 'cache_hit', streamed=True)
+                yield cached
+                return
+
+        if fallback_models:
+            deltas = self.hedging.stream(self._model_chain(model, fallback_models), messages, priority, endpoint=endpoint, **kwargs)
+        else:
+            deltas = self._stream_upstream(model, messages, priority, endpoint=endpoint, **kwargs)
+        received = []
+        for delta in deltas:
+            received.append(delta)
+            yield delta
+        if use_cache and received:
+            self.cache.put(endpoint, key, model, ''.join(received).strip())
+
+    def _open_stream(self, model, messages, priority, on_open=None, cancelled=None, endpoint=None, **kwargs):
+        """HedgedStream hook: streams one model of the chain."""
+        return self._stream_upstream(model, messages, priority, on_open=on_open, cancelled=cancelled, endpoint=endpoint, **kwargs)
+
+    def _stream_upstream(self, model, messages, priority, on_open=None, cancelled=None, endpoint=None, **kwargs):
+        """Streams text deltas from the upstream API while holding one scheduler slot.
+
+        Transient errors are retried only until the first delta has been
+        yielded; after that the caller already has partial output. on_open
+        receives the upstream stream so another thread can close it (setting
+        the cancelled event first). The call is recorded in the metrics as
+        success, error or cancelled.
+        """
+        started_at = time.monotonic()
+        ttft = None
+        usage = None
+        received_chars = 0
+        outcome, error = 'cancelled', None
+        attempt = 0
+        try:
+            while True:
+                try:
+                    with self.scheduler.admit(model, priority):
+                        sent_at = time.monotonic()
+                        stream = self.client.chat.completions.create(
+                            extra_headers=self.extra_headers,
+                            model=model,
+                            messages=messages,
+                            stream=True,
+                            **kwargs
+                        )
+                        if on_open is not None:
+                            on_open(stream)
+                        try:
+                            for chunk in stream:
+                                # OpenRouter reports usage on the final chunk
+                                usage = getattr(chunk, 'usage', None) or usage
+                                if not chunk.choices:
+                                    continue
+                                delta = chunk.choices[0].delta
+                                if delta is not None and delta.content:
+                                    if ttft is None:
+                                        ttft = time.monotonic() - sent_at
+                                        self.latency.record(model, ttft)
+                                    received_chars += len(delta.content)
+                                    yield delta.content
+                        finally:
+                            stream.response.close()
+                    outcome = 'success'
+                    return
+                except (APIStatusError, APIConnectionError) as e:
+                    delay = None if ttft is not None else self.scheduler.retry_delay(model, e, attempt)
+                    if delay is None:
+                        raise
+                time.sleep(delay)
+                attempt += 1
+        except Exception as e:
+            if cancelled is None or not cancelled.is_set():
+                outcome, error = 'error', e.__class__.__name__
+            raise
+        finally:
+            prompt_tokens, completion_tokens = usage_tokens(usage)
+            estimated = prompt_tokens is None
+            if estimated:
+                prompt_tokens = estimate_tokens(messages)
+                completion_tokens = received_chars // 4
+            self.metrics.record(
+                model, endpoint, outcome, latency=time.monotonic() - started_at, ttft=ttft,
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                streamed=True, tokens_estimated=estimated, error=error
+            )
+
+    def close(self):
+        """Closes the pooled HTTP connections."""
+        self.http_client.close()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway(config, instance_path=None):
+    """Returns the process-wide LLMGateway, creating it on first use."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway(config, instance_path)
+                atexit.register(_gateway.close)
+    return _gateway
@@ -0,0 +1,202 @@
+import logging
+import threading
+import queue
+import time
+from collections import deque
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_model_list(value):
+    """Returns a list of model ids from a comma-separated string (or an existing list)."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [model.strip() for model in value if model and model.strip()]
+
+
+class LatencyTracker:
+    """Keeps a sliding window of time-to-first-token samples per model."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = self._samples[model] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, model, q):
+        """Returns the q-th quantile (0.0 - 1.0) of the model's samples and the sample count."""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if not samples:
+            return None, 0
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index], len(samples)
+
+    def stats(self):
+        """Returns p50/p95 time to first token per model."""
+        with self._lock:
+            models = list(self._samples)
+        stats = {}
+        for model in models:
+            p50, count = self.percentile(model, 0.5)
+            p95, _ = self.percentile(model, 0.95)
+            stats[model] = {"samples": count, "ttft_p50": round(p50, 3), "ttft_p95": round(p95, 3)}
+        return stats
+
+
+class _Attempt:
+    """One upstream stream racing in a hedged request."""
+
+    def __init__(self, model):
+        self.model = model
+        self.cancelled = threading.Event()
+        self.stream = None
+        self.finished = False
+
+    def cancel(self):
+        """Stops the attempt, closing its upstream response if it is open."""
+        self.cancelled.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.response.close()
+            except Exception:
+                pass
+
+
+class HedgedStream:
+    """Races a chain of models for the first token of a streamed completion.
+
+    The first model starts immediately. If it has not produced a token by its
+    hedge deadline (the p95 time to first token observed for that model), the
+    next model in the chain is started alongside it; if an attempt fails before
+    producing a token, the next model starts at once. The first attempt to
+    produce a token wins and the others are cancelled.
+    """
+
+    def __init__(self, open_stream, tracker, config):
+        """open_stream(model, messages, priority, on_open=..., cancelled=..., **kwargs) must return a generator of text deltas."""
+        self.open_stream = open_stream
+        self.tracker = tracker
+        self.enabled = bool(config.get('LLM_HEDGING_ENABLED', True))
+        self.percentile = config.get('LLM_HEDGE_PERCENTILE', 0.95)
+        self.min_samples = config.get('LLM_HEDGE_MIN_SAMPLES', 20)
+        self.min_delay = config.get('LLM_HEDGE_MIN_DELAY', 1.0)
+        self.default_delay = config.get('LLM_HEDGE_DEFAULT_DELAY', 8.0)
+        self._lock = threading.Lock()
+        self._stats = {"hedged": 0, "fallbacks": 0, "wins": {}}
+
+    def hedge_delay(self, model):
+        """Seconds to wait for the model's first token before starting the next model (None = never)."""
+        if not self.enabled:
+            return None
+        p, count = self.tracker.percentile(model, self.percentile)
+        if count < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, p)
+
+    def _count(self, field, model=None):
+        with self._lock:
+            if model is None:
+                self._stats[field] += 1
+            else:
+                self._stats[field][model] = self._stats[field].get(model, 0) + 1
+
+    def _run(self, attempt, events, messages, priority, kwargs):
+        """Worker thread: forwards one model's deltas to the shared event queue."""
+        def on_open(stream):
+            attempt.stream = stream
+            if attempt.cancelled.is_set():
+                attempt.cancel()
+        try:
+            for delta in self.open_stream(attempt.model, messages, priority, on_open=on_open, cancelled=attempt.cancelled, **kwargs):
+                if attempt.cancelled.is_set():
+                    break
+                events.put((attempt, 'delta', delta))
+            events.put((attempt, 'done', None))
+        except Exception as e:
+            events.put((attempt, 'error', e))
+
+    def stream(self, models, messages, priority, **kwargs):
+        """Yields the text deltas of whichever model in the chain answers first."""
+        events = queue.Queue()
+        attempts = []
+        remaining = list(models)
+
+        def launch():
+            attempt = _Attempt(remaining.pop(0))
+            attempts.append(attempt)
+            threading.Thread(target=self._run, args=(attempt, events, messages, priority, kwargs), name=f"hedge-{attempt.model}", daemon=True).start()
+            delay = self.hedge_delay(attempt.model)
+            return None if delay is None else time.monotonic() + delay
+
+        try:
+            deadline = launch()
+            winner = None
+            first = None
+            last_error = None
+            while winner is None:
+                timeout = None
+                if remaining and deadline is not None:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    attempt, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    logger.info(f"No first token from {attempts[-1].model} within hedge deadline, also trying {remaining[0]}")
+                    self._count("hedged")
+                    deadline = launch()
+                    continue
+
+                if kind == 'error':
+                    attempt.finished = True
+                    last_error = value
+                    logger.warning(f"Model {attempt.model} failed before its first token: {value}")
+                    if remaining:
+                        self._count("fallbacks")
+                        deadline = launch()
+                    elif all(a.finished for a in attempts):
+                        raise last_error
+                    continue
+                winner = attempt
+                first = value if kind == 'delta' else None
+
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel()
+            self._count("wins", winner.model)
+            if winner is not attempts[0]:
+                logger.info(f"Hedged request won by {winner.model}")
+
+            if first is None:
+                return
+            yield first
+            while True:
+                attempt, kind, value = events.get()
+                if attempt is not winner:
+                    continue
+                if kind == 'delta':
+                    yield value
+                elif kind == 'done':
+                    return
+                else:
+                    raise value
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    def stats(self):
+        with self._lock:
+            stats = {"hedged": self._stats["hedged"], "fallbacks": self._stats["fallbacks"], "wins": dict(self._stats["wins"])}
+        stats["enabled"] = self.enabled
+        stats["ttft"] = self.tracker.stats()
+        return stats
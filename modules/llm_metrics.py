@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        """Estimates the q-th quantile as the upper bound of the bucket it falls in (None past the last bucket)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class LLMMetrics:
+    """In-process metrics for upstream LLM calls.
+
+    The gateway calls record() once per upstream call (and per cache hit).
+    Counters and histograms are kept by model/endpoint/outcome and rendered in
+    the Prometheus text format; listeners receive every call record, e.g. to
+    persist it to the usage table.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._latency = {}
+        self._ttft = {}
+        self._tokens = {}
+        self._completion_tokens = {}
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Registers listener(call) to be called with each recorded call dict."""
+        self._listeners.append(listener)
+
+    def record(self, model, endpoint=None, outcome='success', latency=None, ttft=None,
+               prompt_tokens=None, completion_tokens=None, streamed=False, tokens_estimated=False, error=None):
+        """Records one LLM call."""
+        endpoint = endpoint or 'unknown'
+        with self._lock:
+            key = (model, endpoint, outcome)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if latency is not None and outcome != 'cache_hit':
+                self._latency.setdefault((model, endpoint), Histogram(LATENCY_BUCKETS)).observe(latency)
+            if ttft is not None:
+                self._ttft.setdefault(model, Histogram(LATENCY_BUCKETS)).observe(ttft)
+            if prompt_tokens:
+                self._tokens[(model, 'prompt')] = self._tokens.get((model, 'prompt'), 0) + prompt_tokens
+            if completion_tokens:
+                self._tokens[(model, 'completion')] = self._tokens.get((model, 'completion'), 0) + completion_tokens
+                self._completion_tokens.setdefault(model, Histogram(TOKEN_BUCKETS)).observe(completion_tokens)
+
+        call = {
+            "model": model,
+            "endpoint": endpoint,
+            "outcome": outcome,
+            "streamed": streamed,
+            "latency": latency,
+            "ttft": ttft,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_estimated": tokens_estimated,
+            "error": error,
+            "created_at": time.time()
+        }
+        for listener in self._listeners:
+            try:
+                listener(call)
+            except Exception as e:
+                logger.error(f"LLM metrics listener failed: {e}")
+
+    @staticmethod
+    def _render_histogram(lines, name, labels, histogram):
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {count}")
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+    def render_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines.append("# HELP tara_llm_requests_total LLM calls by model, endpoint and outcome.")
+            lines.append("# TYPE tara_llm_requests_total counter")
+            for (model, endpoint, outcome), count in sorted(self._requests.items()):
+                lines.append(f"tara_llm_requests_total{_labels(model=model, endpoint=endpoint, outcome=outcome)} {count}")
+
+            lines.append("# HELP tara_llm_request_duration_seconds Upstream LLM call duration, including retries.")
+            lines.append("# TYPE tara_llm_request_duration_seconds histogram")
+            for (model, endpoint), histogram in sorted(self._latency.items()):
+                self._render_histogram(lines, "tara_llm_request_duration_seconds", {"model": model, "endpoint": endpoint}, histogram)
+
+            lines.append("# HELP tara_llm_time_to_first_token_seconds Time from sending a streamed request to its first token.")
+            lines.append("# TYPE tara_llm_time_to_first_token_seconds histogram")
+            for model, histogram in sorted(self._ttft.items()):
+                self._render_histogram(lines, "tara_llm_time_to_first_token_seconds", {"model": model}, histogram)
+
+            lines.append("# HELP tara_llm_tokens_total Prompt and completion tokens by model.")
+            lines.append("# TYPE tara_llm_tokens_total counter")
+            for (model, kind), count in sorted(self._tokens.items()):
+                lines.append(f"tara_llm_tokens_total{_labels(model=model, type=kind)} {count}")
+
+            lines.append("# HELP tara_llm_completion_tokens Completion tokens per call.")
+            lines.append("# TYPE tara_llm_completion_tokens histogram")
+            for model, histogram in sorted(self._completion_tokens.items()):
+                self._render_histogram(lines, "tara_llm_completion_tokens", {"model": model}, histogram)
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Returns per-model call counts, error rate and approximate latency percentiles."""
+        with self._lock:
+            models = {}
+            for (model, endpoint, outcome), count in self._requests.items():
+                entry = models.setdefault(model, {"calls": 0, "errors": 0, "cache_hits": 0})
+                entry["calls"] += count
+                if outcome == 'error':
+                    entry["errors"] += count
+                elif outcome == 'cache_hit':
+                    entry["cache_hits"] += count
+            for model, entry in models.items():
+                merged = Histogram(LATENCY_BUCKETS)
+                for (latency_model, _), histogram in self._latency.items():
+                    if latency_model == model:
+                        merged.count += histogram.count
+                        merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                entry["error_rate"] = round(entry["errors"] / entry["calls"], 4) if entry["calls"] else 0.0
+                entry["latency_p50_le"] = merged.quantile(0.5)
+                entry["latency_p95_le"] = merged.quantile(0.95)
+                ttft = self._ttft.get(model)
+                entry["ttft_p95_le"] = ttft.quantile(0.95) if ttft else None
+                for kind in ('prompt', 'completion'):
+                    entry[f"{kind}_tokens"] = self._tokens.get((model, kind), 0)
+            return models
@@ -0,0 +1,251 @@
+import logging
+import threading
+import heapq
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from openai import APIStatusError, APIConnectionError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0  # user is waiting on the response (chat)
+PRIORITY_NORMAL = 1       # single-shot editor actions (generate, debug, modify, transcribe)
+PRIORITY_BATCH = 2        # bulk/background work (test generation, history summaries)
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class SchedulerBusyError(RuntimeError):
+    """Raised when a request cannot be admitted upstream within the queue timeout."""
+
+
+class _PriorityGate:
+    """Hands out resources to waiters in priority order, FIFO within a priority."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+
+    def _wait_turn(self, priority, timeout, ready, take):
+        """Blocks until this waiter is first in line and ready() holds, then calls take().
+
+        ready() returns True or the number of seconds until it may become true
+        (None if unknown). Returns False on timeout.
+        """
+        entry = (priority, next(self._seq))
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    wait = None
+                    if self._waiting[0] == entry:
+                        state = ready()
+                        if state is True:
+                            take()
+                            return True
+                        wait = state
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                # Let the next waiter in line re-check
+                self._cond.notify_all()
+
+    def waiting(self):
+        """Returns the number of waiters per priority."""
+        with self._cond:
+            counts = {}
+            for priority, _ in self._waiting:
+                counts[priority] = counts.get(priority, 0) + 1
+            return counts
+
+
+class PrioritySlots(_PriorityGate):
+    """Counting semaphore whose free slots go to the highest-priority waiter first."""
+
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+        self._free = size
+
+    def acquire(self, priority, timeout):
+        def take():
+            self._free -= 1
+        return self._wait_turn(priority, timeout, lambda: self._free > 0 or None, take)
+
+    def release(self):
+        with self._cond:
+            self._free += 1
+            self._cond.notify_all()
+
+
+class TokenBucket(_PriorityGate):
+    """Per-model request rate limiter (requests per minute with a burst allowance).
+
+    A 429 with Retry-After pauses the bucket, so every caller for that model
+    waits out the upstream limit instead of hammering it.
+    """
+
+    def __init__(self, rate_per_minute, burst):
+        super().__init__()
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _ready(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._tokens >= 1:
+            return True
+        return (1 - self._tokens) / self.rate
+
+    def acquire(self, priority, timeout):
+        def take():
+            self._tokens -= 1
+        return self._wait_turn(priority, timeout, self._ready, take)
+
+    def pause(self, seconds):
+        """Stops handing out tokens for the given number of seconds."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+
+class LLMScheduler:
+    """Admission control and retries for upstream LLM calls.
+
+    Each call first takes a token from its model's bucket (LLM_RATE_LIMIT_RPM /
+    LLM_RATE_LIMIT_BURST), then one of LLM_MAX_CONCURRENCY slots; both are
+    granted in priority order so interactive chat is not stuck behind batch
+    test generation. 429s, 5xx and connection errors are retried up to
+    LLM_MAX_RETRIES times with jittered exponential backoff, honouring
+    Retry-After when the upstream sends it.
+    """
+
+    def __init__(self, config):
+        """Initialize the LLMScheduler with application configuration."""
+        self.max_concurrency = config.get('LLM_MAX_CONCURRENCY', 16)
+        self.queue_timeout = config.get('LLM_QUEUE_TIMEOUT', 60.0)
+        self.rate_per_minute = config.get('LLM_RATE_LIMIT_RPM', 20)
+        self.burst = config.get('LLM_RATE_LIMIT_BURST', 5)
+        self.max_retries = config.get('LLM_MAX_RETRIES', 4)
+        self.backoff_base = config.get('LLM_BACKOFF_BASE', 1.0)
+        self.backoff_max = config.get('LLM_BACKOFF_MAX', 30.0)
+        # A Retry-After longer than this (e.g. a daily quota) fails fast instead of blocking the worker
+        self.max_retry_after = config.get('LLM_MAX_RETRY_AFTER', 60.0)
+
+        self._slots = PrioritySlots(self.max_concurrency)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {"retries": 0, "rate_limited": 0, "gave_up": 0}
+
+    def _bucket(self, model):
+        with self._lock:
+            bucket = self._buckets.get(model)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_per_minute, self.burst)
+                self._buckets[model] = bucket
+            return bucket
+
+    def _count(self, field):
+        with self._lock:
+            self._stats[field] += 1
+
+    @contextmanager
+    def admit(self, model, priority=PRIORITY_NORMAL):
+        """Holds a rate-limit token and a concurrency slot for one upstream request."""
+        if self.rate_per_minute > 0 and not self._bucket(model).acquire(priority, self.queue_timeout):
+            raise SchedulerBusyError(f"Rate limit queue for {model} did not clear within {self.queue_timeout}s")
+        if not self._slots.acquire(priority, self.queue_timeout):
+            raise SchedulerBusyError(f"All {self.max_concurrency} upstream slots busy for {self.queue_timeout}s")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _retry_after(error):
+        """Returns the Retry-After delay in seconds from an API error, or None."""
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        value = response.headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def retry_delay(self, model, error, attempt):
+        """Returns how long to wait before retrying after error, or None if it should not be retried."""
+        if isinstance(error, APIStatusError):
+            if error.status_code not in RETRYABLE_STATUS_CODES and error.status_code < 500:
+                return None
+        elif not isinstance(error, APIConnectionError):
+            return None
+
+        retry_after = self._retry_after(error)
+        if isinstance(error, APIStatusError) and error.status_code == 429:
+            self._count("rate_limited")
+            if retry_after is not None and retry_after > self.max_retry_after:
+                logger.warning(f"Rate limited on {model} for {retry_after:.0f}s, not retrying")
+                self._count("gave_up")
+                return None
+            if self.rate_per_minute > 0:
+                self._bucket(model).pause(retry_after if retry_after is not None else self.backoff_base)
+
+        if attempt >= self.max_retries:
+            self._count("gave_up")
+            return None
+
+        # Full jitter keeps clients that failed together from retrying together
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        self._count("retries")
+        logger.warning(f"Upstream error for {model} ({error.__class__.__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    def call(self, model, fn, priority=PRIORITY_NORMAL):
+        """Runs fn() as an admitted upstream request, retrying transient failures."""
+        attempt = 0
+        while True:
+            try:
+                with self.admit(model, priority):
+                    return fn()
+            except (APIStatusError, APIConnectionError) as e:
+                delay = self.retry_delay(model, e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        """Returns retry counters and queue depth per priority."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["waiting"] = self._slots.waiting()
+        stats["max_concurrency"] = self.max_concurrency
+        stats["rate_limit_rpm"] = self.rate_per_minute
+        return stats
@@ -0,0 +1,84 @@
+import logging
+import threading
+import queue
+import time
+from datetime import datetime
+from database import db, LLMUsage
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LLMUsageRecorder:
+    """Persists LLMMetrics call records to the llm_usage table.
+
+    Records are buffered and written in batches by a background thread, so an
+    LLM call never waits on (or shares a session with) the usage insert.
+    """
+
+    def __init__(self, app):
+        """Initialize the LLMUsageRecorder with the Flask app (used for the writer's app context)."""
+        self.app = app
+        self.enabled = bool(app.config.get('LLM_USAGE_LOG_ENABLED', True))
+        self.flush_interval = app.config.get('LLM_USAGE_FLUSH_INTERVAL', 5.0)
+        self.batch_size = app.config.get('LLM_USAGE_BATCH_SIZE', 200)
+        self._queue = queue.Queue(maxsize=10000)
+        self._start_lock = threading.Lock()
+        self._writer = None
+        self._dropped = 0
+
+    def __call__(self, call):
+        """LLMMetrics listener: queues one call record."""
+        if not self.enabled:
+            return
+        row = {
+            "created_at": datetime.utcfromtimestamp(call["created_at"]),
+            "endpoint": call["endpoint"],
+            "model": call["model"],
+            "outcome": call["outcome"],
+            "streamed": bool(call["streamed"]),
+            "latency_ms": int(call["latency"] * 1000) if call["latency"] is not None else None,
+            "ttft_ms": int(call["ttft"] * 1000) if call["ttft"] is not None else None,
+            "prompt_tokens": call["prompt_tokens"],
+            "completion_tokens": call["completion_tokens"],
+            "tokens_estimated": bool(call["tokens_estimated"]),
+            "error": call["error"]
+        }
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._dropped += 1
+            return
+        self._start()
+
+    def _start(self):
+        if self._writer is not None:
+            return
+        with self._start_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="llm-usage-writer", daemon=True)
+                self._writer.start()
+
+    def _drain(self, first):
+        rows = [first]
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _write_loop(self):
+        while True:
+            rows = self._drain(self._queue.get())
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        conn.execute(LLMUsage.__table__.insert(), rows)
+            except Exception as e:
+                logger.error(f"Failed to write {len(rows)} LLM usage rows: {e}")
+            time.sleep(self.flush_interval)
+
+    def stats(self):
+        return {"enabled": self.enabled, "pending": self._queue.qsize(), "dropped": self._dropped}
@@ -0,0 +1,329 @@
+import html
+import logging
+import re
+import time
+from sqlalchemy import bindparam, event, inspect, select, text
+from sqlalchemy.orm import Session
+from database import db, ChatMessage, FATranscription, FATranscriptionItem, Script, ScriptVersion
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Every indexed row gets document id ref_id * KIND_SLOTS + its kind's slot, so one row is found by primary key
+KINDS = {'script': 0, 'script_version': 1, 'chat_message': 2, 'transcription_item': 3}
+KIND_SLOTS = 4
+SQLITE_TABLE = 'search_index'
+POSTGRES_TABLE = 'search_documents'
+# Highlight markers (control characters cannot occur in the escaped output, so they are swapped for <mark> after escaping)
+MARK_START, MARK_END = '\x02', '\x03'
+QUERY_TERM = re.compile(r'"([^"]*)"?|(\S+)')
+QUERY_TOKEN = re.compile(r'[^\W_]+')
+
+# Rows indexed by triggers: (table, kind, title SQL, body SQL, parent SQL, columns whose update re-indexes).
+# {row} is the new row in a trigger and the table name when the index is rebuilt.
+TRIGGER_SOURCES = [
+    ('scripts', 'script', "{row}.title", "{row}.content", "NULL", ('title', 'content')),
+    ('chat_messages', 'chat_message', "NULL", "{row}.content", "{row}.session_id", ('content',)),
+    ('fa_transcription_items', 'transcription_item', "{row}.sheet_name",
+     "coalesce({row}.message, '') || ' ' || coalesce({row}.start_ecu, '') || ' ' || coalesce({row}.end_ecu, '')"
+     " || ' ' || coalesce({row}.sending_ecu, '') || ' ' || coalesce({row}.receiving_ecu, '')",
+     "{row}.transcription_id", ('sheet_name', 'message', 'start_ecu', 'end_ecu', 'sending_ecu', 'receiving_ecu')),
+]
+
+
+def parse_query(query):
+    """Splits a search string into phrases of word tokens; returns (phrases, last phrase is a prefix).
+
+    Quoted text is one phrase, as is an identifier like parse_can_frame
+    (indexed as parse, can, frame). Unless the query ends in a space or a
+    quote, its last word is matched as a prefix, for search-as-you-type.
+    """
+    phrases = []
+    matches = list(QUERY_TERM.finditer(query or ''))
+    for match in matches:
+        tokens = [token.lower() for token in QUERY_TOKEN.findall(match.group(1) if match.group(1) is not None else match.group(2))]
+        if tokens:
+            phrases.append(tokens)
+    prefix = bool(phrases) and matches[-1].group(2) is not None and not query.endswith(' ')
+    return phrases, prefix
+
+
+def _marked_html(value):
+    """Escapes highlighted text for the browser, turning the markers into <mark> tags."""
+    return html.escape(value or '').replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+class SearchIndex:
+    """Ranked full-text search over scripts, script versions, chat messages and transcription items.
+
+    On SQLite the index is an FTS5 table ranked with bm25; on PostgreSQL it
+    is a table with a generated, weighted tsvector column under a GIN index
+    ranked with ts_rank_cd. Scripts, chat messages and transcription items
+    are kept in sync by triggers on their tables, so bulk inserts and
+    deletes are covered too. Script versions mostly store deltas, which SQL
+    cannot read, so their text is indexed from the ORM after each flush (a
+    trigger still removes deleted versions). Other databases have no search.
+    """
+
+    def __init__(self, config):
+        """Initialize the SearchIndex with application configuration."""
+        self.page_size = config.get('SEARCH_PAGE_SIZE', 20)
+        self.max_page_size = config.get('SEARCH_MAX_PAGE_SIZE', 100)
+        self.snippet_tokens = config.get('SEARCH_SNIPPET_TOKENS', 16)
+        self._ready = None
+        event.listen(Session, 'after_flush', self._index_script_versions)
+
+    def _dialect(self, bind=None):
+        return (bind or db.engine).dialect.name
+
+    def ready(self, bind=None):
+        """Whether the index exists in this database (remembered once it does, so init-db needs no restart)."""
+        if not self._ready:
+            bind = bind or db.engine
+            table = {'sqlite': SQLITE_TABLE, 'postgresql': POSTGRES_TABLE}.get(self._dialect(bind))
+            self._ready = bool(table) and inspect(bind).has_table(table)
+        return self._ready
+
+    def _sqlite_statements(self):
+        yield (f"CREATE VIRTUAL TABLE {SQLITE_TABLE} USING fts5("
+               "title, body, kind UNINDEXED, ref_id UNINDEXED, parent_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')")
+        # Title matches weigh ten times body matches
+        yield f"INSERT INTO {SQLITE_TABLE} ({SQLITE_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')"
+        for table, kind, title, body, parent, columns in TRIGGER_SOURCES:
+            slot = KINDS[kind]
+            values = (f"new.id * {KIND_SLOTS} + {slot}, {title.format(row='new')}, {body.format(row='new')}, "
+                      f"'{kind}', new.id, {parent.format(row='new')}")
+            insert = f"INSERT INTO {SQLITE_TABLE} (rowid, title, body, kind, ref_id, parent_id) VALUES ({values});"
+            remove = f"DELETE FROM {SQLITE_TABLE} WHERE rowid = old.id * {KIND_SLOTS} + {slot};"
+            yield f"CREATE TRIGGER {table}_search_insert AFTER INSERT ON {table} BEGIN {insert} END"
+            yield f"CREATE TRIGGER {table}_search_update AFTER UPDATE OF {', '.join(columns)} ON {table} BEGIN {remove} {insert} END"
+            yield f"CREATE TRIGGER {table}_search_delete AFTER DELETE ON {table} BEGIN {remove} END"
+        yield (f"CREATE TRIGGER script_versions_search_delete AFTER DELETE ON script_versions BEGIN "
+               f"DELETE FROM {SQLITE_TABLE} WHERE rowid = old.id * {KIND_SLOTS} + {KINDS['script_version']}; END")
+
+    def _postgres_statements(self):
+        # to_tsvector fails on documents over 1 MB of lexemes, so very long bodies are indexed by their start
+        yield (f"CREATE TABLE {POSTGRES_TABLE} ("
+               "doc_id BIGINT PRIMARY KEY, kind VARCHAR(32) NOT NULL, ref_id BIGINT NOT NULL, parent_id BIGINT, title TEXT, body TEXT, "
+               "tsv tsvector GENERATED ALWAYS AS (setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+               "setweight(to_tsvector('simple', left(coalesce(body, ''), 500000)), 'B')) STORED)")
+        yield f"CREATE INDEX ix_{POSTGRES_TABLE}_tsv ON {POSTGRES_TABLE} USING GIN (tsv)"
+        for table, kind, title, body, parent, columns in TRIGGER_SOURCES:
+            slot = KINDS[kind]
+            yield (f"CREATE OR REPLACE FUNCTION {table}_search_sync() RETURNS trigger AS $$ BEGIN "
+                   f"IF TG_OP = 'DELETE' THEN DELETE FROM {POSTGRES_TABLE} WHERE doc_id = OLD.id * {KIND_SLOTS} + {slot}; RETURN NULL; END IF; "
+                   f"INSERT INTO {POSTGRES_TABLE} (doc_id, title, body, kind, ref_id, parent_id) VALUES ("
+                   f"NEW.id * {KIND_SLOTS} + {slot}, {title.format(row='NEW')}, {body.format(row='NEW')}, '{kind}', NEW.id, {parent.format(row='NEW')}) "
+                   "ON CONFLICT (doc_id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body, parent_id = EXCLUDED.parent_id; "
+                   "RETURN NULL; END $$ LANGUAGE plpgsql")
+            yield f"DROP TRIGGER IF EXISTS search_sync ON {table}"
+            yield (f"CREATE TRIGGER search_sync AFTER INSERT OR UPDATE OF {', '.join(columns)} OR DELETE ON {table} "
+                   f"FOR EACH ROW EXECUTE FUNCTION {table}_search_sync()")
+        yield (f"CREATE OR REPLACE FUNCTION script_versions_search_sync() RETURNS trigger AS $$ BEGIN "
+               f"DELETE FROM {POSTGRES_TABLE} WHERE doc_id = OLD.id * {KIND_SLOTS} + {KINDS['script_version']}; RETURN NULL; END $$ LANGUAGE plpgsql")
+        yield "DROP TRIGGER IF EXISTS search_sync ON script_versions"
+        yield "CREATE TRIGGER search_sync AFTER DELETE ON script_versions FOR EACH ROW EXECUTE FUNCTION script_versions_search_sync()"
+
+    def install(self):
+        """Creates the index and its triggers if missing, filling it from existing rows; returns whether it was created."""
+        dialect = self._dialect()
+        if dialect not in ('sqlite', 'postgresql'):
+            logger.warning(f"Full-text search is not available on {dialect}; /api/search is disabled.")
+            return False
+        if self.ready():
+            return False
+        statements = self._sqlite_statements() if dialect == 'sqlite' else self._postgres_statements()
+        with db.engine.begin() as conn:
+            for statement in statements:
+                conn.exec_driver_sql(statement)
+        self._ready = True
+        logger.info(f"Created the full-text search index ({dialect}); indexing existing rows")
+        self.rebuild()
+        return True
+
+    def _table(self):
+        return SQLITE_TABLE if self._dialect() == 'sqlite' else POSTGRES_TABLE
+
+    def _key_column(self):
+        return 'rowid' if self._dialect() == 'sqlite' else 'doc_id'
+
+    def rebuild(self, batch_size=200):
+        """Re-indexes every row from scratch; returns the number of documents."""
+        table, key = self._table(), self._key_column()
+        db.session.execute(text(f"DELETE FROM {table}"))
+        for source, kind, title, body, parent, _ in TRIGGER_SOURCES:
+            db.session.execute(text(
+                f"INSERT INTO {table} ({key}, title, body, kind, ref_id, parent_id) "
+                f"SELECT {source}.id * {KIND_SLOTS} + {KINDS[kind]}, {title.format(row=source)}, {body.format(row=source)}, "
+                f"'{kind}', {source}.id, {parent.format(row=source)} FROM {source}"
+            ))
+        db.session.commit()
+
+        # Versions are read in script and version order, so each delta applies to the cached previous text
+        script_ids = list(db.session.scalars(select(Script.id).order_by(Script.id)))
+        for start in range(0, len(script_ids), batch_size):
+            versions = ScriptVersion.query.filter(ScriptVersion.script_id.in_(script_ids[start:start + batch_size])) \
+                .order_by(ScriptVersion.script_id, ScriptVersion.version).all()
+            self._write_versions(db.session.connection(), versions)
+            db.session.commit()
+            db.session.expunge_all()
+        count = db.session.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+        logger.info(f"Rebuilt the search index: {count} documents")
+        return count
+
+    def _write_versions(self, conn, versions):
+        rows = [{
+            "doc_id": version.id * KIND_SLOTS + KINDS['script_version'],
+            "title": version.changes,
+            "body": version.content,
+            "kind": 'script_version',
+            "ref_id": version.id,
+            "parent_id": version.script_id
+        } for version in versions]
+        if not rows:
+            return
+        if self._dialect(conn) == 'sqlite':
+            conn.execute(text(f"DELETE FROM {SQLITE_TABLE} WHERE rowid = :doc_id"), [{"doc_id": row["doc_id"]} for row in rows])
+            conn.execute(text(f"INSERT INTO {SQLITE_TABLE} (rowid, title, body, kind, ref_id, parent_id) "
+                              "VALUES (:doc_id, :title, :body, :kind, :ref_id, :parent_id)"), rows)
+        else:
+            conn.execute(text(f"INSERT INTO {POSTGRES_TABLE} (doc_id, title, body, kind, ref_id, parent_id) "
+                              "VALUES (:doc_id, :title, :body, :kind, :ref_id, :parent_id) "
+                              "ON CONFLICT (doc_id) DO UPDATE SET title = EXCLUDED.title, body = EXCLUDED.body"), rows)
+
+    def _index_script_versions(self, session, flush_context):
+        """after_flush: index new script versions and ones whose text or description changed."""
+        versions = []
+        for obj in list(session.new) + list(session.dirty):
+            if not isinstance(obj, ScriptVersion) or obj.id is None:
+                continue
+            state = inspect(obj)
+            # Re-storing a version as a delta (stored_content set to NULL) leaves its text unchanged
+            changed = state.attrs.changes.history.has_changes() or (
+                state.attrs.stored_content.history.has_changes() and obj.stored_content is not None)
+            if obj in session.new or changed:
+                versions.append(obj)
+        if versions and self.ready(session.connection()):
+            self._write_versions(session.connection(), versions)
+
+    def _match_query(self, query):
+        phrases, prefix = parse_query(query)
+        if not phrases:
+            raise ValueError("Query must contain at least one word")
+        if self._dialect() == 'sqlite':
+            terms = [f'"{" ".join(tokens)}"' for tokens in phrases]
+            if prefix:
+                terms[-1] += '*'
+            return ' AND '.join(terms)
+        terms = []
+        for index, tokens in enumerate(phrases):
+            if prefix and index == len(phrases) - 1:
+                tokens = tokens[:-1] + [tokens[-1] + ':*']
+            terms.append('(' + ' <-> '.join(tokens) + ')')
+        return ' & '.join(terms)
+
+    def search(self, query, kinds=None, page=1, page_size=None, all_versions=False, chat_session_id=None):
+        """One page of ranked results with highlighted titles and snippets.
+
+        Unless all_versions is set, a script contributes only its best
+        matching version, so a long history does not crowd out other hits.
+        Chat messages are private to their conversation: only those of
+        chat_session_id (a ChatSession.id) are searched, none without it.
+        """
+        kinds = [kind.strip() for kind in kinds or KINDS if kind.strip()]
+        unknown = [kind for kind in kinds if kind not in KINDS]
+        if unknown:
+            raise ValueError(f"Unknown type(s) {', '.join(unknown)}; expected: {', '.join(KINDS)}")
+        page_size = max(1, min(int(page_size or self.page_size), self.max_page_size))
+        page = max(1, int(page or 1))
+        started = time.perf_counter()
+        match = self._match_query(query)
+        params = {"match": match, "kinds": kinds, "chat_session_id": chat_session_id,
+                  "limit": page_size + 1, "offset": (page - 1) * page_size}
+        own_chat = "(kind <> 'chat_message' OR parent_id = :chat_session_id)"
+        group = "ref_id" if all_versions else "CASE WHEN kind = 'script_version' THEN parent_id ELSE ref_id END"
+
+        if self._dialect() == 'sqlite':
+            ranked = (f"SELECT rowid AS doc_id, kind, ref_id, parent_id, -rank AS score, "
+                      f"row_number() OVER (PARTITION BY kind, {group} ORDER BY rank) AS position "
+                      f"FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH :match AND kind IN :kinds AND {own_chat}")
+            highlights = (f"SELECT rowid AS doc_id, highlight({SQLITE_TABLE}, 0, :start, :end) AS title, "
+                          f"snippet({SQLITE_TABLE}, 1, :start, :end, ' … ', :tokens) AS snippet "
+                          f"FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH :match AND rowid IN :doc_ids")
+        else:
+            ranked = (f"SELECT doc_id, kind, ref_id, parent_id, ts_rank_cd(tsv, to_tsquery('simple', :match)) AS score, "
+                      f"row_number() OVER (PARTITION BY kind, {group} ORDER BY ts_rank_cd(tsv, to_tsquery('simple', :match)) DESC) AS position "
+                      f"FROM {POSTGRES_TABLE} WHERE tsv @@ to_tsquery('simple', :match) AND kind IN :kinds AND {own_chat}")
+            highlights = (f"SELECT doc_id, ts_headline('simple', coalesce(title, ''), to_tsquery('simple', :match), :title_options) AS title, "
+                          f"ts_headline('simple', coalesce(body, ''), to_tsquery('simple', :match), :snippet_options) AS snippet "
+                          f"FROM {POSTGRES_TABLE} WHERE doc_id IN :doc_ids")
+        statement = text(f"SELECT doc_id, kind, ref_id, parent_id, score FROM ({ranked}) ranked "
+                         f"WHERE position = 1 ORDER BY score DESC, doc_id LIMIT :limit OFFSET :offset")
+        rows = db.session.execute(statement.bindparams(bindparam('kinds', expanding=True)), params).all()
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        marked = {}
+        if rows:
+            statement = text(highlights).bindparams(bindparam('doc_ids', expanding=True))
+            highlight_params = {"match": match, "doc_ids": [row.doc_id for row in rows]}
+            if self._dialect() == 'sqlite':
+                highlight_params.update(start=MARK_START, end=MARK_END, tokens=self.snippet_tokens)
+            else:
+                highlight_params.update(
+                    title_options=f"StartSel={MARK_START}, StopSel={MARK_END}, HighlightAll=true",
+                    snippet_options=f"StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={self.snippet_tokens}, "
+                                    f"MinWords={max(1, self.snippet_tokens // 2)}, MaxFragments=2, FragmentDelimiter=' … '"
+                )
+            marked = {row.doc_id: row for row in db.session.execute(statement, highlight_params)}
+        details = self._details(rows)
+        results = []
+        for row in rows:
+            result = {
+                "type": row.kind,
+                "id": row.ref_id,
+                "score": round(float(row.score), 4),
+                "title": _marked_html(marked[row.doc_id].title) if row.doc_id in marked else None,
+                "snippet": _marked_html(marked[row.doc_id].snippet) if row.doc_id in marked else None
+            }
+            result.update(details.get((row.kind, row.ref_id), {}))
+            results.append(result)
+        return {
+            "query": query,
+            "results": results,
+            "page": page,
+            "page_size": page_size,
+            "has_more": has_more,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+
+    def _details(self, rows):
+        """Fields that link each result back to its record, loaded with one query per type on the page."""
+        ids = {}
+        for row in rows:
+            ids.setdefault(row.kind, []).append(row.ref_id)
+        details = {}
+        if 'script' in ids:
+            for row in db.session.execute(select(Script.id, Script.title, Script.language, Script.updated_at).where(Script.id.in_(ids['script']))):
+                details[('script', row.id)] = {"script_id": row.id, "script_title": row.title, "language": row.language,
+                                               "updated_at": row.updated_at.isoformat() if row.updated_at else None}
+        if 'script_version' in ids:
+            statement = select(ScriptVersion.id, ScriptVersion.script_id, ScriptVersion.version, ScriptVersion.created_at, Script.title) \
+                .join(Script, ScriptVersion.script_id == Script.id).where(ScriptVersion.id.in_(ids['script_version']))
+            for row in db.session.execute(statement):
+                details[('script_version', row.id)] = {"script_id": row.script_id, "script_title": row.title, "version": row.version,
+                                                       "created_at": row.created_at.isoformat() if row.created_at else None}
+        if 'chat_message' in ids:
+            statement = select(ChatMessage.id, ChatMessage.role, ChatMessage.created_at).where(ChatMessage.id.in_(ids['chat_message']))
+            for row in db.session.execute(statement):
+                details[('chat_message', row.id)] = {"role": row.role, "created_at": row.created_at.isoformat() if row.created_at else None}
+        if 'transcription_item' in ids:
+            statement = select(FATranscriptionItem.id, FATranscriptionItem.transcription_id, FATranscription.image_id,
+                               FATranscriptionItem.start_ecu, FATranscriptionItem.end_ecu) \
+                .join(FATranscription, FATranscriptionItem.transcription_id == FATranscription.id) \
+                .where(FATranscriptionItem.id.in_(ids['transcription_item']))
+            for row in db.session.execute(statement):
+                details[('transcription_item', row.id)] = {"transcription_id": row.transcription_id, "image_id": row.image_id,
+                                                           "start_ecu": row.start_ecu, "end_ecu": row.end_ecu}
+        return details
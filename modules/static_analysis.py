@@ -0,0 +1,335 @@
+import ast
+import builtins
+import logging
+import os
+import re
+import shutil
+import subprocess
+import symtable
+import sys
+import tempfile
+import time
+from modules.code_regions import splice
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    from pyflakes.checker import Checker as PyflakesChecker
+except ImportError:
+    PyflakesChecker = None
+
+LANGUAGE_ALIASES = {
+    'python': 'python', 'py': 'python',
+    'c': 'c', 'h': 'c',
+    'c++': 'c++', 'cpp': 'c++', 'cxx': 'c++', 'cc': 'c++', 'hpp': 'c++',
+    'javascript': 'javascript', 'js': 'javascript', 'node': 'javascript', 'nodejs': 'javascript',
+}
+SOURCE_SUFFIXES = {'c': '.c', 'c++': '.cpp', 'javascript': '.js'}
+# pyflakes messages that fail at run time; everything else it reports is a warning
+PYFLAKES_ERRORS = {'UndefinedName', 'UndefinedLocal', 'UndefinedExport', 'ReturnOutsideFunction',
+                   'YieldOutsideFunction', 'ContinueOutsideLoop', 'BreakOutsideLoop', 'DuplicateArgument'}
+DIAGNOSTIC_PATTERN = re.compile(r'^(?P<file>.+?):(?P<line>\d+):(?P<column>\d+): (?P<severity>fatal error|error|warning): (?P<message>.*?)(?: \[(?P<code>-W[\w=-]+)\])?$')
+FIXIT_PATTERN = re.compile(r'^fix-it:"(?P<file>.+?)":\{(?P<l1>\d+):(?P<c1>\d+)-(?P<l2>\d+):(?P<c2>\d+)\}:"(?P<text>(?:[^"\\]|\\.)*)"$')
+NODE_LOCATION_PATTERN = re.compile(r'^(?P<file>.+?):(?P<line>\d+)$')
+COMPOUND_HEADER = re.compile(r'^\s*(async\s+)?(def|class|if|elif|else|for|while|try|except|finally|with|match|case)\b')
+# Error logs that describe something a compiler or linter can find; anything else (a runtime traceback) still goes to the model
+STATIC_ERROR_LOG = re.compile(r'SyntaxError|IndentationError|TabError|NameError|is not defined|'
+                              r'undeclared|implicit declaration|expected .* before|error: expected', re.IGNORECASE)
+
+
+def normalize_language(source, language=None):
+    """'python', 'c', 'c++', 'javascript' or None for a script (the stored language wins when known)."""
+    name = (language or '').strip().lower()
+    if name:
+        return LANGUAGE_ALIASES.get(name)
+    if re.search(r'^\s*#\s*include\b', source, re.MULTILINE):
+        return 'c++' if re.search(r'\b(std::|namespace|template\s*<|class\s+\w+\s*[:{])', source) else 'c'
+    if re.search(r'^(def|class)\s+\w+.*:\s*$|^(import|from)\s+\w+', source, re.MULTILINE):
+        return 'python'
+    if re.search(r'^\s*(?:static\s+)?(?:unsigned\s+)?(?:int|void|char|long|float|double|struct\s+\w+)\s*\*?\s*\w+\s*\([^)]*\)\s*\{', source, re.MULTILINE):
+        return 'c'
+    if re.search(r'\b(function\s+\w+\s*\(|const\s+\w+\s*=|let\s+\w+\s*=|=>|require\()', source):
+        return 'javascript'
+    return None
+
+
+def _unescape_fixit(text):
+    """Fix-it replacement text is C-escaped (\\n, \\", \\\\ and octal escapes)."""
+    return re.sub(r'\\([0-7]{3}|.)', lambda m: chr(int(m.group(1), 8)) if len(m.group(1)) == 3 else
+                  {'n': '\n', 't': '\t'}.get(m.group(1), m.group(1)), text)
+
+
+def _finding(line, column, severity, code, message, tool):
+    return {"line": line, "column": column, "severity": severity, "code": code, "message": message, "tool": tool}
+
+
+class StaticAnalyzer:
+    """Local checks run before a script is sent to the model for debugging.
+
+    Python is compiled and then linted (pyflakes when installed, otherwise
+    an undefined-name check over symtable); C and C++ go through the local
+    gcc/g++ (or clang) with -fsyntax-only and JavaScript through node
+    --check, each when the tool is on PATH. Findings are dicts with line,
+    column, severity, code, message and tool. A few mechanical fixes (a
+    missing colon, a missing standard-library import, compiler fix-it
+    hints such as a missing #include) are applied locally.
+    """
+
+    def __init__(self, config):
+        """Initialize the StaticAnalyzer with application configuration."""
+        self.enabled = config.get('STATIC_ANALYSIS_ENABLED', True)
+        self.timeout = config.get('STATIC_ANALYSIS_TIMEOUT', 5)
+        self.max_fix_rounds = config.get('STATIC_ANALYSIS_MAX_FIX_ROUNDS', 5)
+        self.compilers = {
+            'c': config.get('STATIC_ANALYSIS_CC') or shutil.which('gcc') or shutil.which('clang'),
+            'c++': config.get('STATIC_ANALYSIS_CXX') or shutil.which('g++') or shutil.which('clang++'),
+            'javascript': shutil.which('node'),
+        }
+
+    def analyze(self, source, language=None):
+        """Returns {"language", "tools", "complete", "findings", "fixits", "elapsed_ms"} for a script."""
+        started = time.perf_counter()
+        kind = normalize_language(source, language)
+        report = {"language": kind, "tools": [], "complete": False, "findings": [], "fixits": []}
+        try:
+            if kind == 'python':
+                self._analyze_python(source, report)
+            elif kind in ('c', 'c++'):
+                self._analyze_c(source, kind, report)
+            elif kind == 'javascript':
+                self._analyze_javascript(source, report)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Static analysis of {kind} script failed: {e}")
+            report["complete"] = False
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return report
+
+    def _analyze_python(self, source, report):
+        report["tools"].append('compile')
+        try:
+            # A full compile, not just a parse, so 'return' outside a function and the like are caught too
+            compile(source, '<script>', 'exec', dont_inherit=True)
+        except SyntaxError as e:
+            # Only the first syntax error is known; the rest of the file is unchecked
+            report["findings"].append(_finding(e.lineno, e.offset, 'error', type(e).__name__, e.msg, 'compile'))
+            return
+        except ValueError as e:  # source contains null bytes
+            report["findings"].append(_finding(None, None, 'error', 'ValueError', str(e), 'compile'))
+            return
+
+        if PyflakesChecker:
+            report["tools"].append('pyflakes')
+            for message in sorted(PyflakesChecker(ast.parse(source), '<script>').messages, key=lambda m: (m.lineno, m.col)):
+                code = type(message).__name__
+                report["findings"].append(_finding(message.lineno, message.col + 1, 'error' if code in PYFLAKES_ERRORS else 'warning',
+                                                   code, message.message % message.message_args, 'pyflakes'))
+        else:
+            report["tools"].append('symtable')
+            report["findings"].extend(self._undefined_names(source))
+        report["complete"] = True
+
+    def _undefined_names(self, source):
+        """Names read as globals anywhere in the script that nothing defines (pyflakes' UndefinedName, roughly)."""
+        top = symtable.symtable(source, '<script>', 'exec')
+        defined = {symbol.get_name() for symbol in top.get_symbols() if symbol.is_assigned() or symbol.is_imported()
+                   or symbol.is_namespace() or symbol.is_parameter()}
+        defined |= set(dir(builtins)) | {'__file__', '__name__', '__doc__', '__builtins__', '__spec__', '__loader__', '__package__'}
+        if re.search(r'^\s*from\s+\S+\s+import\s+\*', source, re.MULTILINE):
+            return []  # star imports make any name possibly defined
+        scopes, tables = [], [top]
+        while tables:
+            table = tables.pop()
+            tables.extend(table.get_children())
+            scopes.append(table)
+            # 'global x' followed by an assignment in a function defines x too
+            defined |= {symbol.get_name() for symbol in table.get_symbols() if symbol.is_declared_global() and symbol.is_assigned()}
+        missing = {symbol.get_name() for table in scopes for symbol in table.get_symbols()
+                   if symbol.is_referenced() and (table is top or symbol.is_global()) and symbol.get_name() not in defined}
+        findings = []
+        for name in missing:
+            match = re.search(rf'(?<![\w.]){re.escape(name)}\b', source)
+            line = source.count('\n', 0, match.start()) + 1 if match else None
+            column = match.start() - source.rfind('\n', 0, match.start()) if match else None
+            findings.append(_finding(line, column, 'error', 'UndefinedName', f"undefined name '{name}'", 'symtable'))
+        return sorted(findings, key=lambda f: (f["line"] or 0, f["column"] or 0))
+
+    def _run_tool(self, kind, source, command):
+        """Writes source to a temporary file and runs command + [path]; returns (path, combined output)."""
+        with tempfile.TemporaryDirectory(prefix='tara-lint-') as directory:
+            suffix = SOURCE_SUFFIXES[kind]
+            if kind == 'javascript' and re.search(r'^\s*(import|export)\s', source, re.MULTILINE):
+                suffix = '.mjs'
+            path = os.path.join(directory, 'script' + suffix)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(source)
+            # The C locale keeps compiler messages in English with plain ASCII quotes
+            result = subprocess.run(command + [path], capture_output=True, text=True, timeout=self.timeout, cwd=directory,
+                                    env={**os.environ, 'LC_ALL': 'C'})
+            return path, result.stdout + result.stderr
+
+    def _analyze_c(self, source, kind, report):
+        compiler = self.compilers[kind]
+        if not compiler:
+            return
+        report["tools"].append(os.path.basename(compiler))
+        path, output = self._run_tool(kind, source, [compiler, '-fsyntax-only', '-Wall', '-fdiagnostics-parseable-fixits',
+                                                     '-fdiagnostics-color=never', '-fno-diagnostics-show-caret',
+                                                     '-x', 'c' if kind == 'c' else 'c++'])
+        report["complete"] = True
+        for line in output.splitlines():
+            fixit = FIXIT_PATTERN.match(line)
+            if fixit and os.path.basename(fixit.group('file')) == os.path.basename(path):
+                edit = {"start": (int(fixit.group('l1')), int(fixit.group('c1'))), "end": (int(fixit.group('l2')), int(fixit.group('c2'))),
+                        "text": _unescape_fixit(fixit.group('text'))}
+                if edit not in report["fixits"]:
+                    report["fixits"].append(edit)
+                continue
+            diagnostic = DIAGNOSTIC_PATTERN.match(line)
+            if not diagnostic or os.path.basename(diagnostic.group('file')) != os.path.basename(path):
+                continue
+            severity = diagnostic.group('severity')
+            if severity == 'fatal error':
+                # Usually a project header that is not available here: nothing after it was checked
+                report["complete"] = False
+                severity = 'error'
+            report["findings"].append(_finding(int(diagnostic.group('line')), int(diagnostic.group('column')), severity,
+                                               diagnostic.group('code') or severity, diagnostic.group('message'), report["tools"][-1]))
+
+    def _analyze_javascript(self, source, report):
+        node = self.compilers['javascript']
+        if not node:
+            return
+        report["tools"].append('node')
+        _, output = self._run_tool('javascript', source, [node, '--check'])
+        report["complete"] = True
+        lines = output.splitlines()
+        location = next((NODE_LOCATION_PATTERN.match(line) for line in lines if NODE_LOCATION_PATTERN.match(line)), None)
+        error = next((line for line in lines if re.match(r'^\w*Error: ', line)), None)
+        if error:
+            code, _, message = error.partition(': ')
+            report["findings"].append(_finding(int(location.group('line')) if location else None, None, 'error', code, message, 'node'))
+
+    def errors(self, report):
+        return [finding for finding in report["findings"] if finding["severity"] == 'error']
+
+    def _fix_python(self, source, report):
+        """One round of mechanical Python fixes; returns (source, [descriptions])."""
+        lines = source.splitlines()
+        fixes = []
+        for finding in self.errors(report):
+            line = finding["line"]
+            if finding["code"] == 'SyntaxError' and finding["message"] == "expected ':'" and line and line <= len(lines):
+                text = lines[line - 1]
+                if COMPOUND_HEADER.match(text) and '#' not in text and not text.rstrip().endswith(':'):
+                    lines[line - 1] = text.rstrip() + ':'
+                    fixes.append(f"line {line}: added the missing ':'")
+        imports = []
+        for finding in self.errors(report):
+            name = re.match(r"undefined name '(\w+)'$", finding["message"])
+            # Only a standard-library module used as one (os.path, json.dumps, ...) is certain to be a missing import
+            if name and name.group(1) in sys.stdlib_module_names and re.search(rf'(?<![\w.]){name.group(1)}\.\w', source):
+                imports.append(f"import {name.group(1)}")
+                fixes.append(f"added the missing 'import {name.group(1)}'")
+        result = '\n'.join(lines) + ('\n' if source.endswith('\n') else '')
+        if imports:
+            result = splice(result, [], [], {}, sorted(set(imports)), 'python') or result
+        return result, fixes
+
+    def _apply_fixits(self, source, report):
+        """Applies the compiler's fix-it hints (ranges are 1-based, end exclusive); returns (source, [descriptions])."""
+        lines = source.split('\n')
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1] + len(line) + 1)
+
+        def offset(position):
+            line, column = position
+            return offsets[min(line, len(lines)) - 1] + column - 1
+
+        fixes = []
+        result = source
+        applied_end = None
+        for fixit in sorted(report["fixits"], key=lambda f: (f["start"], f["end"]), reverse=True):
+            start, end = offset(fixit["start"]), offset(fixit["end"])
+            if applied_end is not None and end > applied_end:
+                continue  # overlaps a fix already applied
+            result = result[:start] + fixit["text"] + result[end:]
+            applied_end = start
+            replaced = source[start:end]
+            fixes.append(f"line {fixit['start'][0]}: " + (f"replaced '{replaced}' with '{fixit['text'].strip()}'" if replaced
+                                                          else f"inserted '{fixit['text'].strip()}'"))
+        return result, list(reversed(fixes))
+
+    def fix(self, source, language=None, report=None):
+        """Applies local fixes until none apply; returns (source, [fix descriptions], final report)."""
+        report = report or self.analyze(source, language)
+        applied = []
+        for _ in range(self.max_fix_rounds):
+            if report["language"] == 'python':
+                fixed, fixes = self._fix_python(source, report)
+            elif report["language"] in ('c', 'c++') and report["fixits"]:
+                fixed, fixes = self._apply_fixits(source, report)
+            else:
+                break
+            if not fixes or fixed == source:
+                break
+            source = fixed
+            applied.extend(fixes)
+            report = self.analyze(source, language)
+        return source, applied, report
+
+    def hints(self, report, limit=20):
+        """The findings as lines for the model's prompt ('' if there are none)."""
+        findings = report["findings"][:limit]
+        if not findings:
+            return ''
+        lines = [f"Local static analysis ({', '.join(report['tools'])}):"]
+        for finding in findings:
+            location = f"line {finding['line']}" + (f", col {finding['column']}" if finding['column'] else '') if finding['line'] else 'script'
+            lines.append(f"- {location}: {finding['severity']} [{finding['code']}] {finding['message']}")
+        if len(report["findings"]) > limit:
+            lines.append(f"- ... and {len(report['findings']) - limit} more")
+        if not report["complete"]:
+            lines.append("- (analysis stopped early; later code was not checked)")
+        return '\n'.join(lines)
+
+    def quick_debug(self, source, error_log='', language=None):
+        """Static pre-analysis for debug_script.
+
+        Returns {"result", "script", "hints", "summary"}. result is a
+        debug_script-shaped dict when local fixes resolved every error and the
+        error log (if any) describes a compile-time problem, so the model is
+        not needed. Otherwise result is None, script is the source with any
+        local fixes applied (what the model should see) and hints are the
+        remaining findings for its prompt. summary is the report returned to
+        the client (None when static analysis is disabled).
+        """
+        if not self.enabled:
+            return {"result": None, "script": source, "hints": '', "summary": None}
+        report = self.analyze(source, language)
+        fixed, applied, final = self.fix(source, language, report)
+        elapsed = report["elapsed_ms"] + (final["elapsed_ms"] if final is not report else 0)
+        logger.info(f"Static analysis ({report['language']}, {', '.join(report['tools']) or 'no tools'}): "
+                    f"{len(report['findings'])} finding(s), {len(applied)} local fix(es) in {elapsed} ms")
+        resolved = bool(applied) and final["complete"] and not self.errors(final) and (not error_log or bool(STATIC_ERROR_LOG.search(error_log)))
+        summary = {
+            "language": report["language"],
+            "tools": report["tools"],
+            "complete": report["complete"],
+            "findings": report["findings"],
+            "local_fixes": applied,
+            "remaining": final["findings"],
+            "resolved_locally": resolved,
+            "elapsed_ms": elapsed
+        }
+        if resolved:
+            analysis = "Fixed locally by static analysis, without the model:\n" + '\n'.join(f"- {fix}" for fix in applied)
+            if final["findings"]:
+                analysis += "\nRemaining warnings:\n" + '\n'.join(self.hints(final).splitlines()[1:])
+            return {"result": {"analysis": analysis, "fixed_code": fixed}, "script": fixed, "hints": '', "summary": summary}
+        hints = self.hints(final)
+        if applied:
+            hints = '\n'.join(["Already fixed locally (in the script shown):"] + [f"- {fix}" for fix in applied] + ([hints] if hints else []))
+        return {"result": None, "script": fixed, "hints": hints, "summary": summary}
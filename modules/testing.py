@@ -2,8 +2,10 @@ import logging
 import subprocess
 import tempfile
 import os
-import httpx
-from openai import OpenAI, OpenAIError
+from openai import OpenAIError
+from modules.llm_gateway import get_gateway
+from modules.llm_scheduler import PRIORITY_BATCH
+from modules.llm_hedging import parse_model_list
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,44 +16,31 @@ class TestingModule:
 
     def __init__(self, config):
         """Initialize the TestingModule with application configuration."""
-        if not config.get('OPENROUTER_API_KEY'):
-            raise ValueError("OpenRouter API key not found in configuration.")
-            
-        # Create an httpx client that doesn't trust environment proxy settings
-        httpx_client = httpx.Client(trust_env=False)
-            
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=config['OPENROUTER_API_KEY'],
-            http_client=httpx_client
-        )
+        # All modules share one pooled upstream client (raises ValueError if the API key is missing)
+        self.gateway = get_gateway(config)
         self.model = config.get('OPENROUTER_MODEL', 'meta-llama/llama-4-maverick:free')
-        self.site_url = config.get('YOUR_SITE_URL')
-        self.site_name = config.get('YOUR_SITE_NAME')
-        self.extra_headers = {}
-        if self.site_url:
-            self.extra_headers["HTTP-Referer"] = self.site_url
-        if self.site_name:
-            self.extra_headers["X-Title"] = self.site_name
+        # Tried/raced after the primary model when it is slow or failing
+        self.fallback_models = parse_model_list(config.get('TESTING_FALLBACK_MODELS'))
 
-    def _call_openrouter(self, system_prompt, user_prompt):
-        """Helper method to make calls to the OpenRouter API."""
+    def _call_openrouter(self, system_prompt, user_prompt, endpoint=None):
+        """Helper method to make calls to the OpenRouter API (endpoint names the caller for response caching)."""
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
         try:
-            logger.info(f"Calling OpenRouter model: {self.model} for testing module with headers: {self.extra_headers}")
-            completion = self.client.chat.completions.create(
-                extra_headers=self.extra_headers,
+            logger.info(f"Calling OpenRouter model: {self.model} for testing module")
+            response_content = self.gateway.complete_text(
+                messages,
+                endpoint=endpoint,
                 model=self.model,
-                messages=messages,
                 temperature=0.5, # Slightly lower temperature for tests
-                max_tokens=2048 # Adjust max tokens as needed
+                max_tokens=2048, # Adjust max tokens as needed
+                priority=PRIORITY_BATCH, # test generation yields to interactive chat
+                fallback_models=self.fallback_models
             )
-            response_content = completion.choices[0].message.content
             logger.info("OpenRouter call successful for testing module.")
-            return response_content.strip()
+            return response_content
         except OpenAIError as e:
             logger.error(f"OpenRouter API call failed in testing module: {e}")
             raise
@@ -74,7 +63,7 @@ class TestingModule:
         user_prompt = f"Script ({language}):\n```\n{script_content}\n```\n\nGenerate test cases for this script with these requirements: {requirements}"
 
         try:
-            generated_tests = self._call_openrouter(system_prompt, user_prompt)
+            generated_tests = self._call_openrouter(system_prompt, user_prompt, endpoint='testing.generate')
             # Post-processing: Ensure it looks like code, remove potential ``` markdown
             lang_lower = language.lower()
             if generated_tests.startswith(f"```{lang_lower}"):
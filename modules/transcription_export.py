@@ -0,0 +1,245 @@
+import csv
+import io
+import json
+import logging
+import re
+import zipfile
+from xml.sax.saxutils import escape
+from sqlalchemy import and_, func, or_, select
+from database import db, FATranscription, FATranscriptionItem
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# (key, header) of every exported column, in order
+COLUMNS = [
+    ("transcription_id", "Transcription ID"),
+    ("image_id", "Image ID"),
+    ("processed_at", "Processed At"),
+    ("model", "Model"),
+    ("sheet_name", "Sheet Name"),
+    ("message", "Message"),
+    ("start_ecu", "Start ECU"),
+    ("end_ecu", "End ECU"),
+    ("sending_ecu", "Sending ECU"),
+    ("receiving_ecu", "Receiving ECU"),
+    ("dashed_line", "Dashed Line"),
+]
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+XLSX_MAX_ROWS = 1048576  # Excel's sheet limit, header row included
+XLSX_MAX_CELL_CHARS = 32767
+# Characters XML 1.0 cannot carry at all
+INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Transcriptions" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+class _ChunkSink:
+    """Write-only file object that collects bytes until the generator hands them out.
+
+    It can tell() but not seek(), so zipfile writes entries with trailing
+    data descriptors and never needs to go back over bytes already sent.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class TranscriptionExporter:
+    """Streams transcription items as CSV, NDJSON or XLSX.
+
+    Items are read in keyset-paginated chunks of EXPORT_CHUNK_SIZE rows
+    (plain column tuples, no ORM objects), and each format writer yields
+    its output chunk by chunk, so memory use does not grow with the size of
+    the export. XLSX is written as a zip stream of a single inline-string
+    worksheet, which needs no spreadsheet library.
+    """
+
+    def __init__(self, config):
+        """Initialize the TranscriptionExporter with application configuration."""
+        self.chunk_size = max(1, config.get('EXPORT_CHUNK_SIZE', 1000))
+
+    def rows(self, transcription_id=None, since=None, until=None, latest_only=False):
+        """Yields a dict per item (keys as in COLUMNS), ordered by transcription then item."""
+        columns = [
+            FATranscriptionItem.id,
+            FATranscriptionItem.transcription_id,
+            FATranscription.image_id,
+            FATranscription.processed_at,
+            FATranscription.model,
+            FATranscriptionItem.sheet_name,
+            FATranscriptionItem.message,
+            FATranscriptionItem.start_ecu,
+            FATranscriptionItem.end_ecu,
+            FATranscriptionItem.sending_ecu,
+            FATranscriptionItem.receiving_ecu,
+            FATranscriptionItem.dashed_line,
+        ]
+        statement = select(*columns).join(FATranscription, FATranscriptionItem.transcription_id == FATranscription.id)
+        if transcription_id is not None:
+            statement = statement.where(FATranscriptionItem.transcription_id == transcription_id)
+        if since is not None:
+            statement = statement.where(FATranscription.processed_at >= since)
+        if until is not None:
+            statement = statement.where(FATranscription.processed_at < until)
+        if latest_only:
+            latest = select(func.max(FATranscription.id)).group_by(FATranscription.image_id)
+            statement = statement.where(FATranscription.id.in_(latest))
+
+        # Keyset pagination on (transcription, item): each chunk is an index range scan, not an OFFSET
+        last = None
+        while True:
+            page = statement
+            if last is not None:
+                page = page.where(or_(
+                    FATranscriptionItem.transcription_id > last.transcription_id,
+                    and_(FATranscriptionItem.transcription_id == last.transcription_id, FATranscriptionItem.id > last.id)
+                ))
+            chunk = db.session.execute(
+                page.order_by(FATranscriptionItem.transcription_id, FATranscriptionItem.id).limit(self.chunk_size)
+            ).all()
+            if not chunk:
+                return
+            for row in chunk:
+                yield {
+                    "transcription_id": row.transcription_id,
+                    "image_id": row.image_id,
+                    "processed_at": row.processed_at.isoformat() if row.processed_at else None,
+                    "model": row.model,
+                    "sheet_name": row.sheet_name,
+                    "message": row.message,
+                    "start_ecu": row.start_ecu,
+                    "end_ecu": row.end_ecu,
+                    "sending_ecu": row.sending_ecu,
+                    "receiving_ecu": row.receiving_ecu,
+                    "dashed_line": row.dashed_line,
+                }
+            last = chunk[-1]
+            if len(chunk) < self.chunk_size:
+                return
+
+    def stream(self, export_format, rows):
+        """Returns a generator of encoded chunks for rows in export_format."""
+        writers = {"csv": self.stream_csv, "ndjson": self.stream_ndjson, "xlsx": self.stream_xlsx}
+        return writers[export_format](rows)
+
+    def _batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def stream_csv(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # The byte-order mark makes Excel read the file as UTF-8 instead of the local code page
+        writer.writerow([header for _, header in COLUMNS])
+        yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+        for batch in self._batches(rows):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([[row[key] if row[key] is not None else '' for key, _ in COLUMNS] for row in batch])
+            yield buffer.getvalue().encode('utf-8')
+
+    def stream_ndjson(self, rows):
+        for batch in self._batches(rows):
+            yield ''.join(json.dumps(row) + '\n' for row in batch).encode('utf-8')
+
+    def _xlsx_row(self, number, values):
+        cells = []
+        for index, value in enumerate(values):
+            if value is None or value == '':
+                continue
+            reference = f"{chr(ord('A') + index)}{number}"
+            if isinstance(value, int):
+                cells.append(f'<c r="{reference}"><v>{value}</v></c>')
+            else:
+                text = INVALID_XML_CHARS.sub('', str(value))[:XLSX_MAX_CELL_CHARS]
+                cells.append(f'<c r="{reference}" t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>')
+        return f'<row r="{number}">{"".join(cells)}</row>'
+
+    def stream_xlsx(self, rows):
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, content in XLSX_STATIC_PARTS.items():
+                archive.writestr(name, content)
+            yield sink.drain()
+
+            with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+                sheet.write((
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                    + self._xlsx_row(1, [header for _, header in COLUMNS])
+                ).encode('utf-8'))
+                number = 1
+                for batch in self._batches(rows):
+                    if number + len(batch) > XLSX_MAX_ROWS:
+                        batch = batch[:XLSX_MAX_ROWS - number]
+                        logger.warning(f"XLSX export truncated at Excel's limit of {XLSX_MAX_ROWS} rows")
+                    sheet.write(''.join(
+                        self._xlsx_row(number + offset + 1, [row[key] for key, _ in COLUMNS])
+                        for offset, row in enumerate(batch)
+                    ).encode('utf-8'))
+                    number += len(batch)
+                    yield sink.drain()
+                    if number >= XLSX_MAX_ROWS:
+                        break
+                sheet.write(b'</sheetData></worksheet>')
+        yield sink.drain()
@@ -88,14 +88,17 @@ document.addEventListener('DOMContentLoaded', function() {
                     const reader = response.body.getReader();
                     const decoder = new TextDecoder();
                     let accumulatedContent = '';
-                    
+                    let buffer = '';
+
                     while (true) {
                         const { value, done } = await reader.read();
                         if (done) break;
-                        
-                        const chunk = decoder.decode(value);
-                        const lines = chunk.split('\n\n');
-                        
+
+                        // An SSE event may be split across reads; keep the incomplete tail for the next read
+                        buffer += decoder.decode(value, { stream: true });
+                        const lines = buffer.split('\n\n');
+                        buffer = lines.pop();
+
                         for (const line of lines) {
                             if (line.startsWith('data: ')) {
                                 try {
@@ -5,6 +5,38 @@ function getCsrfToken() {
     return document.querySelector('meta[name="csrf-token"]').getAttribute('content');
 }
 
+// Read an SSE code stream, passing each chunk to onChunk; resolves with the final done/error payload
+async function readCodeStream(response, onChunk) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const event of events) {
+            if (!event.startsWith('data: ')) continue;
+            const data = JSON.parse(event.slice(6));
+            if (data.chunk) {
+                onChunk(data.chunk);
+            } else if (data.done || data.error) {
+                return data;
+            }
+        }
+    }
+    return { success: false, error: 'Stream ended unexpectedly.' };
+}
+
+// True when the server answered with an SSE stream rather than JSON
+function isEventStream(response) {
+    return (response.headers.get('Content-Type') || '').includes('text/event-stream');
+}
+
 // Handle Generate Script form submission
 function handleGenerateScriptFormSubmit(form, promptInput, languageSelect, resultContainer) {
     form.addEventListener('submit', async function(e) {
@@ -38,7 +70,7 @@ function handleGenerateScriptFormSubmit(form, promptInput, languageSelect, resul
             const requestData = { requirements: prompt, language };
             console.log('Sending to /api/coding/generate:', requestData);
             
-            const response = await fetch('/api/coding/generate', { 
+            const response = await fetch('/api/coding/generate?stream=true', { 
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -47,7 +79,16 @@ function handleGenerateScriptFormSubmit(form, promptInput, languageSelect, resul
                 body: JSON.stringify(requestData)
             });
             
-            const result = await response.json(); 
+            let result;
+            if (response.ok && isEventStream(response)) {
+                // Show code in the editor as it is generated
+                codeElement.textContent = '';
+                result = await readCodeStream(response, chunk => {
+                    codeElement.textContent += chunk;
+                });
+            } else {
+                result = await response.json(); 
+            }
 
             if (response.ok && result.success) {
                 const scriptData = result.script; 
@@ -289,7 +330,7 @@ function handleModifyScriptFormSubmit(form, scriptContentInput, modificationRequ
             };
             console.log('Sending requestData to /api/coding/modify:', requestData); 
 
-            const response = await fetch('/api/coding/modify', { 
+            const response = await fetch('/api/coding/modify?stream=true', { 
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -298,7 +339,16 @@ function handleModifyScriptFormSubmit(form, scriptContentInput, modificationRequ
                 body: JSON.stringify(requestData)
             });
             
-            const result = await response.json(); 
+            let result;
+            if (response.ok && isEventStream(response)) {
+                // Show the modified code as it is produced
+                if (codeElement) codeElement.textContent = '';
+                result = await readCodeStream(response, chunk => {
+                    if (codeElement) codeElement.textContent += chunk;
+                });
+            } else {
+                result = await response.json(); 
+            }
             console.log('Modify API response:', result);
 
             if (response.ok && result.success) {